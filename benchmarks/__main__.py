@@ -0,0 +1,63 @@
+"""Run the offline benchmark suite.
+
+Usage::
+
+    python -m benchmarks [--only letsgo|bridge] [--sessions 1,10,100]
+                         [--out results.json] [--compare baseline.json]
+                         [--threshold 0.2]
+
+Everything runs against a throwaway HOME, a local Perplexity stub and a fake
+Telegram bot. With ``--compare`` the exit status is 1 if any result is worse
+than the baseline by more than ``--threshold``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from . import harness
+from .bench_letsgo import ROOT, isolate
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--only", choices=["letsgo", "bridge"])
+    parser.add_argument("--sessions", default="1,10,100")
+    parser.add_argument("--per-session", type=int, default=20)
+    parser.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--compare", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    with tempfile.TemporaryDirectory(prefix="letsgo-bench-") as home:
+        isolate(Path(home))
+        from . import bench_bridge, bench_letsgo
+
+        if args.only in (None, "letsgo"):
+            asyncio.run(bench_letsgo.run_all())
+        if args.only in (None, "bridge"):
+            levels = [int(n) for n in args.sessions.split(",") if n]
+            asyncio.run(bench_bridge.run_all(levels, args.per_session))
+    harness.save(args.out)
+    print(f"results written to {args.out}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())["results"]
+        current = json.loads(args.out.read_text())["results"]
+        regressions = harness.compare(current, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""Throughput of the bridge over HTTP, websockets and Telegram handlers."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable
+
+import httpx
+import uvicorn
+import websockets
+
+from spirits import frames
+
+from .harness import best_of_async, record
+from .stubs import FakeBot, fake_context, fake_update
+
+TOKEN = "bench"
+COMMAND = "/ping"
+WIRE_COMMAND = "/run seq 1 100000"
+
+
+async def _serve():
+    import bridge
+
+    bridge.API_TOKEN = TOKEN
+    bridge.RATE_LIMIT = 0
+    server = uvicorn.Server(
+        uvicorn.Config(bridge.app, host="127.0.0.1", port=0, log_level="warning")
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, task, port
+
+
+async def post_run(port: int, sessions: int, per_session: int) -> None:
+    url = f"http://127.0.0.1:{port}/run"
+
+    async def _client(index: int, client: httpx.AsyncClient) -> None:
+        for _ in range(per_session):
+            response = await client.post(
+                url, params={"cmd": COMMAND}, auth=(f"bench{index}", TOKEN)
+            )
+            response.raise_for_status()
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(_client(i, client) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+    record(f"post_run_{sessions}", sessions * per_session / elapsed, "req/s", "higher")
+
+
+async def websocket(port: int, sessions: int, per_session: int) -> None:
+    async def _session(index: int) -> float:
+        url = f"ws://127.0.0.1:{port}/ws?token={TOKEN}&sid=bench{index}"
+        async with websockets.connect(url, open_timeout=120) as ws:
+            # the first reply includes the session's letsgo spawn
+            await ws.send(COMMAND)
+            await ws.recv()
+            start = time.perf_counter()
+            for _ in range(per_session):
+                await ws.send(COMMAND)
+                await ws.recv()
+            elapsed = time.perf_counter() - start
+            await ws.send("__close__")
+            return elapsed
+
+    start = time.perf_counter()
+    busy = await asyncio.gather(*(_session(i) for i in range(sessions)))
+    total = time.perf_counter() - start
+    record(f"ws_{sessions}", sessions * per_session / max(busy), "msg/s", "higher")
+    record(f"ws_{sessions}_setup", total - max(busy), "s")
+
+
+async def _counting_proxy(port: int):
+    """Forward TCP connections to ``port`` and count the bytes sent back."""
+    counts = {"down": 0}
+
+    async def _pipe(reader, writer, count: bool) -> None:
+        try:
+            while data := await reader.read(65536):
+                if count:
+                    counts["down"] += len(data)
+                writer.write(data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle(client_reader, client_writer) -> None:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        await asyncio.gather(
+            _pipe(client_reader, writer, False),
+            _pipe(reader, client_writer, True),
+            return_exceptions=True,
+        )
+
+    server = await asyncio.start_server(_handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], counts
+
+
+async def _exchange(ws, framed: bool, command: str) -> float:
+    """Send ``command`` and wait for its reply; return the time to first byte."""
+    start = time.perf_counter()
+    if not framed:
+        await ws.send(command)
+        await ws.recv()
+        return time.perf_counter() - start
+    await ws.send(frames.encode(frames.COMMAND, command.encode()))
+    first = None
+    while True:
+        kind, _ = frames.decode(await ws.recv())
+        if first is None:
+            first = time.perf_counter() - start
+        if kind == frames.EXIT:
+            return first
+
+
+async def wire(port: int) -> None:
+    """Bytes on the wire and time to first byte for a large reply."""
+    server, proxy_port, counts = await _counting_proxy(port)
+    async with server:
+        for framed in (False, True):
+            for compression in (None, "deflate"):
+                name = f"ws_wire_{'v1' if framed else 'text'}_{compression or 'plain'}"
+                url = f"ws://127.0.0.1:{proxy_port}/ws?token={TOKEN}&sid={name}"
+                async with websockets.connect(
+                    url,
+                    subprotocols=[frames.SUBPROTOCOL] if framed else None,
+                    compression=compression,
+                    open_timeout=120,
+                    max_size=None,
+                ) as ws:
+                    await _exchange(ws, framed, COMMAND)
+                    before = counts["down"]
+                    start = time.perf_counter()
+                    ttfb = await _exchange(ws, framed, WIRE_COMMAND)
+                    total = time.perf_counter() - start
+                    sent = counts["down"] - before
+                    if framed:
+                        await ws.send(frames.encode(frames.CLOSE))
+                    else:
+                        await ws.send("__close__")
+                record(f"{name}_bytes", sent, "B")
+                record(f"{name}_ttfb", ttfb, "s")
+                record(f"{name}_total", total, "s")
+
+
+async def telegram(sessions: int, per_session: int) -> None:
+    import bridge
+
+    bot = FakeBot()
+
+    async def _user(user_id: int) -> None:
+        context = fake_context(bot)
+        for _ in range(per_session):
+            await bridge.handle_telegram(fake_update(bot, user_id, COMMAND), context)
+
+    await asyncio.gather(*(_user(i) for i in range(sessions)))  # warm sessions
+    start = time.perf_counter()
+    await asyncio.gather(*(_user(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    record(f"telegram_{sessions}", sessions * per_session / elapsed, "msg/s", "higher")
+    for proc in list(bridge.user_sessions.values()):
+        await proc.stop()
+    bridge.user_sessions.clear()
+
+
+async def telegram_delivery(size: int = 200_000) -> None:
+    """Bot API requests and bytes needed to deliver one large reply."""
+    import bridge
+
+    bot = FakeBot()
+    output = "\n".join(f"{i:6d} {'x' * 40}" for i in range(size // 48 + 1))[:size]
+    await bridge.send_output(bot, 1, output)
+    sent = sum(map(len, bot.sent)) + sum(map(len, bot.documents))
+    record("telegram_200k_requests", len(bot.sent) + len(bot.documents), "calls")
+    record("telegram_200k_bytes", sent, "B")
+
+
+async def persistence(users: int = 100_000, changed: int = 100) -> None:
+    """Load all users and flush a few changed ones, SQLite against pickle."""
+    from telegram.ext import PicklePersistence
+
+    from spirits.persistence import SQLitePersistence
+
+    directory = Path(tempfile.mkdtemp(prefix="letsgo-persistence-"))
+    data = {uid: {"companion_active": uid % 2 == 0} for uid in range(users)}
+    label = f"{users // 1000}k"
+
+    sqlite = SQLitePersistence(directory / "state.db")
+    start = time.perf_counter()
+    for uid, user_data in data.items():
+        await sqlite.update_user_data(uid, user_data)
+    await sqlite.flush()
+    record(f"persistence_sqlite_write_{label}", time.perf_counter() - start, "s")
+    start = time.perf_counter()
+    assert len(await sqlite.get_user_data()) == users
+    record(f"persistence_sqlite_load_{label}", time.perf_counter() - start, "s")
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            sqlite.update_user_data(uid, {"companion_active": True})
+            for uid in range(changed)
+        )
+    )
+    await sqlite.flush()
+    record(f"persistence_sqlite_flush_{label}", time.perf_counter() - start, "s")
+    sqlite.close()
+
+    pickled = PicklePersistence(filepath=directory / "state.pkl", on_flush=True)
+    for uid, user_data in data.items():
+        await pickled.update_user_data(uid, user_data)
+    await pickled.flush()
+    start = time.perf_counter()
+    loaded = PicklePersistence(filepath=directory / "state.pkl", on_flush=True)
+    assert len(await loaded.get_user_data()) == users
+    record(f"persistence_pickle_load_{label}", time.perf_counter() - start, "s")
+    start = time.perf_counter()
+    for uid in range(changed):
+        await loaded.update_user_data(uid, {"companion_active": True})
+    await loaded.flush()
+    record(f"persistence_pickle_flush_{label}", time.perf_counter() - start, "s")
+    shutil.rmtree(directory)
+
+
+async def workers(counts: Iterable[int] = (1, 2, 4), clients: int = 32) -> None:
+    """POST /run throughput of ``python bridge.py`` run with each worker count."""
+    root = Path(__file__).resolve().parents[1]
+    for count in counts:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        run_dir = Path(tempfile.mkdtemp(prefix="letsgo-workers-"))
+        env = dict(
+            os.environ,
+            LETSGO_WORKERS=str(count),
+            LETSGO_RUN_DIR=str(run_dir),
+            PORT=str(port),
+            API_TOKEN=TOKEN,
+            RATE_LIMIT_SEC="0",
+            TELEGRAM_TOKEN="",
+        )
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(root / "bridge.py"),
+            cwd=root,
+            env=env,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            async with httpx.AsyncClient(timeout=120) as client:
+                url = f"http://127.0.0.1:{port}/run"
+
+                async def _post(index: int) -> None:
+                    response = await client.post(
+                        url, params={"cmd": COMMAND}, auth=(f"w{index}", TOKEN)
+                    )
+                    response.raise_for_status()
+
+                # every worker answers before the clock starts
+                while len(list(run_dir.glob("worker-*.sock"))) < count > 1:
+                    await asyncio.sleep(0.1)
+                while True:
+                    try:
+                        await _post(0)
+                        break
+                    except httpx.TransportError:
+                        await asyncio.sleep(0.1)
+                await asyncio.gather(*(_post(i) for i in range(clients)))
+                start = time.perf_counter()
+                for _ in range(10):
+                    await asyncio.gather(*(_post(i) for i in range(clients)))
+                elapsed = time.perf_counter() - start
+            record(f"workers_{count}", clients * 10 / elapsed, "req/s", "higher")
+        finally:
+            proc.terminate()
+            await proc.wait()
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+async def agent_sessions(repeat: int = 200) -> None:
+    """/ping on a session of the bridge's own against one kept by letsgo-agent."""
+    from spirits import agent
+
+    path = Path(tempfile.mkdtemp(prefix="letsgo-agent-")) / "agent.sock"
+    local = agent.LetsGoProcess()
+    remote = agent.AgentSession("bench", path)
+    await local.start()
+    await remote.start()
+    try:
+        for name, session in (("local", local), ("agent", remote)):
+
+            async def _pings(session=session) -> None:
+                for _ in range(repeat):
+                    await session.run(COMMAND)
+
+            record(f"session_{name}_ping", await best_of_async(_pings, 3) / repeat, "s")
+    finally:
+        await local.stop()
+        await remote.stop()
+        os.kill(int(path.with_suffix(".pid").read_text()), signal.SIGTERM)
+
+
+async def uploads(port: int, size: int = 256 * 1024**2) -> None:
+    """A first upload against the same artifact sent again under a new name."""
+    import hashlib
+
+    import bridge
+
+    root = Path(tempfile.mkdtemp(prefix="letsgo-uploads-"))
+    bridge.UPLOADS = bridge.uploads.UploadStore(root)
+    data = os.urandom(1024**2) * (size // 1024**2)
+    auth = ("bench", TOKEN)
+    base = f"http://127.0.0.1:{port}"
+    label = f"{size // 1024**2}m"
+
+    async def _send(client: httpx.AsyncClient, name: str) -> None:
+        # what a client does: hash, ask, and send only if the server lacks it
+        digest = hashlib.sha256(data).hexdigest()
+        headers = {"x-sha256": digest}
+        head = await client.head(f"{base}/blobs/{digest}", auth=auth)
+        body = b"" if head.status_code == 200 else data
+        response = await client.put(
+            f"{base}/upload/{name}", content=body, headers=headers, auth=auth
+        )
+        response.raise_for_status()
+
+    try:
+        async with httpx.AsyncClient(timeout=600) as client:
+            for name in ("first", "again"):
+                start = time.perf_counter()
+                await _send(client, name)
+                record(f"upload_{label}_{name}", time.perf_counter() - start, "s")
+        inodes = {
+            info.st_ino: info.st_size
+            for info in (path.stat() for path in root.rglob("*") if path.is_file())
+        }
+        record(f"upload_{label}_disk", sum(inodes.values()), "B")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+async def run_all(levels: Iterable[int], per_session: int = 20) -> None:
+    import bridge
+
+    server, task, port = await _serve()
+    await bridge.letsgo.start()
+    try:
+        for sessions in levels:
+            await post_run(port, sessions, per_session)
+            await websocket(port, sessions, per_session)
+            await telegram(sessions, per_session)
+        await wire(port)
+        await uploads(port)
+        await telegram_delivery()
+        await persistence()
+        await workers()
+        await agent_sessions()
+    finally:
+        await bridge.letsgo.stop()
+        server.should_exit = True
+        await task
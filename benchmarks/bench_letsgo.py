@@ -0,0 +1,240 @@
+"""Benchmarks for letsgo.py and the spirits it relies on."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from .harness import best_of, best_of_async, record
+from .stubs import PerplexityStub
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+async def repl_startup(repeat: int = 5) -> None:
+    async def _start() -> None:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(ROOT / "letsgo.py"),
+            "--no-color",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        await proc.stdout.readuntil(b">> ")
+        proc.stdin.write(b"exit\n")
+        await proc.stdin.drain()
+        await proc.wait()
+
+    record("repl_startup", await best_of_async(_start, repeat), "s")
+
+
+async def run_command_throughput(count: int = 100) -> None:
+    import letsgo
+
+    start = time.perf_counter()
+    for _ in range(count):
+        await letsgo.run_command("echo hi")
+    record(
+        "run_command_small", count / (time.perf_counter() - start), "cmd/s", "higher"
+    )
+
+    lines = 200_000
+    elapsed = await best_of_async(
+        lambda: letsgo.run_command(f"seq 1 {lines}", timeout=60), 3
+    )
+    record("run_command_large", lines / elapsed, "lines/s", "higher")
+
+
+async def py_latency() -> None:
+    import letsgo
+
+    record("py_latency", await best_of_async(lambda: letsgo.handle_py("/py 1"), 5), "s")
+
+
+async def script_mode(count: int = 200) -> None:
+    """``count`` shell commands through the prompt, then as a --script batch."""
+    lines = b"".join(b"/run echo %d\n" % i for i in range(count))
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable,
+        str(ROOT / "letsgo.py"),
+        "--no-color",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    await proc.stdout.readuntil(b">> ")
+    start = time.perf_counter()
+    for line in lines.splitlines(keepends=True):
+        proc.stdin.write(line)
+        await proc.stdin.drain()
+        await proc.stdout.readuntil(b">> ")
+    record("script_prompt", count / (time.perf_counter() - start), "cmd/s", "higher")
+    proc.stdin.write(b"exit\n")
+    await proc.stdin.drain()
+    await proc.wait()
+
+    async def _batch(jobs: int, script: bytes) -> float:
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(ROOT / "letsgo.py"),
+            "--script",
+            "-",
+            "--jobs",
+            str(jobs),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        out, _ = await proc.communicate(script)
+        assert out.count(b"\n") == script.count(b"\n")
+        return time.perf_counter() - start
+
+    # the prompt was already up above, so leave out the interpreter's start
+    startup = await _batch(1, b"")
+    for jobs in (1, 8):
+        elapsed = await _batch(jobs, lines) - startup
+        record(f"script_batch_j{jobs}", count / elapsed, "cmd/s", "higher")
+
+
+def summarize_large(lines: int = 500_000) -> None:
+    import letsgo
+
+    letsgo.LOG_DIR.mkdir(parents=True, exist_ok=True)
+    path = letsgo.LOG_DIR / "bench.log"
+    with path.open("w") as fh:
+        for i in range(lines):
+            fh.write(f"2024-01-01T00:00:00 user:cmd {i} {'match' if i % 7 else ''}\n")
+    try:
+        record("summarize_large", best_of(lambda: letsgo.summarize("match"), 3), "s")
+    finally:
+        path.unlink()
+
+
+def completion_large(entries: int = 100_000) -> None:
+    """One tab-completion cycle in a directory of ``entries`` files."""
+    import tempfile
+
+    from spirits import completion
+
+    with tempfile.TemporaryDirectory(prefix="letsgo-complete-") as directory:
+        for i in range(entries):
+            open(os.path.join(directory, f"file{i:06d}"), "w").close()
+        text = f"{directory}/file0999"
+        line = f"/run cat {text}"
+
+        def _cycle(completer) -> None:
+            state = 0
+            while completer.complete(line, text, state) is not None:
+                state += 1
+
+        record(
+            "completion_100k_cold",
+            best_of(lambda: _cycle(completion.Completer(lambda: [])), 3),
+            "s",
+        )
+        warm = completion.Completer(lambda: [])
+        _cycle(warm)
+        record("completion_100k_warm", best_of(lambda: _cycle(warm), 5), "s")
+
+
+def memory_events(count: int = 2000) -> None:
+    from spirits import memory
+
+    start = time.perf_counter()
+    for i in range(count):
+        memory.log("user", f"event {i}")
+    record("memory_log", count / (time.perf_counter() - start), "events/s", "higher")
+
+
+def memory_recall(count: int = 2_000_000) -> None:
+    """/recall queries, common, rare and one-off words, over ``count`` events."""
+    import random
+    import sqlite3
+
+    from spirits import memory
+
+    words = [f"w{i}" for i in range(50_000)]
+    rng = random.Random(1)
+    with sqlite3.connect(memory.DB_PATH) as conn:
+        # the one-off word is in the oldest event, far outside RECALL_WINDOW
+        conn.execute("INSERT INTO events VALUES (-1, 'user', 'pip install needle')")
+        conn.executemany(
+            "INSERT INTO events VALUES (?, 'user', ?)",
+            (
+                (i, "pip install " + " ".join(rng.choices(words, k=8)))
+                for i in range(count)
+            ),
+        )
+    label = f"{count / 1_000_000:g}m"
+    queries = (("common", "pip install"), ("rare", "w123"), ("single", "needle"))
+    for name, query in queries:
+        record(
+            f"memory_recall_{name}_{label}",
+            best_of(lambda: memory.recall(query), 5),
+            "s",
+        )
+
+
+def johny_query() -> None:
+    import letsgo
+
+    with PerplexityStub() as stub:
+        letsgo.JOHNY.base_url = stub.url
+        letsgo.JOHNY.api_key = "bench"
+        record("johny_query", best_of(lambda: letsgo.JOHNY.query("ls fails"), 10), "s")
+
+
+async def xplaine_known_failure(entries: int = 100_000) -> None:
+    """/xplaine asking Johny about a failure, then one with the same signature."""
+    import letsgo
+
+    with letsgo.ERROR_LOG_PATH.open("a") as fh:
+        for i in range(entries):
+            fh.write(
+                f"2024-05-01T10:00:00 cat /f{i} | код возврата: 1, длительность:"
+                f" 0.01s, cpu: 0.00s | cat: /f{i}: No such file or directory\n"
+            )
+    start = time.perf_counter()
+    letsgo.ERRORS.refresh()
+    record("errors_index", entries / (time.perf_counter() - start), "lines/s", "higher")
+    with PerplexityStub() as stub:
+        letsgo.JOHNY.base_url = stub.url
+        letsgo.JOHNY.api_key = "bench"
+        for name, command in (("miss", "cat /etc/shadow"), ("hit", "cat /etc/gshadow")):
+            letsgo.LAST_FAILURE = command, f"cat: /{command[4:]}: Permission denied"
+            record(
+                f"xplaine_{name}",
+                await best_of_async(lambda: letsgo.handle_xplaine("/xplaine"), 1),
+                "s",
+            )
+        record(
+            "xplaine_hit_best",
+            await best_of_async(lambda: letsgo.handle_xplaine("/xplaine"), 100),
+            "s",
+        )
+    letsgo.LAST_FAILURE = None
+
+
+async def run_all() -> None:
+    await repl_startup()
+    await run_command_throughput()
+    await py_latency()
+    await script_mode()
+    summarize_large()
+    completion_large()
+    memory_events()
+    memory_recall()
+    johny_query()
+    await xplaine_known_failure()
+
+
+def isolate(home: Path) -> None:
+    """Point HOME and the memory DB at ``home`` before letsgo is imported."""
+    os.environ["HOME"] = str(home)
+    os.environ["LETSGO_MEMORY_DB"] = str(home / "memory.db")
+    from spirits import memory
+
+    memory.DB_PATH = home / "memory.db"
+    memory._init_db()
@@ -0,0 +1,81 @@
+"""Timing helpers, result files and baseline comparison."""
+
+from __future__ import annotations
+
+import json
+import platform
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+
+@dataclass
+class Result:
+    value: float
+    unit: str
+    better: str  # "lower" or "higher"
+
+
+RESULTS: Dict[str, Result] = {}
+
+
+def record(name: str, value: float, unit: str, better: str = "lower") -> None:
+    RESULTS[name] = Result(value, unit, better)
+    print(f"{name:45s} {value:12.4f} {unit}", flush=True)
+
+
+def best_of(func: Callable[[], object], repeat: int = 5) -> float:
+    """Return the fastest of ``repeat`` runs of ``func`` in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def best_of_async(
+    func: Callable[[], Awaitable[object]], repeat: int = 5
+) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def save(path: Path) -> None:
+    payload = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": {name: asdict(result) for name, result in RESULTS.items()},
+    }
+    path.write_text(json.dumps(payload, indent=2) + "\n")
+
+
+def compare(
+    current: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float
+) -> List[str]:
+    """Return a line for every result that regressed beyond ``threshold``."""
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        now = current.get(name)
+        if now is None or not base["value"]:
+            continue
+        ratio = now["value"] / base["value"]
+        if base["better"] == "lower":
+            worse = ratio > 1 + threshold
+        else:
+            worse = ratio < 1 - threshold
+        if worse:
+            regressions.append(
+                f"{name}: {base['value']:.4f} -> {now['value']:.4f} "
+                f"{now['unit']} ({(ratio - 1) * 100:+.1f}%)"
+            )
+    return regressions
@@ -0,0 +1,82 @@
+"""Offline stand-ins for Perplexity and the Telegram Bot API."""
+
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import List
+
+
+class _PerplexityHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:  # noqa: N802 - http.server API
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = json.dumps(
+            {
+                "choices": [
+                    {
+                        "message": {"content": "Check the command spelling."},
+                        "finish_reason": "stop",
+                    }
+                ]
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class PerplexityStub:
+    """Serve canned chat completions on a local port."""
+
+    def __init__(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _PerplexityHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/chat/completions"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "PerplexityStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeBot:
+    """Record what handlers send instead of calling Telegram."""
+
+    def __init__(self) -> None:
+        self.sent: List[str] = []
+        self.documents: List[bytes] = []
+
+    async def send_chat_action(self, chat_id: int, action: str) -> None:
+        pass
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> None:
+        self.sent.append(text)
+
+    async def send_document(self, chat_id: int, document: bytes, **kwargs) -> None:
+        self.documents.append(document)
+
+
+def fake_update(bot: FakeBot, user_id: int, text: str) -> SimpleNamespace:
+    async def reply_text(reply: str, **kwargs) -> None:
+        bot.sent.append(reply)
+
+    return SimpleNamespace(
+        message=SimpleNamespace(text=text, reply_text=reply_text),
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+    )
+
+
+def fake_context(bot: FakeBot) -> SimpleNamespace:
+    return SimpleNamespace(bot=bot, user_data={})
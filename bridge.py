@@ -1,19 +1,32 @@
 import asyncio
+import gzip
+import io
+import multiprocessing
+import multiprocessing.connection
 import os
+import signal
+import socket
 import time
+from collections import deque
+from contextlib import aclosing
+from datetime import timedelta
 from pathlib import Path
-from typing import Dict
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
 
 from fastapi import (
     Depends,
     FastAPI,
+    Header,
     HTTPException,
+    Request,
+    Response,
     UploadFile,
     File,
     WebSocket,
     WebSocketDisconnect,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from telegram import (
     Update,
@@ -25,19 +38,42 @@ from telegram import (
 )
 from telegram.ext import (
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
     MessageHandler,
-    PicklePersistence,
     filters,
 )
-from telegram.constants import ChatAction
-from letsgo import CORE_COMMANDS, build_help_message
+from telegram.constants import ChatAction, ParseMode
+from telegram.error import RetryAfter
+from letsgo import (
+    CORE_COMMANDS,
+    PROFILE_DIR,
+    build_help_message,
+    command_descriptions,
+    execution_backend,
+    looks_like_python,
+    split_tty_flag,
+)
+from spirits import (
+    agent,
+    broker,
+    frames,
+    memory,
+    profiler,
+    telemetry,
+    terminal,
+    tracing,
+    uploads,
+)
+from spirits.agent import LetsGoProcess, clean_reply
+from spirits.persistence import SQLitePersistence
 import uvicorn
+import websockets
 
-PROMPT = ">>"
+tracing.SERVICE = "bridge"
 
 MAIN_COMMANDS = [cmd for cmd in ("/status", "/time", "/help") if cmd in CORE_COMMANDS]
 
@@ -54,68 +90,226 @@ def build_main_keyboard() -> InlineKeyboardMarkup:
 
 
 RUN_COMMAND = 0
+# commands running at once across all users, and queued per user beyond that
+MAX_CONCURRENCY = int(
+    os.getenv("LETSGO_MAX_CONCURRENCY", str(max(4, os.cpu_count() or 1)))
+)
+USER_QUEUE = int(os.getenv("LETSGO_USER_QUEUE", "5"))
+# every turn costs at least this much, so that instant commands take turns too
+MIN_TURN_COST = 0.01
+# Telegram refuses messages longer than MESSAGE_LIMIT characters
+INLINE_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+SEND_ATTEMPTS = 5
+DOCUMENT_NAME = "output.txt.gz"
+HEARTBEAT_INTERVAL = float(os.getenv("LETSGO_WS_HEARTBEAT", "15"))
+# how long a disconnected websocket session waits for its client to return
+WS_GRACE = float(os.getenv("LETSGO_WS_GRACE", "60"))
+WS_SCROLLBACK = int(os.getenv("LETSGO_WS_SCROLLBACK", str(1024 * 1024)))
+# close code for a connection replaced by a newer one for the same sid
+WS_SUPERSEDED = 4000
+
+MESSAGES = telemetry.Counter(
+    "letsgo_bridge_messages_total", "Messages received by channel", ("channel",)
+)
+REPLIES = telemetry.Counter(
+    "letsgo_bridge_telegram_replies_total", "Telegram replies by form", ("form",)
+)
+SCHED_QUEUED = telemetry.Gauge(
+    "letsgo_bridge_sched_queued", "Commands waiting for a turn", ("channel",)
+)
+SCHED_RUNNING = telemetry.Gauge(
+    "letsgo_bridge_sched_running", "Commands holding a turn", ("channel",)
+)
+SCHED_DEEPEST = telemetry.Gauge(
+    "letsgo_bridge_sched_max_depth", "Longest queue of a single user", ("channel",)
+)
+SCHED_REJECTED = telemetry.Counter(
+    "letsgo_bridge_sched_rejected_total",
+    "Commands turned away because the user's queue was full",
+    ("channel",),
+)
+SCHED_WAIT_SECONDS = telemetry.Histogram(
+    "letsgo_bridge_sched_wait_seconds", "Time a command waits for its turn"
+)
+FLOOD_WAITS = telemetry.Counter(
+    "letsgo_bridge_telegram_flood_waits_total",
+    "Telegram requests retried after a flood wait",
+)
+PROXIED = telemetry.Counter(
+    "letsgo_bridge_ws_proxied_total",
+    "Websocket connections relayed to the worker owning their session",
+)
 
 
-class LetsGoProcess:
-    """Manage a persistent letsgo.py subprocess."""
+class Busy(Exception):
+    """A user already has as many commands queued as they may."""
+
+
+def _busy_message(queued: int) -> str:
+    return f"busy: {queued} commands already queued, send this again when they finish"
+
+
+class _UserQueue:
+    __slots__ = ("key", "channel", "weight", "vtime", "waiting", "running")
+
+    def __init__(self, key: str, weight: float, vtime: float) -> None:
+        self.key = key
+        self.channel = key.partition(":")[0]
+        self.weight = weight
+        self.vtime = vtime
+        self.waiting: Deque[Ticket] = deque()
+        self.running = False
+
+
+class Ticket:
+    """A command's place in the scheduler; ``async with`` it to take the turn."""
+
+    def __init__(self, scheduler: "FairScheduler", user: _UserQueue) -> None:
+        self.user = user
+        self.future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.queued = time.perf_counter()
+        self.started: float | None = None
+        self._scheduler = scheduler
+        self._done = False
+
+    async def __aenter__(self) -> None:
+        try:
+            await self.future
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        self.started = time.perf_counter()
+        SCHED_WAIT_SECONDS.observe(self.started - self.queued)
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.cancel()
+
+    def cancel(self) -> None:
+        """Give the place or the turn back; a no-op the second time."""
+        if not self._done:
+            self._done = True
+            self._scheduler._finish(self)
+
+
+class FairScheduler:
+    """Share ``concurrency`` turns between users by weighted fair queuing.
+
+    Each user runs one command at a time and may queue ``queue_size`` more;
+    ``enter`` raises ``Busy`` beyond that instead of queueing without bound.
+    A finished turn adds its duration divided by the user's weight to their
+    virtual time, and the next turn goes to the waiting user with the least,
+    so a user sending heavy commands falls behind those sending light ones.
+    A user with nothing queued is forgotten and comes back at the virtual
+    time of the last turn given, neither owed nor owing.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        queue_size: int,
+        weights: Dict[str, float] | None = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.weights = weights or {}
+        self._users: Dict[str, _UserQueue] = {}
+        self._running = 0
+        self._vclock = 0.0
+        self._channels: set[str] = set()
+
+    def depth(self, key: str) -> int:
+        user = self._users.get(key)
+        return len(user.waiting) if user else 0
+
+    def enter(self, key: str) -> Ticket:
+        """Queue a command for ``key``, e.g. ``"telegram:42"``."""
+        user = self._users.get(key)
+        if user is None:
+            weight = self.weights.get(key, 1.0)
+            user = self._users[key] = _UserQueue(key, weight, self._vclock)
+        elif len(user.waiting) >= self.queue_size:
+            SCHED_REJECTED.inc(user.channel)
+            raise Busy(_busy_message(len(user.waiting)))
+        ticket = Ticket(self, user)
+        user.waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def _finish(self, ticket: Ticket) -> None:
+        user = ticket.user
+        if ticket.future.done() and not ticket.future.cancelled():
+            user.running = False
+            self._running -= 1
+            elapsed = time.perf_counter() - (ticket.started or time.perf_counter())
+            user.vtime += max(elapsed, MIN_TURN_COST) / user.weight
+        else:
+            ticket.future.cancel()
+            if ticket in user.waiting:
+                user.waiting.remove(ticket)
+        if not user.running and not user.waiting:
+            del self._users[user.key]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency:
+            ready = [u for u in self._users.values() if u.waiting and not u.running]
+            if not ready:
+                break
+            user = min(ready, key=lambda u: (u.vtime, u.waiting[0].queued))
+            ticket = user.waiting.popleft()
+            user.running = True
+            self._running += 1
+            self._vclock = max(self._vclock, user.vtime)
+            ticket.future.set_result(None)
+        self._publish()
+
+    def _publish(self) -> None:
+        queued: Dict[str, int] = dict.fromkeys(self._channels, 0)
+        running = dict(queued)
+        deepest = dict(queued)
+        for user in self._users.values():
+            queued[user.channel] = queued.get(user.channel, 0) + len(user.waiting)
+            running[user.channel] = running.get(user.channel, 0) + user.running
+            deepest[user.channel] = max(deepest.get(user.channel, 0), len(user.waiting))
+        self._channels.update(queued)
+        for channel in queued:
+            SCHED_QUEUED.set(queued[channel], channel)
+            SCHED_RUNNING.set(running[channel], channel)
+            SCHED_DEEPEST.set(deepest[channel], channel)
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    """Parse ``LETSGO_USER_WEIGHTS``, e.g. ``telegram:42=2,ws:kiosk=0.5``."""
+    weights = {}
+    for item in spec.split(","):
+        key, _, value = item.strip().rpartition("=")
+        try:
+            weight = float(value)
+        except ValueError:
+            continue
+        if key and weight > 0:
+            weights[key] = weight
+    return weights
+
+
+SCHEDULER = FairScheduler(
+    MAX_CONCURRENCY, USER_QUEUE, _parse_weights(os.getenv("LETSGO_USER_WEIGHTS", ""))
+)
+# with LETSGO_AGENT=1 the letsgo sessions are kept by letsgo-agent (see
+# spirits.agent), started on first use, and outlive restarts of the bridge
+USE_AGENT = os.getenv("LETSGO_AGENT", "0").lower() in {"1", "true", "yes", "on"}
+Session = LetsGoProcess | agent.AgentSession
 
-    def __init__(self) -> None:
-        self.proc: asyncio.subprocess.Process | None = None
-        self._lock = asyncio.Lock()
 
-    async def start(self) -> None:
-        self.proc = await asyncio.create_subprocess_exec(
-            "python",
-            "letsgo.py",
-            "--no-color",
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-        )
-        await self._read_until_prompt()
+def _session(key: str) -> Session:
+    """Return the letsgo session for ``key``, kept here or by the agent."""
+    return agent.AgentSession(key) if USE_AGENT else LetsGoProcess()
 
-    async def _read_until_prompt(self) -> None:
-        if not self.proc or not self.proc.stdout:
-            return
-        prompt_bytes = (PROMPT + " ").encode()
-        buffer = b""
-        while not buffer.endswith(prompt_bytes):
-            chunk = await self.proc.stdout.read(1)
-            if not chunk:
-                break
-            buffer += chunk
 
-    async def run(self, cmd: str) -> str:
-        if not self.proc or not self.proc.stdin or not self.proc.stdout:
-            raise RuntimeError("process not started")
-        async with self._lock:
-            self.proc.stdin.write((cmd + "\n").encode())
-            await self.proc.stdin.drain()
-            prompt_bytes = (PROMPT + " ").encode()
-            buffer = b""
-            while not buffer.endswith(prompt_bytes):
-                chunk = await self.proc.stdout.read(1)
-                if not chunk:
-                    break
-                buffer += chunk
-            text = buffer.decode()
-            if text.endswith(PROMPT + " "):
-                text = text[: -len(PROMPT) - 1]
-            if text.startswith(PROMPT + " "):
-                text = text[len(PROMPT) + 1 :]
-            return text.strip()
-
-    async def stop(self) -> None:
-        if self.proc and self.proc.stdin:
-            self.proc.stdin.close()
-        if self.proc:
-            self.proc.terminate()
-            await self.proc.wait()
-            self.proc = None
-
-
-letsgo = LetsGoProcess()
-sessions: Dict[str, LetsGoProcess] = {}
-user_sessions: Dict[int, LetsGoProcess] = {}
+letsgo = _session("http")
+sessions: Dict[str, "WebSession"] = {}
+user_sessions: Dict[int, Session] = {}
 _user_last_active: Dict[int, float] = {}
 SESSION_TIMEOUT = float(os.getenv("USER_SESSION_TIMEOUT", "300"))
 app = FastAPI()
@@ -130,10 +324,20 @@ security = HTTPBasic()
 API_TOKEN = os.getenv("API_TOKEN", "change-me")
 RATE_LIMIT = float(os.getenv("RATE_LIMIT_SEC", "1"))
 _last_call: Dict[str, float] = {}
+# bridge processes accepting on PORT; with more than one, session owners
+# and rate limits are kept by a broker in RUN_DIR
+WORKERS = int(os.getenv("LETSGO_WORKERS", "1"))
+RUN_DIR = Path(os.getenv("LETSGO_RUN_DIR", str(Path.home() / ".letsgo" / "run")))
+BROKER: broker.Broker | None = None
 UPLOAD_DIR = "/arianna_core/upload"
+UPLOADS = uploads.UploadStore(UPLOAD_DIR)
+# seconds between sweeps for upload blobs that no name refers to
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "3600"))
 
 
 HISTORY_ROOT = Path.home() / ".letsgo"
+# a history file past this size is cut to the newest half of it
+HISTORY_BYTES = int(os.getenv("LETSGO_HISTORY_BYTES", str(64 * 1024)))
 
 
 def _history_path(user_id: int) -> Path:
@@ -145,6 +349,19 @@ def _append_history(user_id: int, cmd: str) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("a", encoding="utf-8") as fh:
         fh.write(cmd + "\n")
+        size = fh.tell()
+    if size > HISTORY_BYTES:
+        _trim_history(path)
+
+
+def _trim_history(path: Path) -> None:
+    data = path.read_bytes()
+    keep = data[-(HISTORY_BYTES // 2) :]
+    if len(keep) < len(data):
+        keep = keep.partition(b"\n")[2]
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(keep)
+    os.replace(tmp, path)
 
 
 def _read_history(user_id: int) -> list[str]:
@@ -156,18 +373,24 @@ def _read_history(user_id: int) -> list[str]:
         return []
 
 
-def _check_rate(client: str) -> None:
-    now = time.time()
-    if now - _last_call.get(client, 0) < RATE_LIMIT:
+async def _check_rate(client: str) -> None:
+    if BROKER is not None:
+        allowed = await asyncio.to_thread(BROKER.allow, client, RATE_LIMIT)
+    else:
+        now = time.time()
+        allowed = now - _last_call.get(client, 0) >= RATE_LIMIT
+        if allowed:
+            _last_call[client] = now
+    if not allowed:
         raise HTTPException(status_code=429, detail="rate limit exceeded")
-    _last_call[client] = now
 
 
-async def _get_user_proc(user_id: int) -> LetsGoProcess:
+async def _get_user_proc(user_id: int) -> Session:
     proc = user_sessions.get(user_id)
     if not proc:
-        proc = LetsGoProcess()
-        await proc.start()
+        proc = _session(f"tg:{user_id}")
+        with tracing.span("bridge.session", user=user_id):
+            await proc.start()
         user_sessions[user_id] = proc
     _user_last_active[user_id] = time.time()
     return proc
@@ -194,74 +417,620 @@ async def cleanup_user_sessions() -> None:
 
 @app.post("/run")
 async def run_command(
-    cmd: str, credentials: HTTPBasicCredentials = Depends(security)
+    cmd: str,
+    response: Response,
+    credentials: HTTPBasicCredentials = Depends(security),
+    traceparent: str | None = Header(None),
 ) -> Dict[str, str]:
     if credentials.password != API_TOKEN:
         raise HTTPException(status_code=401, detail="unauthorized")
-    _check_rate(credentials.username)
-    output = await letsgo.run(cmd)
+    await _check_rate(credentials.username)
+    MESSAGES.inc("http")
+    with tracing.span(
+        "http.run", tracing.parse(traceparent), user=credentials.username
+    ):
+        header = tracing.traceparent()
+        if header:
+            response.headers["traceparent"] = header
+        try:
+            ticket = SCHEDULER.enter(f"http:{credentials.username}")
+        except Busy as exc:
+            raise HTTPException(status_code=429, detail=str(exc))
+        async with ticket:
+            output = await letsgo.run(cmd)
     return {"output": output}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics(credentials: HTTPBasicCredentials = Depends(security)) -> str:
+    if credentials.password != API_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    return PlainTextResponse(
+        await asyncio.to_thread(telemetry.collect),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+BRIDGE_PROFILER = profiler.Sampler()
+
+
+@app.post("/profile")
+async def profile(
+    action: str, credentials: HTTPBasicCredentials = Depends(security)
+) -> Dict[str, str]:
+    if credentials.password != API_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    if action not in {"start", "stop", "dump"}:
+        raise HTTPException(status_code=400, detail="action must be start|stop|dump")
+    reply = await asyncio.to_thread(
+        profiler.control, BRIDGE_PROFILER, action, PROFILE_DIR, "bridge"
+    )
+    return {"output": reply}
+
+
+def _pty_command(cmd: str) -> str | None:
+    """Return the shell command if a websocket line should run on a PTY."""
+    if cmd.split()[:1] == ["/run"]:
+        command, requested = split_tty_flag(cmd.partition(" ")[2].strip())
+    elif cmd.startswith("/") or looks_like_python(cmd):
+        return None
+    else:
+        command, requested = cmd, False
+    return command if requested or terminal.is_tui(command) else None
+
+
+def _parse_size(message: str) -> Tuple[int, int] | None:
+    try:
+        rows, cols = (int(part) for part in message.split()[1:3])
+    except ValueError:
+        return None
+    return (rows, cols) if rows > 0 and cols > 0 else None
+
+
+Event = Tuple[int, Any]
+
+
+class _TextChannel:
+    """The original protocol: a text frame per reply and ``__name__`` sentinels.
+
+    PTY output goes out as binary frames, and while a program runs on the PTY
+    every frame from the client is a keystroke.
+    """
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self.websocket = websocket
+        self.raw = False
+        self._reply = bytearray()
+
+    async def receive(self) -> Event | None:
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        text = message.get("text")
+        if text is None:
+            return frames.INPUT, message.get("bytes") or b""
+        if text == "__close__":
+            return frames.CLOSE, None
+        if text.startswith("__resize__"):
+            size = _parse_size(text)
+            return (frames.RESIZE, size) if size else None
+        if self.raw:
+            return frames.INPUT, text.encode()
+        return frames.COMMAND, text
+
+    async def send(self, kind: int, payload: bytes) -> None:
+        if kind == frames.PTY:
+            self.raw = True
+        elif kind == frames.OUTPUT:
+            if self.raw:
+                await self.websocket.send_bytes(payload)
+            else:
+                self._reply += payload
+        elif self.raw:
+            self.raw = False
+            rc = frames.exit_status(payload)
+            await self.websocket.send_text(f"__pty_exit__ {rc}")
+        else:
+            reply, self._reply = bytes(self._reply), bytearray()
+            await self.websocket.send_text(clean_reply(reply))
+
+    async def resume(
+        self, first: int, next_seq: int, raw: bool, backlog: List[bytes]
+    ) -> None:
+        # no sequence numbers here: the client just carries on from now
+        self.raw = raw
+
+    async def heartbeat(self) -> None:
+        pass
+
+
+class _FramedChannel:
+    """The binary protocol described in ``spirits.frames``."""
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self.websocket = websocket
+        # heartbeats and replies are sent from different tasks
+        self._lock = asyncio.Lock()
+
+    async def receive(self) -> Event | None:
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        data = message.get("bytes")
+        if data is None:
+            return None
+        try:
+            kind, payload = frames.decode(data)
+            if kind == frames.RESIZE:
+                return kind, frames.size(payload)
+        except frames.FrameError:
+            return None
+        if kind == frames.COMMAND:
+            return kind, payload.decode(errors="replace")
+        return kind, payload
+
+    async def send(self, kind: int, payload: bytes) -> None:
+        async with self._lock:
+            await self.websocket.send_bytes(frames.encode(kind, payload))
+
+    async def resume(
+        self, first: int, next_seq: int, raw: bool, backlog: List[bytes]
+    ) -> None:
+        async with self._lock:
+            await self.websocket.send_bytes(frames.resumed_frame(first, next_seq, raw))
+            for frame in backlog:
+                await self.websocket.send_bytes(frame)
+
+    async def heartbeat(self) -> None:
+        async with self._lock:
+            await self.websocket.send_bytes(frames.heartbeat_frame(time.time()))
+
+
+Channel = _TextChannel | _FramedChannel
+
+
+class WebSession:
+    """The letsgo session behind a terminal tab, kept across reconnects.
+
+    Every frame the session sends is numbered and kept in a byte-capped
+    ``frames.Scrollback`` so that a client coming back within ``WS_GRACE``
+    seconds replays what it missed. After that the process is stopped.
+    """
+
+    def __init__(self, sid: str, proc: Session) -> None:
+        self.sid = sid
+        self.proc = proc
+        self.channel: Channel | None = None
+        self.scrollback = frames.Scrollback(WS_SCROLLBACK)
+        self.pending: asyncio.Queue[Tuple[str, str | None, Ticket | Busy | None]] = (
+            asyncio.Queue()
+        )
+        self.size = (24, 80)
+        self.term: terminal.PtyProcess | None = None
+        self._pty_seq: int | None = None
+        self._executor = asyncio.create_task(self._execute())
+        self._expiry: asyncio.Task | None = None
+
+    @property
+    def alive(self) -> bool:
+        return not self._executor.done()
+
+    async def _send(self, kind: int, payload: bytes = b"") -> None:
+        seq = self.scrollback.append(frames.encode(kind, payload))
+        if kind == frames.PTY:
+            self._pty_seq = seq
+        elif kind == frames.EXIT:
+            self._pty_seq = None
+        channel = self.channel
+        if channel is None:
+            return
+        try:
+            await channel.send(kind, payload)
+        except Exception:  # noqa: BLE001 - the reader sees the disconnect
+            pass
+
+    async def _run_pty(self, command: str) -> None:
+        slot = execution_backend().open(0)
+        started = time.perf_counter()
+        rc = 1
+        with tracing.span("websocket.pty", sid=self.sid) as attrs:
+            term = self.term = await terminal.PtyProcess.spawn(
+                command, *self.size, slot=slot
+            )
+            try:
+                await self._send(frames.PTY)
+                while chunk := await term.read():
+                    await self._send(frames.OUTPUT, chunk)
+                rc = attrs["rc"] = await term.wait()
+            except BaseException:
+                await term.terminate()
+                raise
+            finally:
+                term.close()
+                self.term = None
+                usage = slot.close()
+                duration = time.perf_counter() - started
+                memory.log_command(f"ws-{self.sid}", command, rc, duration, usage)
+        await self._send(frames.EXIT, frames.exit_payload(rc))
+
+    def submit(self, cmd: str) -> None:
+        """Queue ``cmd`` behind the session's earlier commands.
+
+        Its turn comes from ``SCHEDULER``, except for programs on a PTY:
+        those are interactive and would hold a turn for as long as they are
+        open. A full queue is answered in order, without running anything.
+        """
+        command = _pty_command(cmd)
+        place: Ticket | Busy | None = None
+        if command is None:
+            try:
+                place = SCHEDULER.enter(f"ws:{self.sid}")
+            except Busy as exc:
+                place = exc
+        self.pending.put_nowait((cmd, command, place))
+
+    async def _execute(self) -> None:
+        while True:
+            cmd, command, place = await self.pending.get()
+            if command is not None:
+                await self._run_pty(command)
+            elif isinstance(place, Busy):
+                await self._send(frames.OUTPUT, f"{place}\n".encode())
+                await self._send(frames.EXIT, frames.exit_payload(1))
+            else:
+                async with place, aclosing(self.proc.stream(cmd)) as chunks:
+                    with tracing.span("websocket.command", sid=self.sid):
+                        async for chunk in chunks:
+                            await self._send(frames.OUTPUT, chunk)
+                    await self._send(
+                        frames.EXIT, frames.exit_payload(self.proc.last_rc)
+                    )
+
+    def resize(self, size: Tuple[int, int]) -> None:
+        self.size = size
+        if self.term is not None:
+            self.term.resize(*size)
+
+    def write(self, data: bytes) -> None:
+        if self.term is not None:
+            self.term.write(data)
+
+    async def attach(self, channel: Channel, resume: int | None) -> None:
+        """Make ``channel`` the client, replaying frames from ``resume`` on."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        old, self.channel = self.channel, channel
+        first, backlog = self.scrollback.since(
+            self.scrollback.next if resume is None else resume
+        )
+        raw = self._pty_seq is not None and self._pty_seq < first
+        # resume() takes the channel's send lock before its first await, so
+        # nothing the executor sends can overtake the backlog
+        await channel.resume(first, self.scrollback.next, raw, backlog)
+        if old is not None:
+            try:
+                await old.websocket.close(code=WS_SUPERSEDED)
+            except Exception:  # noqa: BLE001 - it may be gone already
+                pass
+
+    def detach(self, channel: Channel) -> None:
+        """Forget ``channel`` and stop the session unless a client returns."""
+        if self.channel is not channel:
+            return
+        self.channel = None
+        self._expiry = asyncio.create_task(self._expire())
+
+    async def _expire(self) -> None:
+        await asyncio.sleep(WS_GRACE)
+        self._expiry = None
+        await self.close()
+
+    async def close(self) -> None:
+        if sessions.get(self.sid) is self:
+            del sessions[self.sid]
+            if BROKER is not None:
+                await asyncio.to_thread(BROKER.release, f"ws:{self.sid}")
+        self._executor.cancel()
+        await asyncio.gather(self._executor, return_exceptions=True)
+        while not self.pending.empty():
+            _, _, place = self.pending.get_nowait()
+            if isinstance(place, Ticket):
+                place.cancel()
+        await self.proc.stop()
+
+
+def _resume_seq(value: str | None) -> int | None:
+    try:
+        return max(int(value), 0) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def _proxy_websocket(websocket: WebSocket, address: str) -> bool:
+    """Relay ``websocket`` to the worker listening on the Unix socket ``address``.
+
+    Returns False, without accepting the connection, if that worker can't be
+    reached.
+    """
+    offered = websocket.scope.get("subprotocols", [])
+    try:
+        upstream = await websockets.unix_connect(
+            address,
+            f"ws://worker{websocket.url.path}?{websocket.url.query}",
+            subprotocols=offered or None,
+            compression=None,
+            max_size=None,
+            ping_interval=None,
+        )
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+        return False
+    PROXIED.inc()
+    async with upstream:
+        await websocket.accept(subprotocol=upstream.subprotocol)
+
+        async def _down() -> None:
+            async for message in upstream:
+                if isinstance(message, bytes):
+                    await websocket.send_bytes(message)
+                else:
+                    await websocket.send_text(message)
+
+        async def _up() -> None:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes") is not None:
+                    await upstream.send(message["bytes"])
+                elif message.get("text") is not None:
+                    await upstream.send(message["text"])
+
+        down = asyncio.create_task(_down())
+        up = asyncio.create_task(_up())
+        try:
+            await asyncio.wait({down, up}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            down.cancel()
+            up.cancel()
+            await asyncio.gather(down, up, return_exceptions=True)
+        if not up.done() or up.cancelled():
+            # the owner hung up first; pass its close code on
+            try:
+                await websocket.close(code=upstream.close_code or 1000)
+            except Exception:  # noqa: BLE001 - the client may be gone too
+                pass
+    return True
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket) -> None:
+    """Run commands for one terminal tab.
+
+    Clients offering the ``letsgo.v1`` subprotocol get the binary framing of
+    ``spirits.frames``; others keep the text protocol of ``_TextChannel``.
+    Commands that need a terminal run on a PTY owned by the bridge. The
+    session outlives the connection, see ``WebSession``.
+    """
     token = websocket.query_params.get("token")
     sid = websocket.query_params.get("sid")
     if token != API_TOKEN or not sid:
         await websocket.close(code=1008)
         return
-    proc = sessions.get(sid)
-    if not proc:
-        proc = LetsGoProcess()
+    if BROKER is not None and sid not in sessions:
+        # the session may belong to another worker; connect the client to it
+        owner = await asyncio.to_thread(BROKER.claim, f"ws:{sid}")
+        if owner != BROKER.address:
+            if await _proxy_websocket(websocket, owner):
+                return
+            await asyncio.to_thread(BROKER.claim, f"ws:{sid}", owner)
+    session = sessions.get(sid)
+    if session is None or not session.alive:
+        if session is not None:
+            await session.close()
+        proc = _session(f"ws:{sid}")
         await proc.start()
-        sessions[sid] = proc
-    await websocket.accept()
-    try:
+        session = sessions[sid] = WebSession(sid, proc)
+    framed = frames.SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=frames.SUBPROTOCOL if framed else None)
+    channel: Channel = _FramedChannel(websocket) if framed else _TextChannel(websocket)
+    resume = _resume_seq(websocket.query_params.get("resume")) if framed else None
+    await session.attach(channel, resume)
+    last_seen = time.monotonic()
+
+    async def _heartbeat() -> None:
         while True:
-            cmd = await websocket.receive_text()
-            if cmd == "__close__":
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if time.monotonic() - last_seen > 3 * HEARTBEAT_INTERVAL:
+                await websocket.close(code=1001)
+                return
+            await channel.heartbeat()
+
+    # keep reading while a command runs so that a close kills it at once
+    heartbeat = asyncio.create_task(_heartbeat()) if framed else None
+    closed = False
+    try:
+        while session.alive and not (heartbeat and heartbeat.done()):
+            event = await channel.receive()
+            last_seen = time.monotonic()
+            if event is None:
+                continue
+            kind, payload = event
+            if kind == frames.CLOSE:
+                closed = True
                 break
-            output = await proc.run(cmd)
-            await websocket.send_text(output)
+            if kind == frames.RESIZE:
+                session.resize(payload)
+            elif kind == frames.INPUT:
+                session.write(payload)
+            elif kind == frames.COMMAND:
+                MESSAGES.inc("websocket")
+                session.submit(payload)
     except WebSocketDisconnect:
         pass
     finally:
-        await proc.stop()
-        sessions.pop(sid, None)
+        # nothing is awaited before detach: the handler may be cancelled
+        if heartbeat is not None:
+            heartbeat.cancel()
+        if session.channel is channel and (closed or not session.alive):
+            # on a task of its own so that cancelling the handler can't stop it
+            await asyncio.shield(session.close())
+        else:
+            session.detach(channel)
+
+
+async def _upload(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a store operation off the loop, answering 400 to what it refuses."""
+    try:
+        return await asyncio.to_thread(func, *args)
+    except uploads.UploadError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+async def _receive_upload(
+    receive: Callable[[], Awaitable[bytes | None]], name: str, sha256: str | None
+) -> Tuple[str, bool]:
+    """Store the chunks ``receive`` returns until ``None`` under ``name``."""
+    writer = await asyncio.to_thread(UPLOADS.writer)
+    with writer:
+        pending = bytearray()
+        while True:
+            data = await receive()
+            if data:
+                pending += data
+            # written in large pieces, each one a trip to a thread
+            if pending and (data is None or len(pending) >= uploads.CHUNK):
+                await asyncio.to_thread(writer.write, bytes(pending))
+                pending.clear()
+            if data is None:
+                return await asyncio.to_thread(writer.commit, name, sha256)
+
+
+async def _link_known(sha256: str | None, name: str) -> bool:
+    """Name the blob ``sha256`` if it is stored, sparing the client the upload."""
+    if sha256 is None or await _upload(UPLOADS.size, sha256) is None:
+        return False
+    try:
+        await _upload(UPLOADS.link, sha256, name)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@app.head("/blobs/{digest}")
+async def blob_exists(
+    digest: str, credentials: HTTPBasicCredentials = Depends(security)
+) -> Response:
+    """200 with the size if a blob with this SHA-256 is stored, else 404."""
+    if credentials.password != API_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    size = await _upload(UPLOADS.size, digest)
+    if size is None:
+        raise HTTPException(status_code=404, detail="blob not stored")
+    return Response(headers={"content-length": str(size)})
 
 
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
+    sha256: str | None = None,
     credentials: HTTPBasicCredentials = Depends(security),
-) -> Dict[str, str]:
+) -> Dict[str, Any]:
+    if credentials.password != API_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    await _check_rate(credentials.username)
+    name = file.filename or ""
+    digest, new = await _upload(UPLOADS.add, file.file, name, sha256)
+    return {"filename": name, "sha256": digest, "stored": new}
+
+
+@app.put("/upload/{name}")
+async def upload_stream(
+    name: str,
+    request: Request,
+    x_sha256: str | None = Header(None),
+    credentials: HTTPBasicCredentials = Depends(security),
+) -> Dict[str, Any]:
+    """Store the request body as it arrives, without spooling it first.
+
+    With an ``X-Sha256`` header naming a stored blob the body is not read:
+    the name is linked to the blob, so a client that found it with
+    ``HEAD /blobs/<sha256>`` can send an empty body.
+    """
     if credentials.password != API_TOKEN:
         raise HTTPException(status_code=401, detail="unauthorized")
-    _check_rate(credentials.username)
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    dest = os.path.join(UPLOAD_DIR, file.filename)
-    with open(dest, "wb") as fh:
-        fh.write(await file.read())
-    return {"filename": file.filename}
+    await _check_rate(credentials.username)
+    await _upload(uploads.safe_name, name)
+    if await _link_known(x_sha256, name):
+        return {"filename": name, "sha256": x_sha256, "stored": False}
+    chunks = request.stream()
+
+    async def _receive() -> bytes | None:
+        return await anext(chunks, None)
+
+    try:
+        digest, new = await _receive_upload(_receive, name, x_sha256)
+    except uploads.UploadError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"filename": name, "sha256": digest, "stored": new}
 
 
 @app.websocket("/upload")
 async def upload_ws(websocket: WebSocket) -> None:
+    """Store the binary messages sent until an empty one or a disconnect.
+
+    After an empty message the server replies with the filename, digest
+    and whether the blob was new. With ``sha256`` in the query the upload
+    is dropped unless it arrived whole, and a stored blob is linked at once:
+    the server then replies and closes before any data is sent.
+    """
     token = websocket.query_params.get("token")
     name = websocket.query_params.get("name")
+    sha256 = websocket.query_params.get("sha256")
     if token != API_TOKEN or not name:
         await websocket.close(code=1008)
         return
+    try:
+        uploads.safe_name(name)
+        known = await _link_known(sha256, name)
+    except (uploads.UploadError, HTTPException):
+        await websocket.close(code=1008)
+        return
     await websocket.accept()
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    path = os.path.join(UPLOAD_DIR, name)
+    if known:
+        await websocket.send_json({"filename": name, "sha256": sha256, "stored": False})
+        await websocket.close()
+        return
+    ended = False
+
+    async def _receive() -> bytes | None:
+        nonlocal ended
+        try:
+            data = await websocket.receive_bytes()
+        except WebSocketDisconnect:
+            return None
+        ended = not data
+        return data or None
+
     try:
-        with open(path, "wb") as fh:
-            while True:
-                data = await websocket.receive_bytes()
-                fh.write(data)
-    except WebSocketDisconnect:
-        pass
+        digest, new = await _receive_upload(_receive, name, sha256)
+    except uploads.UploadError:
+        if ended:
+            await websocket.close(code=1008)
+        return
+    if ended:
+        await websocket.send_json({"filename": name, "sha256": digest, "stored": new})
+        await websocket.close()
+
+
+async def collect_uploads(interval: float = UPLOAD_GC_INTERVAL) -> None:
+    """Remove upload blobs whose names were all deleted."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(UPLOADS.collect)
+        except OSError:
+            pass
 
 
 async def handle_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -269,19 +1038,38 @@ async def handle_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     if not cmd or not user:
         return
-    history = context.user_data.setdefault("history", [])
-    history.append(cmd)
+    MESSAGES.inc("telegram")
+    base = cmd.split()[0]
+    with tracing.span("telegram.message", user=user.id, command=base):
+        await _reply_to_command(update, context, cmd, user.id)
+
+
+async def _run_for_user(bot: Any, chat_id: int, user_id: int, cmd: str) -> str:
+    """Run ``cmd`` in the user's session once the scheduler gives it a turn.
+
+    Raises ``Busy`` at once if the user already has a full queue.
+    """
+    async with SCHEDULER.enter(f"telegram:{user_id}"):
+        proc = await _get_user_proc(user_id)
+        with tracing.span("telegram.typing"):
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        return await proc.run(cmd)
+
+
+async def _reply_to_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, cmd: str, user_id: int
+) -> None:
     try:
-        proc = await _get_user_proc(user.id)
-        await context.bot.send_chat_action(
-            chat_id=update.effective_chat.id,
-            action=ChatAction.TYPING,
+        output = await _run_for_user(
+            context.bot, update.effective_chat.id, user_id, cmd
         )
-        output = await proc.run(cmd)
         if cmd.split()[0] != "/history":
-            _append_history(user.id, cmd)
+            _append_history(user_id, cmd)
+    except Busy as exc:
+        await send_output(context.bot, update.effective_chat.id, str(exc))
+        return
     except Exception as exc:  # noqa: BLE001 - send error to user
-        await update.message.reply_text(f"Error: {exc}")
+        await send_output(context.bot, update.effective_chat.id, f"Error: {exc}")
         return
     if not output:
         return
@@ -290,19 +1078,81 @@ async def handle_telegram(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data["companion_active"] = True
     elif base == "/xplaineoff":
         context.user_data["companion_active"] = False
-    if base in MAIN_COMMANDS:
-        await update.message.reply_text(output, reply_markup=build_main_keyboard())
+    markup = build_main_keyboard() if base in MAIN_COMMANDS else None
+    with tracing.span("telegram.reply", chars=len(output)) as attrs:
+        attrs["form"] = await send_output(
+            context.bot, update.effective_chat.id, output, markup
+        )
+
+
+def _code_block(text: str) -> str:
+    # inside a MarkdownV2 code block only backslashes and backticks are special
+    body = text.replace("\\", "\\\\").replace("`", "\\`")
+    return f"```\n{body}\n```"
+
+
+def _flood_delay(retry_after: int | timedelta) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def _call_bot(method: Callable[..., Awaitable[Any]], **kwargs: Any) -> Any:
+    """Call a Bot API method, sleeping through flood-wait errors."""
+    for attempt in range(1, SEND_ATTEMPTS + 1):
+        try:
+            return await method(**kwargs)
+        except RetryAfter as exc:
+            if attempt == SEND_ATTEMPTS:
+                raise
+            FLOOD_WAITS.inc()
+            await asyncio.sleep(_flood_delay(exc.retry_after))
+
+
+async def send_output(
+    bot: Any,
+    chat_id: int,
+    output: str,
+    reply_markup: InlineKeyboardMarkup | None = None,
+) -> str | None:
+    """Send ``output`` to ``chat_id`` in a form that suits its size.
+
+    Up to ``INLINE_LIMIT`` characters go out as plain text and output that
+    fits one message as a code block. Anything longer is uploaded as a
+    gzipped ``.txt`` document: one request instead of a message per 4000
+    characters, each of which counts against Telegram's flood limits.
+    Returns the form used, or None for empty output.
+    """
+    if not output.strip():
+        return None
+    block = _code_block(output)
+    if len(output) <= INLINE_LIMIT:
+        form = "inline"
+        await _call_bot(
+            bot.send_message, chat_id=chat_id, text=output, reply_markup=reply_markup
+        )
+    elif len(block) <= MESSAGE_LIMIT:
+        form = "block"
+        await _call_bot(
+            bot.send_message,
+            chat_id=chat_id,
+            text=block,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            reply_markup=reply_markup,
+        )
     else:
-        if len(output) > 4000:
-            for i in range(0, len(output), 4000):
-                chunk = output[i : i + 4000]
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"```\n{chunk}\n```",
-                    parse_mode="Markdown",
-                )
-        else:
-            await update.message.reply_text(output)
+        form = "document"
+        lines = output.count("\n") + 1
+        await _call_bot(
+            bot.send_document,
+            chat_id=chat_id,
+            document=gzip.compress(output.encode(), mtime=0),
+            filename=DOCUMENT_NAME,
+            caption=f"{lines} lines, {len(output)} characters",
+            reply_markup=reply_markup,
+        )
+    REPLIES.inc(form)
+    return form
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -312,31 +1162,25 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
     if not context.user_data.get("companion_active"):
         return
-    history = context.user_data.setdefault("history", [])
-    history.append(text)
-    try:
-        proc = await _get_user_proc(user.id)
-        await context.bot.send_chat_action(
-            chat_id=update.effective_chat.id,
-            action=ChatAction.TYPING,
-        )
-        output = await proc.run(text)
-        _append_history(user.id, text)
-    except Exception as exc:  # noqa: BLE001 - send error to user
-        await update.message.reply_text(f"Error: {exc}")
-        return
-    if not output:
-        return
-    if len(output) > 4000:
-        for i in range(0, len(output), 4000):
-            chunk = output[i : i + 4000]
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"```\n{chunk}\n```",
-                parse_mode="Markdown",
+    MESSAGES.inc("telegram")
+    with tracing.span("telegram.message", user=user.id, command="xplaine"):
+        try:
+            output = await _run_for_user(
+                context.bot, update.effective_chat.id, user.id, text
+            )
+            _append_history(user.id, text)
+        except Busy as exc:
+            await send_output(context.bot, update.effective_chat.id, str(exc))
+            return
+        except Exception as exc:  # noqa: BLE001 - send error to user
+            await send_output(context.bot, update.effective_chat.id, f"Error: {exc}")
+            return
+        if not output:
+            return
+        with tracing.span("telegram.reply", chars=len(output)) as attrs:
+            attrs["form"] = await send_output(
+                context.bot, update.effective_chat.id, output
             )
-    else:
-        await update.message.reply_text(output)
 
 
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -344,25 +1188,52 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         return
     document = update.message.document
     photo = update.message.photo[-1] if update.message.photo else None
-    tg_file = None
-    name = None
     if document:
-        tg_file = await document.get_file()
+        item = document
         name = document.file_name or document.file_unique_id
     elif photo:
-        tg_file = await photo.get_file()
+        item = photo
         name = f"{photo.file_unique_id}.jpg"
-    if not tg_file or not name:
+    else:
+        return
+    try:
+        await _store_telegram_file(item, name)
+    except uploads.UploadError as exc:
+        await send_output(context.bot, update.effective_chat.id, f"Error: {exc}")
         return
-    dest = Path(name)
-    await tg_file.download_to_drive(custom_path=str(dest))
-    await update.message.reply_text(f"file {name} uploaded")
+    await send_output(context.bot, update.effective_chat.id, f"file {name} uploaded")
+
+
+async def _store_telegram_file(item: Any, name: str) -> str:
+    """Store a document or photo in ``UPLOADS`` under ``name``; return its digest.
+
+    A file Telegram sent before, known by its ``file_unique_id``, is not
+    downloaded again.
+    """
+    digest = await asyncio.to_thread(UPLOADS.recall, item.file_unique_id)
+    if digest is not None:
+        try:
+            await asyncio.to_thread(UPLOADS.link, digest, name)
+            return digest
+        except FileNotFoundError:
+            pass
+    uploads.safe_name(name)
+    tg_file = await item.get_file()
+    # bot API downloads are 20 MB at most
+    buffer = io.BytesIO()
+    await tg_file.download_to_memory(out=buffer)
+    buffer.seek(0)
+    digest, _ = await asyncio.to_thread(UPLOADS.add, buffer, name)
+    await asyncio.to_thread(UPLOADS.remember, item.file_unique_id, digest)
+    return digest
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(
+    await send_output(
+        context.bot,
+        update.effective_chat.id,
         build_help_message(),
-        reply_markup=build_main_keyboard(),
+        build_main_keyboard(),
     )
 
 
@@ -375,14 +1246,15 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not user or not update.message:
         return
     history = _read_history(user.id)
-    if history:
-        await update.message.reply_text("\n".join(history))
-    else:
-        await update.message.reply_text("No history yet.")
+    await send_output(
+        context.bot,
+        update.effective_chat.id,
+        "\n".join(history) if history else "No history yet.",
+    )
 
 
 async def run_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Send the command to run.")
+    await send_output(context.bot, update.effective_chat.id, "Send the command to run.")
     return RUN_COMMAND
 
 
@@ -390,22 +1262,24 @@ async def run_execute(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     cmd = update.message.text if update.message else ""
     user = update.effective_user
     if not cmd or not user:
-        await update.message.reply_text("No command provided.")
+        await send_output(context.bot, update.effective_chat.id, "No command provided.")
         return ConversationHandler.END
-    history = context.user_data.setdefault("history", [])
-    history.append(cmd)
+    MESSAGES.inc("telegram")
     try:
-        proc = await _get_user_proc(user.id)
-        output = await proc.run(cmd)
+        output = await _run_for_user(
+            context.bot, update.effective_chat.id, user.id, cmd
+        )
         _append_history(user.id, cmd)
-        await update.message.reply_text(output)
+        await send_output(context.bot, update.effective_chat.id, output)
+    except Busy as exc:
+        await send_output(context.bot, update.effective_chat.id, str(exc))
     except Exception as exc:  # noqa: BLE001 - send error to user
-        await update.message.reply_text(f"Error: {exc}")
+        await send_output(context.bot, update.effective_chat.id, f"Error: {exc}")
     return ConversationHandler.END
 
 
 async def run_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Cancelled.")
+    await send_output(context.bot, update.effective_chat.id, "Cancelled.")
     return ConversationHandler.END
 
 
@@ -417,24 +1291,93 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user = update.effective_user
     if not user:
         return
-    history = context.user_data.setdefault("history", [])
-    history.append(cmd)
-    proc = await _get_user_proc(user.id)
-    output = await proc.run(cmd)
+    MESSAGES.inc("telegram")
+    try:
+        output = await _run_for_user(context.bot, query.message.chat_id, user.id, cmd)
+    except Busy as exc:
+        await query.answer(str(exc))
+        return
     _append_history(user.id, cmd)
     await query.answer()
-    await query.message.reply_text(output, reply_markup=build_main_keyboard())
+    await send_output(context.bot, query.message.chat_id, output, build_main_keyboard())
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Handle the updates of different chats concurrently, each chat's in order.
+
+    A ``ConversationHandler`` reads and writes its state per chat and user:
+    two updates of one chat running at once could both see the state from
+    before either of them, and a reply could overtake the one before it.
+    Updates waiting for their chat's turn never reach ``SCHEDULER``, so its
+    queue bound is applied here: past ``queue_size`` waiting updates a chat
+    gets the same busy reply, and a flooding chat can't hold more than
+    ``queue_size + 1`` of the processor's slots.
+    """
+
+    def __init__(
+        self, max_concurrent_updates: int = 256, queue_size: int = USER_QUEUE
+    ) -> None:
+        super().__init__(max_concurrent_updates)
+        self.queue_size = queue_size
+        # chat (or user) id -> lock and the number of updates holding it
+        self._chats: Dict[int, Tuple[asyncio.Lock, int]] = {}
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        chat = getattr(update, "effective_chat", None) or getattr(
+            update, "effective_user", None
+        )
+        if chat is None:
+            await coroutine
+            return
+        lock, users = self._chats.get(chat.id, (None, 0))
+        # one update of the chat runs, the others wait behind it
+        if users > self.queue_size:
+            getattr(coroutine, "close", lambda: None)()
+            SCHED_REJECTED.inc("telegram")
+            await send_output(update.get_bot(), chat.id, _busy_message(users - 1))
+            return
+        lock = lock or asyncio.Lock()
+        self._chats[chat.id] = (lock, users + 1)
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            lock, users = self._chats[chat.id]
+            if users == 1:
+                del self._chats[chat.id]
+            else:
+                self._chats[chat.id] = (lock, users - 1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
 
 
 async def start_bot() -> None:
     token = os.getenv("TELEGRAM_TOKEN", "").strip()
     if not token:
         return
-    persistence_path = os.getenv("TELEGRAM_PERSISTENCE", "telegram_state.pkl")
-    persistence = PicklePersistence(filepath=persistence_path)
-    application = ApplicationBuilder().token(token).persistence(persistence).build()
+    persistence_path = Path(os.getenv("TELEGRAM_PERSISTENCE", "telegram_state.db"))
+    if persistence_path.suffix == ".pkl":
+        persistence_path = persistence_path.with_suffix(".db")
+    persistence = SQLitePersistence(persistence_path)
+    # command history lives in the history files, not in user_data
+    persistence.import_pickle(persistence_path.with_suffix(".pkl"), drop=("history",))
+    # chats are handled concurrently, and SCHEDULER decides whose command runs
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .persistence(persistence)
+        .concurrent_updates(ChatOrderedProcessor())
+        .build()
+    )
     commands = [
-        BotCommand(cmd[1:], desc.lower()) for cmd, (_, desc) in CORE_COMMANDS.items()
+        BotCommand(cmd[1:], (desc or cmd[1:]).lower())
+        for cmd, desc in command_descriptions().items()
     ]
     commands.append(BotCommand("history", "show command history"))
     await application.bot.set_my_commands(commands)
@@ -479,10 +1422,96 @@ async def main() -> None:
             app,
             host="0.0.0.0",
             port=int(os.getenv("PORT", "8000")),
+            ws_per_message_deflate=True,
         )
     )
-    await asyncio.gather(server.serve(), start_bot(), cleanup_user_sessions())
+    await asyncio.gather(
+        server.serve(), start_bot(), cleanup_user_sessions(), collect_uploads()
+    )
+
+
+async def _broker_heartbeat() -> None:
+    while True:
+        await asyncio.sleep(BROKER.ttl / 3)
+        await asyncio.to_thread(BROKER.heartbeat)
+
+
+async def serve_worker(index: int, sock: socket.socket) -> None:
+    """Serve ``app`` on the shared ``sock`` as worker ``index``.
+
+    The worker also listens on a Unix socket of its own in ``RUN_DIR``, where
+    other workers relay the websockets of sessions it owns. Only worker 0
+    polls Telegram, as a bot token allows one poller at a time, and sweeps the
+    upload store.
+    """
+    global BROKER
+    RUN_DIR.mkdir(parents=True, exist_ok=True)
+    path = RUN_DIR / f"worker-{index}.sock"
+    path.unlink(missing_ok=True)
+    internal = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    internal.bind(str(path))
+    internal.listen(512)
+    BROKER = broker.Broker(RUN_DIR / "broker.db", f"{index}:{os.getpid()}", str(path))
+    await asyncio.to_thread(BROKER.register)
+    await letsgo.start()
+    server = uvicorn.Server(uvicorn.Config(app, ws_per_message_deflate=True))
+    tasks = [
+        server.serve(sockets=[sock, internal]),
+        cleanup_user_sessions(),
+        _broker_heartbeat(),
+    ]
+    if index == 0:
+        tasks += [start_bot(), collect_uploads()]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        BROKER.retire()
+        path.unlink(missing_ok=True)
+
+
+def _worker_process(index: int, sock: socket.socket) -> None:
+    asyncio.run(serve_worker(index, sock))
+
+
+def serve_workers(count: int, host: str, port: int) -> None:
+    """Run ``count`` workers accepting on one socket; restart any that die."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    context = multiprocessing.get_context("spawn")
+    workers: Dict[int, multiprocessing.Process] = {}
+    stopping = False
+
+    def _spawn(index: int) -> None:
+        proc = context.Process(
+            target=_worker_process, args=(index, sock), name=f"bridge-{index}"
+        )
+        proc.start()
+        workers[index] = proc
+
+    def _stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for proc in workers.values():
+            proc.terminate()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    for index in range(count):
+        _spawn(index)
+    while workers:
+        multiprocessing.connection.wait([proc.sentinel for proc in workers.values()])
+        for index, proc in list(workers.items()):
+            if not proc.is_alive():
+                proc.join()
+                del workers[index]
+                if not stopping:
+                    _spawn(index)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKERS > 1:
+        serve_workers(WORKERS, "0.0.0.0", int(os.getenv("PORT", "8000")))
+    else:
+        asyncio.run(main())
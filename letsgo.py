@@ -3,11 +3,20 @@
 
 from __future__ import annotations
 
+import argparse
+import contextlib
+import fcntl
+import json
 import os
+import signal
 import socket
+import subprocess
 import sys
+import time
 import readline
 import atexit
+import termios
+import tty
 import asyncio
 import ast
 import importlib.metadata as importlib_metadata
@@ -21,6 +30,8 @@ from typing import (
     Dict,
     Iterable,
     List,
+    Set,
+    TextIO,
     Tuple,
 )
 from dataclasses import dataclass, asdict
@@ -32,7 +43,20 @@ try:
 except Exception:  # pragma: no cover - fallback when black is absent
     black = None
 from spirits.johny import SonarProDive
-from spirits import memory
+from spirits import (
+    apkindex,
+    completion,
+    errorsig,
+    limits,
+    logstore,
+    plugins,
+    memory,
+    profiler,
+    telemetry,
+    terminal,
+    timeseries,
+    tracing,
+)
 
 _NO_COLOR_FLAG = "--no-color"
 USE_COLOR = (
@@ -65,9 +89,22 @@ class Settings:
     red: str = "\033[31m"
     cyan: str = "\033[36m"
     reset: str = "\033[0m"
-    max_log_files: int = 100
+    # a session log is rotated past this size or age; segments beyond
+    # the budget are removed, oldest first (bytes, seconds, bytes)
+    log_segment_bytes: int = 1 << 20
+    log_segment_age: int = 86400
+    log_budget: int = 64 << 20
     command_timeout: int = 10
     use_color: bool = True
+    # execution backend for /run and /py: plain, rlimit or cgroup
+    exec_backend: str = "plain"
+    cpu_quota: int = 0
+    memory_max: int = 0
+    pids_max: int = 0
+    cgroup_root: str = "/sys/fs/cgroup/letsgo"
+    metrics_interval: int = 5
+    # characters of earlier exchanges /xplaine sends along as context
+    xplaine_context: int = 1500
 
 
 def _load_settings(path: Path = CONFIG_PATH) -> Settings:
@@ -111,6 +148,9 @@ def _save_settings(path: Path | None = None) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w") as fh:
         for key, value in asdict(SETTINGS).items():
+            # quote strings so the loader keeps significant whitespace
+            if isinstance(value, str):
+                value = f'"{value}"'
             fh.write(f"{key}={value}\n")
 
 
@@ -120,17 +160,33 @@ def color(text: str, code: str) -> str:
 
 # //: each session logs to its own file under a fixed directory
 LOG_DIR = DATA_DIR / "log"
-SESSION_ID = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+# the pid keeps sessions started in the same second apart
+SESSION_ID = f"{datetime.utcnow():%Y%m%d-%H%M%S}-{os.getpid()}"
 LOG_PATH = LOG_DIR / f"{SESSION_ID}.log"
 HISTORY_PATH = DATA_DIR / "history"
 PY_TIMEOUT = 5
+# seconds a command group gets between SIGTERM and SIGKILL
+KILL_GRACE = 2
 
 ERROR_LOG_PATH = LOG_DIR / "errors.log"
+ERRORS = errorsig.SignatureIndex(DATA_DIR / "errors.db", ERROR_LOG_PATH)
+SESSION_LOG = logstore.SegmentedLog(
+    LOG_DIR, SESSION_ID, SETTINGS.log_segment_bytes, SETTINGS.log_segment_age
+)
+# how often closed segments are compressed and the budget enforced
+LOG_COMPACT_INTERVAL = 300
+PROFILE_DIR = LOG_DIR / "profiles"
+PROFILER = profiler.Sampler()
+PROFILER_SCRIPT = profiler.__file__
 
 Handler = Callable[[str], Awaitable[Tuple[str, str | None]]]
 
 JOHNY = SonarProDive()
 COMPANION_ACTIVE: str | None = None
+# command and output of the last /run if it failed, for /xplaine
+LAST_FAILURE: Tuple[str, str] | None = None
+# exit code of the last line handled at the prompt, reported with --status
+LAST_RC = 0
 
 
 def _ensure_log_dir() -> None:
@@ -139,23 +195,10 @@ def _ensure_log_dir() -> None:
     if not os.access(LOG_DIR, os.W_OK):
         print(f"No write permission for {LOG_DIR}", file=sys.stderr)
         raise SystemExit(1)
-    max_files = getattr(SETTINGS, "max_log_files", 0)
-    if max_files > 0:
-        logs = sorted(
-            LOG_DIR.glob("*.log"),
-            key=lambda p: p.stat().st_mtime,
-            reverse=True,
-        )
-        for old in logs[max_files:]:
-            try:
-                old.unlink()
-            except OSError:
-                pass
 
 
 def log(message: str) -> None:
-    with LOG_PATH.open("a") as fh:
-        fh.write(f"{datetime.utcnow().isoformat()} {message}\n")
+    SESSION_LOG.write(f"{datetime.utcnow().isoformat()} {message}\n")
 
 
 def log_error(message: str) -> None:
@@ -179,23 +222,43 @@ def _first_ip() -> str:
     return "unknown"
 
 
-def status() -> str:
+@dataclass
+class Snapshot:
+    cpu: int | None
+    uptime: str
+    load: Tuple[float, float, float]
+    disk: Tuple[int, int, int]
+    ip: str
+    gateway: str
+
+
+def sample_metrics(ip: str | None = None, gateway: str | None = None) -> Snapshot:
+    """Collect system metrics, reusing ``ip`` and ``gateway`` when given."""
+    return Snapshot(
+        cpu=os.cpu_count(),
+        uptime=Path("/proc/uptime").read_text().split()[0],
+        load=os.getloadavg(),
+        disk=tuple(shutil.disk_usage("/")),
+        ip=_first_ip() if ip is None else ip,
+        gateway=_default_gateway() if gateway is None else gateway,
+    )
+
+
+def status(snapshot: Snapshot | None = None) -> str:
     """Return basic system metrics."""
-    cpu = os.cpu_count()
-    uptime = Path("/proc/uptime").read_text().split()[0]
-    ip = _first_ip()
-    return f"CPU cores: {cpu}\nUptime: {uptime}s\nIP: {ip}"
+    snap = snapshot or sample_metrics()
+    return f"CPU cores: {snap.cpu}\nUptime: {snap.uptime}s\nIP: {snap.ip}"
 
 
-def cpu_load() -> str:
+def cpu_load(snapshot: Snapshot | None = None) -> str:
     """Return CPU load averages."""
-    load1, load5, load15 = os.getloadavg()
+    load1, load5, load15 = snapshot.load if snapshot else os.getloadavg()
     return f"Load average (1m,5m,15m): {load1:.2f}, {load5:.2f}, {load15:.2f}"
 
 
-def disk_usage_info() -> str:
+def disk_usage_info(snapshot: Snapshot | None = None) -> str:
     """Return disk usage statistics for the root filesystem."""
-    total, used, free = shutil.disk_usage("/")
+    total, used, free = snapshot.disk if snapshot else shutil.disk_usage("/")
     to_gib = 1024**3
     return (
         f"Disk /: total {total // to_gib} GiB, "
@@ -216,13 +279,286 @@ def _default_gateway() -> str:
     return "unknown"
 
 
-def network_info() -> str:
+def network_info(snapshot: Snapshot | None = None) -> str:
     """Return basic network parameters."""
-    ip = _first_ip()
-    gateway = _default_gateway()
+    if snapshot:
+        ip, gateway = snapshot.ip, snapshot.gateway
+    else:
+        ip, gateway = _first_ip(), _default_gateway()
     return f"IP: {ip}\nGateway: {gateway}"
 
 
+# address lookups may block on DNS, so they are redone only when netlink
+# reports an address or route change, or after NET_MAX_AGE seconds
+NET_MAX_AGE = 60
+_RTMGRP_IPV4_IFADDR = 0x10
+_RTMGRP_IPV4_ROUTE = 0x40
+
+
+class MetricsSampler:
+    """Refresh a ``Snapshot`` in the background so handlers never block."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.snapshot: Snapshot | None = None
+        self._net_stamp = 0.0
+        self._task: asyncio.Task | None = None
+        self._netlink: socket.socket | None = None
+
+    async def current(self) -> Snapshot:
+        """Return the latest snapshot, sampling once if there is none yet."""
+        if self.snapshot is None:
+            await self.refresh()
+        return self.snapshot
+
+    async def refresh(self) -> None:
+        now = time.monotonic()
+        snap = self.snapshot
+        if snap is None or not self._net_stamp or now - self._net_stamp > NET_MAX_AGE:
+            self._net_stamp = now
+            self.snapshot = await asyncio.to_thread(sample_metrics)
+        else:
+            self.snapshot = await asyncio.to_thread(
+                sample_metrics, snap.ip, snap.gateway
+            )
+
+    def invalidate_network(self) -> None:
+        self._net_stamp = 0.0
+
+    def start(self) -> None:
+        self._watch_routes()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._netlink is not None:
+            asyncio.get_running_loop().remove_reader(self._netlink.fileno())
+            self._netlink.close()
+            self._netlink = None
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except OSError:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def _watch_routes(self) -> None:
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE
+            )
+            sock.bind((0, _RTMGRP_IPV4_IFADDR | _RTMGRP_IPV4_ROUTE))
+            sock.setblocking(False)
+            asyncio.get_running_loop().add_reader(sock.fileno(), self._on_netlink)
+        except (AttributeError, OSError):
+            return
+        self._netlink = sock
+
+    def _on_netlink(self) -> None:
+        try:
+            while self._netlink.recv(65536):
+                pass
+        except OSError:
+            pass
+        self.invalidate_network()
+
+
+METRICS = MetricsSampler(SETTINGS.metrics_interval)
+
+
+# per-second history behind "/cpu 1h" and friends
+TRENDS_PATH = DATA_DIR / "metrics.bin"
+# held by the one session on the host that samples the trends
+TRENDS_LOCK = TRENDS_PATH.with_suffix(".pid")
+TRENDS_SAVE_EVERY = 10
+TELEMETRY_INTERVAL = 5
+TRENDS = timeseries.History()
+_TASKS: Set[asyncio.Task] = set()
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _net_counters() -> Dict[str, Tuple[int, int]]:
+    """Return received and transmitted bytes per interface."""
+    counters: Dict[str, Tuple[int, int]] = {}
+    try:
+        with open("/proc/net/dev") as fh:
+            for line in fh.readlines()[2:]:
+                iface, _, data = line.partition(":")
+                fields = data.split()
+                if iface.strip() != "lo" and len(fields) > 8:
+                    counters[iface.strip()] = (int(fields[0]), int(fields[8]))
+    except OSError:
+        pass
+    return counters
+
+
+def _mem_used() -> float:
+    """Return used memory in bytes according to ``/proc/meminfo``."""
+    info: Dict[str, int] = {}
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                key, _, value = line.partition(":")
+                info[key] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return (info.get("MemTotal", 0) - info.get("MemAvailable", 0)) * 1024.0
+
+
+def trend_sample(
+    counters: Dict[str, Tuple[int, int]], elapsed: float
+) -> Dict[str, float]:
+    """Sample the tracked metrics; ``counters`` carries byte totals between calls."""
+    values = {
+        "load": os.getloadavg()[0],
+        "disk": float(shutil.disk_usage("/").used),
+        "mem": _mem_used(),
+    }
+    for iface, (rx, tx) in _net_counters().items():
+        if iface in counters and elapsed > 0:
+            prev_rx, prev_tx = counters[iface]
+            values[f"rx:{iface}"] = max(0, rx - prev_rx) / elapsed
+            values[f"tx:{iface}"] = max(0, tx - prev_tx) / elapsed
+        counters[iface] = (rx, tx)
+    return values
+
+
+def _lock_trends() -> TextIO | None:
+    """Take ``TRENDS_LOCK`` without waiting; ``None`` if another session has it."""
+    try:
+        TRENDS_LOCK.parent.mkdir(parents=True, exist_ok=True)
+        pidfile = open(TRENDS_LOCK, "a+")
+    except OSError:
+        return None
+    try:
+        fcntl.flock(pidfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        pidfile.close()
+        return None
+    pidfile.truncate(0)
+    pidfile.write(f"{os.getpid()}\n")
+    pidfile.flush()
+    return pidfile
+
+
+def _save_trends() -> None:
+    try:
+        TRENDS.save(TRENDS_PATH)
+    except OSError:
+        pass
+
+
+async def record_trends(interval: float = 1.0) -> None:
+    """Keep ``TRENDS`` current, sampling it in only one session per host.
+
+    The session holding ``TRENDS_LOCK`` records a sample every ``interval``
+    seconds and saves ``TRENDS_PATH`` every ``TRENDS_SAVE_EVERY`` samples.
+    The others read the points added to that file each time it changes, and
+    one of them takes the lock over when the sampling session exits.
+    """
+    loop = asyncio.get_running_loop()
+    pidfile: TextIO | None = None
+    loaded = None
+    try:
+        while True:
+            if pidfile is None:
+                pidfile = _lock_trends()
+                try:
+                    mtime = TRENDS_PATH.stat().st_mtime_ns
+                except OSError:
+                    mtime = None
+                if pidfile is not None or mtime != loaded:
+                    loaded = mtime
+                    await asyncio.to_thread(TRENDS.refresh, TRENDS_PATH)
+                if pidfile is not None:
+                    counters = _net_counters()
+                    last = loop.time()
+                    ticks = 0
+            await asyncio.sleep(interval)
+            if pidfile is None:
+                continue
+            now = loop.time()
+            TRENDS.record(trend_sample(counters, now - last))
+            last = now
+            ticks += 1
+            if ticks % TRENDS_SAVE_EVERY == 0:
+                _save_trends()
+    finally:
+        if pidfile is not None:
+            _save_trends()
+            pidfile.close()
+
+
+async def flush_telemetry(interval: float = TELEMETRY_INTERVAL) -> None:
+    """Publish this session's metrics for the bridge's ``/metrics``."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                telemetry.dump()
+            # one failed dump must not end the loop
+            except Exception as exc:  # noqa: BLE001
+                log_error(f"telemetry dump failed: {exc}")
+    finally:
+        telemetry.discard()
+
+
+async def compact_logs(interval: float = LOG_COMPACT_INTERVAL) -> None:
+    """Compress closed log segments and keep the log directory in budget."""
+    while True:
+        try:
+            await asyncio.to_thread(
+                logstore.compact,
+                LOG_DIR,
+                (SESSION_LOG.path, ERROR_LOG_PATH),
+                SETTINGS.log_budget,
+            )
+        except OSError:
+            pass
+        await asyncio.sleep(interval)
+
+
+def _parse_window(text: str) -> int | None:
+    """Turn ``5m``, ``1h`` or ``7d`` into seconds."""
+    match = re.fullmatch(r"(\d+)([smhd])", text)
+    if not match:
+        return None
+    return int(match.group(1)) * _WINDOW_UNITS[match.group(2)]
+
+
+def trend_report(user: str, series: Iterable[Tuple[str, str, float, str]]) -> str:
+    """Render sparklines for ``series`` over the window given in ``user``.
+
+    ``series`` holds ``(name, label, scale, unit)`` tuples. Returns an empty
+    string when ``user`` has no window argument.
+    """
+    parts = user.split()[1:]
+    seconds = _parse_window(parts[0]) if parts else None
+    if seconds is None:
+        return ""
+    lines = []
+    for name, label, scale, unit in series:
+        points = [value / scale for value in TRENDS.window(name, seconds)]
+        if not points:
+            lines.append(f"{label} {parts[0]}: no history yet")
+            continue
+        lines.append(
+            f"{label} {parts[0]}: {timeseries.sparkline(points)} "
+            f"min {min(points):.2f} avg {sum(points) / len(points):.2f} "
+            f"max {max(points):.2f}{unit}"
+        )
+    return "\n".join(lines)
+
+
+def _with_trend(reply: str, trend: str) -> str:
+    return f"{reply}\n{trend}" if trend else reply
+
+
 def current_time() -> str:
     """Return the current UTC time."""
     return datetime.utcnow().isoformat()
@@ -233,27 +569,136 @@ async def async_input(prompt: str) -> str:
     return await asyncio.to_thread(input, prompt)
 
 
+def _signal_group(proc: limits.Child, sig: int) -> None:
+    """Send ``sig`` to the whole process group led by ``proc``."""
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _terminate_group(proc: limits.Child, grace: float | None = None) -> None:
+    """Stop the process group of ``proc``: SIGTERM first, SIGKILL after ``grace``."""
+    grace = KILL_GRACE if grace is None else grace
+    _signal_group(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        pass
+    # the leader may be gone while pipelines or background jobs linger
+    _signal_group(proc, signal.SIGKILL)
+    await proc.wait()
+
+
+async def _release(proc: limits.Child) -> None:
+    """Stop what is left of ``proc``'s group and reap it.
+
+    Once the group is gone nothing holds the pipes any more, and asyncio
+    closes them as soon as they reach end of file.
+    """
+    if proc.stdin is not None:
+        proc.stdin.close()
+    if proc.returncode is None:
+        await _terminate_group(proc)
+
+
+_RUNNING: Set[limits.Child] = set()
+
+
+async def terminate_running_commands() -> None:
+    """Terminate the process groups of all in-flight commands."""
+    await asyncio.gather(
+        *(_terminate_group(proc) for proc in list(_RUNNING)),
+        return_exceptions=True,
+    )
+
+
+COMMAND_SECONDS = telemetry.Histogram(
+    "letsgo_command_seconds", "Duration of /run commands by exit code", ("rc",)
+)
+PY_SECONDS = telemetry.Histogram("letsgo_py_seconds", "Latency of /py snippets")
+
+_BACKEND: limits.Backend | None = None
+
+
+def execution_backend() -> limits.Backend:
+    """Return the execution backend configured in ``SETTINGS``."""
+    global _BACKEND
+    if _BACKEND is None:
+        _BACKEND = limits.select_backend(
+            SETTINGS.exec_backend,
+            limits.Limits(
+                cpu_quota=SETTINGS.cpu_quota,
+                memory_max=SETTINGS.memory_max,
+                pids_max=SETTINGS.pids_max,
+            ),
+            SETTINGS.cgroup_root,
+        )
+    return _BACKEND
+
+
 async def run_command(
     command: str,
     on_line: Callable[[str], None] | None = None,
     timeout: int = SETTINGS.command_timeout,
 ) -> Tuple[str, int, float]:
     """Execute ``command`` and return its output, exit code and duration."""
+    output, rc, duration, _ = await run_measured(command, on_line, timeout)
+    return output, rc, duration
+
+
+async def run_measured(
+    command: str,
+    on_line: Callable[[str], None] | None = None,
+    timeout: int = SETTINGS.command_timeout,
+    pty: bool = False,
+) -> Tuple[str, int, float, limits.Usage]:
+    """Execute ``command`` and also return the resources it used.
+
+    With ``pty`` the command writes to a pseudo-terminal instead of a pipe, so
+    it line-buffers and colours its output as it would at a prompt.
+    """
+    slot = execution_backend().open(timeout)
+    execute = _execute_pty if pty else _execute
+    with tracing.span("letsgo.execute", pty=pty) as attrs:
+        try:
+            output, rc, duration = await execute(command, on_line, timeout, slot)
+        finally:
+            usage = slot.close()
+        attrs["rc"] = rc
+    COMMAND_SECONDS.observe(duration, str(rc))
+    return output, rc, duration, usage
+
+
+async def _execute(
+    command: str,
+    on_line: Callable[[str], None] | None,
+    timeout: int,
+    slot: limits.Slot,
+) -> Tuple[str, int, float]:
+    """Run ``command`` inside ``slot``.
+
+    The command runs in its own session so that a timeout or cancellation
+    stops every process it spawned, not just the shell.
+    """
 
     loop = asyncio.get_running_loop()
     start = loop.time()
+    proc = None
     try:
-        proc = await asyncio.create_subprocess_shell(
+        proc = await limits.spawn(
+            slot,
             command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
         )
+        _RUNNING.add(proc)
         output_lines: list[str] = []
         while True:
             remaining = timeout - (loop.time() - start)
             if remaining <= 0:
-                proc.kill()
-                await proc.communicate()
+                await _terminate_group(proc)
                 duration = loop.time() - start
                 return "command timed out", 124, duration
             try:
@@ -262,8 +707,7 @@ async def run_command(
                     timeout=remaining,
                 )
             except asyncio.TimeoutError:
-                proc.kill()
-                await proc.communicate()
+                await _terminate_group(proc)
                 duration = loop.time() - start
                 return "command timed out", 124, duration
             if not line:
@@ -276,9 +720,114 @@ async def run_command(
         duration = loop.time() - start
         output = "\n".join(output_lines).strip()
         return output, rc, duration
+    except asyncio.CancelledError:
+        if proc is not None:
+            await _terminate_group(proc)
+        raise
     except Exception as exc:
         duration = loop.time() - start
         return str(exc), 1, duration
+    finally:
+        if proc is not None:
+            _RUNNING.discard(proc)
+            await _release(proc)
+
+
+async def _execute_pty(
+    command: str,
+    on_line: Callable[[str], None] | None,
+    timeout: int,
+    slot: limits.Slot,
+) -> Tuple[str, int, float]:
+    """Run ``command`` on a pseudo-terminal and capture what it draws."""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    term = None
+    try:
+        term = await terminal.PtyProcess.spawn(command, slot=slot)
+        _RUNNING.add(term.proc)
+        captured = bytearray()
+        partial = b""
+        while True:
+            remaining = timeout - (loop.time() - start)
+            try:
+                chunk = await asyncio.wait_for(term.read(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                await term.terminate()
+                return "command timed out", 124, loop.time() - start
+            if not chunk:
+                break
+            captured += chunk
+            if on_line:
+                *lines, partial = (partial + chunk).split(b"\n")
+                for line in lines:
+                    on_line(terminal.plain(line))
+        rc = await term.wait()
+        return terminal.plain(bytes(captured)).strip(), rc, loop.time() - start
+    except asyncio.CancelledError:
+        if term is not None:
+            await term.terminate()
+        raise
+    except Exception as exc:
+        return str(exc), 1, loop.time() - start
+    finally:
+        if term is not None:
+            _RUNNING.discard(term.proc)
+            term.close()
+
+
+def _terminal_size() -> Tuple[int, int]:
+    size = os.get_terminal_size(sys.stdout.fileno())
+    return size.lines, size.columns
+
+
+def on_terminal() -> bool:
+    return sys.stdin.isatty() and sys.stdout.isatty()
+
+
+async def run_interactive(command: str) -> Tuple[int, float, limits.Usage]:
+    """Run ``command`` on a pseudo-terminal wired to ours until it exits.
+
+    Our terminal is switched to raw mode so every key reaches the program,
+    and window size changes are forwarded to it. There is no timeout.
+    """
+    loop = asyncio.get_running_loop()
+    stdin, stdout = sys.stdin.fileno(), sys.stdout.fileno()
+    saved = termios.tcgetattr(stdin)
+    slot = execution_backend().open(0)
+    start = loop.time()
+    term = None
+    rc = 1
+    sys.stdout.flush()
+    try:
+        term = await terminal.PtyProcess.spawn(command, *_terminal_size(), slot=slot)
+        _RUNNING.add(term.proc)
+        tty.setraw(stdin)
+        loop.add_reader(stdin, lambda: term.write(os.read(stdin, 4096)))
+        loop.add_signal_handler(signal.SIGWINCH, lambda: term.resize(*_terminal_size()))
+        while chunk := await term.read():
+            os.write(stdout, chunk)
+        rc = await term.wait()
+    except asyncio.CancelledError:
+        if term is not None:
+            await term.terminate()
+        raise
+    finally:
+        loop.remove_reader(stdin)
+        loop.remove_signal_handler(signal.SIGWINCH)
+        termios.tcsetattr(stdin, termios.TCSADRAIN, saved)
+        usage = slot.close()
+        if term is not None:
+            _RUNNING.discard(term.proc)
+            term.close()
+    return rc, loop.time() - start, usage
+
+
+def split_tty_flag(command: str) -> Tuple[str, bool]:
+    """Strip the ``-t`` of ``/run -t <command>``."""
+    if command == "-t" or command.startswith("-t "):
+        return command[2:].strip(), True
+    return command, False
 
 
 PYTHON_KEYWORDS = (
@@ -339,11 +888,8 @@ def show_history() -> str:
 
 
 def _iter_log_lines() -> Iterable[str]:
-    """Yield log lines from all log files in order."""
-    for file in sorted(LOG_DIR.glob("*.log")):
-        with file.open() as fh:
-            for line in fh:
-                yield line.rstrip("\n")
+    """Yield log lines from all segments, compressed or not, in order."""
+    return logstore.iter_lines(LOG_DIR)
 
 
 def summarize(
@@ -366,7 +912,7 @@ def summarize(
     else:
         if not LOG_DIR.exists():
             return "no logs"
-        lines = list(_iter_log_lines())
+        lines = _iter_log_lines()
     try:
         pattern = re.compile(term) if term else None
     except re.error:
@@ -393,9 +939,35 @@ def search_history(pattern: str) -> str:
     return "\n".join(matches) if matches else "no matches"
 
 
+async def ask_johny(message: str, topic: str) -> str:
+    """Ask Johny ``message`` along with past exchanges about ``topic``."""
+    past = await asyncio.to_thread(memory.context, topic, SETTINGS.xplaine_context)
+    return await asyncio.to_thread(JOHNY.query, message, past)
+
+
+async def explain_failure(command: str, output: str) -> str:
+    """Explain a failed command, asking Johny only about unseen failures."""
+    sig = errorsig.signature(output)
+    reply = ERRORS.explanation(sig)
+    if reply is not None:
+        return reply
+    line = errorsig.error_line(output)
+    if re.search(r"[А-Яа-яЁё]", command + line):
+        prompt = f"Команда '{command}' завершилась ошибкой: {line}. Объясни."
+    else:
+        prompt = f"The command '{command}' failed with: {line}. Explain."
+    reply = await ask_johny(prompt, command)
+    if not reply.startswith("❌"):
+        await asyncio.to_thread(ERRORS.explain, sig, reply, command, output)
+    return reply
+
+
 async def handle_xplaine(_: str) -> Tuple[str, str | None]:
     global COMPANION_ACTIVE
     COMPANION_ACTIVE = "johny"
+    if LAST_FAILURE is not None:
+        reply = await explain_failure(*LAST_FAILURE)
+        return reply, reply
     last = memory.last_real_command()
     is_russian = bool(re.search(r"[А-Яа-яЁё]", last))
     if last:
@@ -403,7 +975,7 @@ async def handle_xplaine(_: str) -> Tuple[str, str | None]:
             prompt = f"Пользователь пытался выполнить '{last}' и столкнулся с проблемами. Объясни."  # noqa: E501
         else:
             prompt = f"The user tried to '{last}' and had problems. Explain."
-        reply = await asyncio.to_thread(JOHNY.query, prompt)
+        reply = await ask_johny(prompt, last)
     else:
         if is_russian:
             reply = "эй, я Джонни! проблемы? нужна помощь?"
@@ -412,6 +984,43 @@ async def handle_xplaine(_: str) -> Tuple[str, str | None]:
     return reply, reply
 
 
+RECALL_LIMIT = 10
+RECALL_WIDTH = 200
+
+
+async def handle_recall(user: str) -> Tuple[str, str | None]:
+    query = user.partition(" ")[2].strip()
+    if not query:
+        reply = "Usage: /recall <query>"
+        return reply, reply
+    rows = await asyncio.to_thread(memory.recall, query, RECALL_LIMIT * 2)
+    lines = [
+        f"{datetime.utcfromtimestamp(ts):%Y-%m-%d %H:%M:%S} {role}: "
+        + " ".join(content.split())[:RECALL_WIDTH]
+        for ts, role, content in rows
+        # the /recall being answered is in memory already
+        if not content.startswith("/recall")
+    ][:RECALL_LIMIT]
+    reply = "\n".join(lines) if lines else "nothing found"
+    return reply, reply
+
+
+ERRORS_LIMIT = 10
+
+
+async def handle_errors(user: str) -> Tuple[str, str | None]:
+    arg = user.partition(" ")[2].strip()
+    limit = int(arg) if arg.isdigit() else ERRORS_LIMIT
+    rows = await asyncio.to_thread(ERRORS.report, limit)
+    lines = [
+        f"{count:>6} {datetime.utcfromtimestamp(last):%Y-%m-%d %H:%M} "
+        f"{'*' if explained else ' '} {sig}"
+        for sig, count, last, explained in rows
+    ]
+    reply = "\n".join(lines) if lines else "no errors logged"
+    return reply, reply
+
+
 async def handle_xplaineoff(_: str) -> Tuple[str, str | None]:
     global COMPANION_ACTIVE
     COMPANION_ACTIVE = None
@@ -419,23 +1028,36 @@ async def handle_xplaineoff(_: str) -> Tuple[str, str | None]:
     return reply, reply
 
 
-async def handle_status(_: str) -> Tuple[str, str | None]:
-    reply = status()
+async def handle_status(user: str) -> Tuple[str, str | None]:
+    reply = status(await METRICS.current())
+    trend = trend_report(
+        user, [("load", "load", 1, ""), ("mem", "memory", 1024**2, " MiB")]
+    )
+    reply = _with_trend(reply, trend)
     return reply, color(reply, SETTINGS.green)
 
 
-async def handle_cpu(_: str) -> Tuple[str, str | None]:
-    reply = cpu_load()
+async def handle_cpu(user: str) -> Tuple[str, str | None]:
+    reply = cpu_load(await METRICS.current())
+    reply = _with_trend(reply, trend_report(user, [("load", "load", 1, "")]))
     return reply, color(reply, SETTINGS.green)
 
 
-async def handle_disk(_: str) -> Tuple[str, str | None]:
-    reply = disk_usage_info()
+async def handle_disk(user: str) -> Tuple[str, str | None]:
+    reply = disk_usage_info(await METRICS.current())
+    trend = trend_report(user, [("disk", "used", 1024**3, " GiB")])
+    reply = _with_trend(reply, trend)
     return reply, color(reply, SETTINGS.green)
 
 
-async def handle_net(_: str) -> Tuple[str, str | None]:
-    reply = network_info()
+async def handle_net(user: str) -> Tuple[str, str | None]:
+    reply = network_info(await METRICS.current())
+    series = [
+        (name, name, 1024, " KiB/s")
+        for name in sorted(TRENDS.series)
+        if name.startswith(("rx:", "tx:"))
+    ]
+    reply = _with_trend(reply, trend_report(user, series))
     return reply, color(reply, SETTINGS.green)
 
 
@@ -445,52 +1067,97 @@ async def handle_time(_: str) -> Tuple[str, str | None]:
 
 
 async def handle_run(user: str) -> Tuple[str, str | None]:
-    command = user.partition(" ")[2]
+    global LAST_FAILURE, LAST_RC
+    LAST_FAILURE = None
+    command, tty_requested = split_tty_flag(user.partition(" ")[2])
+    if on_terminal() and (tty_requested or terminal.is_tui(command)):
+        rc, duration, usage = await run_interactive(command)
+        LAST_RC = rc
+        memory.log_command(SESSION_ID, command, rc, duration, usage)
+        status = f"код возврата: {rc}, длительность: {duration:.2f}s, {usage.summary()}"
+        print(color(status, SETTINGS.red if rc else SETTINGS.green))
+        return status, None
     print("выполняется...")
-    output, rc, duration = await run_command(command)
+    output, rc, duration, usage = await run_measured(command, pty=tty_requested)
+    LAST_RC = rc
+    memory.log_command(SESSION_ID, command, rc, duration, usage)
     if output:
         if rc != 0:
             print(color(output, SETTINGS.red))
         else:
             print(output)
-    status = f"код возврата: {rc}, длительность: {duration:.2f}s"
+    status = f"код возврата: {rc}, длительность: {duration:.2f}s, {usage.summary()}"
     if rc != 0:
         print(color(status, SETTINGS.red))
         log_error(f"{command} | {status} | {output}")
+        LAST_FAILURE = command, output
     else:
         print(color(status, SETTINGS.green))
     reply = "\n".join(filter(None, [output, status]))
     return reply, None
 
 
-async def handle_py(user: str) -> Tuple[str, str | None]:
+async def run_python(
+    code: str, profile_to: Path | None = None
+) -> Tuple[str, int, float]:
+    """Run ``code`` in a fresh interpreter; return output, exit code and duration.
+
+    The output is what the code printed, or its stderr when it failed.
+    """
+    source = format_python(code)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    if profile_to is None:
+        argv = [sys.executable, "-I", "-c", source]
+    else:
+        argv = [sys.executable, "-I", PROFILER_SCRIPT, str(profile_to), source]
+    slot = execution_backend().open(PY_TIMEOUT)
+    try:
+        proc = await limits.spawn(
+            slot, argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except Exception:
+        slot.close()
+        raise
+    _RUNNING.add(proc)
+    rc = 124
+    try:
+        stdout, stderr, rc = await asyncio.wait_for(
+            asyncio.gather(proc.stdout.read(), proc.stderr.read(), proc.wait()),
+            timeout=PY_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        await _terminate_group(proc)
+        return "execution timed out", rc, loop.time() - start
+    except asyncio.CancelledError:
+        await _terminate_group(proc)
+        raise
+    finally:
+        _RUNNING.discard(proc)
+        await _release(proc)
+        usage = slot.close()
+        elapsed = loop.time() - start
+        PY_SECONDS.observe(elapsed)
+        memory.log_command(SESSION_ID, f"/py {code}", rc, elapsed, usage)
+    if rc != 0:
+        return stderr.decode().strip(), rc, elapsed
+    return stdout.decode().strip(), rc, elapsed
+
+
+async def handle_py(
+    user: str, profile_to: Path | None = None
+) -> Tuple[str, str | None]:
+    global LAST_RC
     code = user.partition(" ")[2]
     if not code:
         reply = "Usage: /py <code>"
         return reply, reply
-    code = format_python(code)
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            sys.executable,
-            "-I",
-            "-c",
-            code,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=PY_TIMEOUT)
-    except asyncio.TimeoutError:
-        proc.kill()
-        await proc.communicate()
-        reply = "execution timed out"
-        return reply, color(reply, SETTINGS.red)
-    output = stdout.decode().strip()
-    err = stderr.decode().strip()
-    if proc.returncode != 0:
-        reply = err or "error"
+    output, rc, _ = await run_python(code, profile_to)
+    LAST_RC = rc
+    if rc != 0:
+        reply = output or "error"
         return reply, color(reply, SETTINGS.red)
-    reply = output
-    return reply, reply
+    return output, output
 
 
 async def handle_clear(_: str) -> Tuple[str, str | None]:
@@ -508,8 +1175,17 @@ async def handle_history(user: str) -> Tuple[str, str | None]:
     return reply, reply
 
 
+def command_descriptions() -> Dict[str, str]:
+    """Return every command and its description, plugins after the core ones."""
+    return {
+        cmd: desc for cmd, (_, desc) in {**CORE_COMMANDS, **PLUGIN_COMMANDS}.items()
+    }
+
+
 def build_help_message() -> str:
-    commands = "\n".join(f"{cmd} - {desc}" for cmd, (_, desc) in CORE_COMMANDS.items())
+    commands = "\n".join(
+        f"{cmd} - {desc}" for cmd, desc in command_descriptions().items()
+    )
     return "Welcome! Available commands:\n" + commands
 
 
@@ -539,6 +1215,118 @@ async def handle_search(user: str) -> Tuple[str, str | None]:
     return reply, reply
 
 
+def top_report(limit: int = 5, all_sessions: bool = False) -> str:
+    """Return the slowest and heaviest recent commands."""
+    session = None if all_sessions else SESSION_ID
+    sections = []
+    for title, order in (("slowest", "duration"), ("heaviest", "cpu")):
+        rows = memory.top_commands(order, session=session, limit=limit)
+        if not rows:
+            return "no commands recorded"
+        lines = [f"{title}:"]
+        for _, sid, command, rc, duration, cpu, max_rss in rows:
+            prefix = f"[{sid}] " if all_sessions else ""
+            rss = f"{int(max_rss) // 1024:5d} MiB" if max_rss else "  n/a    "
+            lines.append(
+                f"  {duration:7.2f}s  cpu {cpu:6.2f}s  rss {rss}"
+                f"  rc={rc}  {prefix}{command}"
+            )
+        sections.append("\n".join(lines))
+    return "\n".join(sections)
+
+
+async def handle_top(user: str) -> Tuple[str, str | None]:
+    parts = user.split()[1:]
+    all_sessions = "--all" in parts
+    limit = next((int(p) for p in parts if p.isdigit()), 5)
+    reply = top_report(limit, all_sessions)
+    return reply, reply
+
+
+async def handle_profile(user: str) -> Tuple[str, str | None]:
+    parts = user.split(maxsplit=2)
+    action = parts[1] if len(parts) > 1 else ""
+    if action not in {"/py", "/run"}:
+        reply = profiler.control(PROFILER, action, PROFILE_DIR, "letsgo")
+        if reply.startswith("Usage"):
+            reply = "Usage: /profile start|stop|dump or /profile /py|/run <code>"
+        return reply, reply
+    # profile one dispatch with a private sampler; /py also samples its child
+    rest = parts[2] if len(parts) > 2 else ""
+    label = action.lstrip("/")
+    sampler = profiler.Sampler()
+    sampler.start()
+    try:
+        if action == "/py":
+            child = profiler.profile_path(PROFILE_DIR, f"{label}-child")
+            reply, colored = await handle_py(f"/py {rest}", profile_to=child)
+        else:
+            child = None
+            reply, colored = await handle_run(f"/run {rest}")
+    finally:
+        sampler.stop()
+    path = sampler.dump(profiler.profile_path(PROFILE_DIR, label))
+    note = f"profile: {path}" + (f", {child}" if child and child.exists() else "")
+    reply = "\n".join(filter(None, [reply, note]))
+    return reply, "\n".join(filter(None, [colored, note]))
+
+
+# the apk databases live under this root; the index is rebuilt from them
+PKG_INDEX = apkindex.PackageIndex(
+    DATA_DIR / "apk.db", os.getenv("LETSGO_APK_ROOT", "/")
+)
+PKG_LIMIT = 50
+PKG_USAGE = "Usage: /pkg search [-d] <term> | /pkg info <name> | /pkg installed [term]"
+
+
+def pkg_report(user: str) -> str:
+    """Answer ``/pkg`` from ``PKG_INDEX``, refreshing it first if needed."""
+    parts = user.split()[1:]
+    action, args = (parts[0], parts[1:]) if parts else ("", [])
+    if action not in {"search", "info", "installed"}:
+        return PKG_USAGE
+    if not PKG_INDEX.sources():
+        return f"no apk database under {PKG_INDEX.root}"
+    if action == "installed":
+        rows = PKG_INDEX.installed(" ".join(args))
+        return "\n".join(f"{name}-{version}" for name, version in rows) or "none"
+    if action == "search":
+        description = "-d" in args
+        term = " ".join(arg for arg in args if arg != "-d")
+        if not term:
+            return PKG_USAGE
+        rows = PKG_INDEX.search(term, description, PKG_LIMIT + 1)
+        lines = [
+            f"{name}-{version} - {desc}" + (" [installed]" if installed else "")
+            for name, version, desc, installed in rows[:PKG_LIMIT]
+        ]
+        if len(rows) > PKG_LIMIT:
+            lines.append(f"... first {PKG_LIMIT} shown")
+        return "\n".join(lines) or "no matches"
+    if len(args) != 1:
+        return PKG_USAGE
+    info = PKG_INDEX.info(args[0])
+    if info is None:
+        return f"{args[0]}: not found"
+    lines = [
+        f"{info['name']}-{info['version']}"
+        + (" [installed]" if info["installed"] else ""),
+        str(info["description"] or ""),
+    ]
+    for label in ("url", "license", "origin", "size", "installed_size"):
+        if info[label] is not None:
+            lines.append(f"{label.replace('_', ' ')}: {info[label]}")
+    for label in ("versions", "depends", "provides", "required_by"):
+        if info[label]:
+            lines.append(f"{label.replace('_', ' ')}: {' '.join(info[label])}")
+    return "\n".join(line for line in lines if line)
+
+
+async def handle_pkg(user: str) -> Tuple[str, str | None]:
+    reply = await asyncio.to_thread(pkg_report, user)
+    return reply, reply
+
+
 async def handle_ping(_: str) -> Tuple[str, str | None]:
     reply = "pong"
     return reply, reply
@@ -547,6 +1335,8 @@ async def handle_ping(_: str) -> Tuple[str, str | None]:
 CORE_COMMANDS: Dict[str, Tuple[Handler, str]] = {
     "/xplaine": (handle_xplaine, "xplainer companion"),
     "/xplaineoff": (handle_xplaineoff, "xplainer off"),
+    "/recall": (handle_recall, "search past commands and answers"),
+    "/errors": (handle_errors, "most frequent failures, * if explained"),
     "/status": (handle_status, "show system metrics"),
     "/cpu": (handle_cpu, "show CPU load"),
     "/disk": (handle_disk, "disk usage"),
@@ -559,25 +1349,259 @@ CORE_COMMANDS: Dict[str, Tuple[Handler, str]] = {
     "/history": (handle_history, "command history"),
     "/help": (handle_help, "help message"),
     "/search": (handle_search, "command history"),
+    "/top": (handle_top, "slowest and heaviest commands"),
+    "/profile": (handle_profile, "sampling profiler"),
+    "/pkg": (handle_pkg, "search apk packages"),
     "/ping": (handle_ping, "reply with pong"),
 }
 
 
+# plugins from modules/*.toml and letsgo.commands entry points; a plugin
+# module is imported the first time its command runs
+PLUGIN_DIR = Path(__file__).resolve().parent / "modules"
+PLUGINS = plugins.Registry(PLUGIN_DIR, DATA_DIR)
+PLUGIN_COMMANDS: Dict[str, Tuple[Handler, str]] = {
+    name: (plugins.LazyHandler(command), command.description)
+    for name, command in PLUGINS.load().items()
+    if name not in CORE_COMMANDS
+}
+
+
 COMMAND_HANDLERS: Dict[str, Handler] = {
-    cmd: func for cmd, (func, _) in CORE_COMMANDS.items()
+    cmd: func for cmd, (func, _) in {**CORE_COMMANDS, **PLUGIN_COMMANDS}.items()
 }
 COMMANDS: List[str] = list(COMMAND_HANDLERS.keys())
-COMMAND_MAP: Dict[str, Tuple[Handler, str]] = dict(CORE_COMMANDS)
+COMMAND_MAP: Dict[str, Tuple[Handler, str]] = {**CORE_COMMANDS, **PLUGIN_COMMANDS}
 
 
 def register_core(commands: List[str], handlers: Dict[str, Handler]) -> None:
     commands.extend(CORE_COMMANDS.keys())
-    handlers.update(COMMAND_HANDLERS)
+    handlers.update({cmd: func for cmd, (func, _) in CORE_COMMANDS.items()})
     COMMAND_MAP.update(CORE_COMMANDS)
 
 
-async def main() -> None:
+def register_plugins(commands: List[str], handlers: Dict[str, Handler]) -> None:
+    commands.extend(PLUGIN_COMMANDS.keys())
+    handlers.update({cmd: func for cmd, (func, _) in PLUGIN_COMMANDS.items()})
+    COMMAND_MAP.update(PLUGIN_COMMANDS)
+
+
+# window arguments offered for the commands that draw trends
+TREND_WINDOWS = ("5m", "1h", "1d", "7d")
+COMPLETER = completion.Completer(lambda: COMMAND_HANDLERS)
+
+
+def _complete_profile(args: List[str], text: str) -> Iterable[str]:
+    if not args:
+        return ("start", "stop", "dump", "/py", "/run")
+    if args[0] == "/run":
+        return COMPLETER.matches(" ".join(args + [text]), text)
+    return ()
+
+
+def _register_completers(completer: completion.Completer) -> None:
+    for cmd in ("/status", "/cpu", "/disk", "/net"):
+        completer.register(cmd, lambda args, text: () if args else TREND_WINDOWS)
+    completer.register("/history", completion.choices("10", "20", "50", "100"))
+    completer.register("/summarize", completion.choices("--history"))
+    completer.register("/top", completion.choices("--all"))
+    completer.register("/profile", _complete_profile)
+    completer.register(
+        "/pkg", lambda args, text: () if args else ("search", "info", "installed")
+    )
+
+
+_register_completers(COMPLETER)
+
+
+def _install_signal_handlers() -> None:
+    """Stop in-flight commands before exiting on SIGTERM."""
+    loop = asyncio.get_running_loop()
+
+    async def _shutdown() -> None:
+        await terminate_running_commands()
+        log("session_end")
+        telemetry.discard()
+        loop.remove_signal_handler(signal.SIGTERM)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    try:
+        loop.add_signal_handler(
+            signal.SIGTERM, lambda: asyncio.ensure_future(_shutdown())
+        )
+    except (NotImplementedError, RuntimeError):
+        pass
+
+
+async def dispatch(user: str) -> None:
+    """Handle one line read at the prompt, leaving its exit code in ``LAST_RC``."""
+    global LAST_RC
+    LAST_RC = 0
+    if not user.startswith("/"):
+        if looks_like_python(user):
+            memory.log("user", user)
+            log(f"user:{user}")
+            reply, colored = await handle_py(f"/py {user}")
+        elif COMPANION_ACTIVE:
+            log(f"user:{user}")
+            reply = await ask_johny(user, user)
+            print(reply)
+            memory.log("reply", reply)
+            log(f"{COMPANION_ACTIVE}:{reply}")
+            return
+        else:
+            memory.log("user", user)
+            log(f"user:{user}")
+            reply, colored = await handle_run(f"/run {user}")
+        if colored is not None:
+            print(colored)
+        memory.log("reply", reply)
+        log(f"letsgo:{reply}")
+        return
+    memory.log("user", user)
+    log(f"user:{user}")
+    base = user.split()[0]
+    handler = COMMAND_HANDLERS.get(base)
+    if handler:
+        reply, colored = await handler(user)
+    else:
+        LAST_RC = 127
+        reply = f"Unknown command: {base}. Try /help for guidance."
+        colored = color(reply, SETTINGS.red)
+    if colored is not None:
+        print(colored)
+    memory.log("reply", reply)
+    log(f"letsgo:{reply}")
+
+
+async def run_line(line: str) -> Tuple[str, int]:
+    """Run one script line as the prompt would; return its output and exit code.
+
+    ``/run`` and ``/py`` report the exit code of what they ran, and the other
+    commands 0, or 127 when there is no such command and 1 when the handler
+    failed.
+    """
+    if not line.startswith("/"):
+        line = f"/py {line}" if looks_like_python(line) else f"/run {line}"
+    base, _, rest = line.partition(" ")
+    try:
+        if base == "/run":
+            command, tty_requested = split_tty_flag(rest)
+            output, rc, duration, usage = await run_measured(command, pty=tty_requested)
+            memory.log_command(SESSION_ID, command, rc, duration, usage)
+            return output, rc
+        if base == "/py" and rest:
+            output, rc, _ = await run_python(rest)
+            return output, rc
+        handler = COMMAND_HANDLERS.get(base)
+        if handler is None:
+            return f"Unknown command: {base}. Try /help for guidance.", 127
+        reply, _ = await handler(line)
+        return reply, 0
+    except Exception as exc:  # noqa: BLE001 - one bad line must not end the batch
+        return f"{type(exc).__name__}: {exc}", 1
+
+
+async def run_script(lines: Iterable[str], out: TextIO, jobs: int = 1) -> int:
+    """Run each command in ``lines``, writing one JSON record per command to ``out``.
+
+    Blank lines and ``#`` comments are skipped. Up to ``jobs`` commands run at
+    once, so with more than one the commands must not depend on each other;
+    records are written in script order all the same. ``lines`` is read as
+    the commands run, so a pipe can feed them. Returns how many failed.
+    """
+    slots = asyncio.Semaphore(max(jobs, 1))
+    window = max(jobs, 1) * 4
+    pending: Deque[asyncio.Task] = deque()
+    failed = 0
+
+    async def _run(number: int, line: str) -> Dict[str, object]:
+        async with slots:
+            started = time.perf_counter()
+            words = line.split()
+            with tracing.span("letsgo.batch", command=words[0]) as attrs:
+                output, rc = await run_line(line)
+                attrs["rc"] = rc
+            return {
+                "line": number,
+                "command": line,
+                "output": output,
+                "rc": rc,
+                "duration": round(time.perf_counter() - started, 6),
+            }
+
+    async def _write_first() -> None:
+        nonlocal failed
+        record = await pending.popleft()
+        failed += record["rc"] != 0
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+
+    iterator = iter(lines)
+    number = 0
+    while True:
+        # a pipe may block; read it without stopping the running commands
+        line = await asyncio.to_thread(next, iterator, None)
+        if line is None:
+            break
+        number += 1
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        pending.append(asyncio.create_task(_run(number, line)))
+        while pending and (pending[0].done() or len(pending) >= window):
+            await _write_first()
+    while pending:
+        await _write_first()
+    return failed
+
+
+async def batch(path: str, jobs: int = 1) -> int:
+    """Run the script at ``path``, or stdin for ``-``, for ``--script``.
+
+    Records go to stdout and what the handlers print is dropped. Returns the
+    exit status: 0 when every command succeeded.
+    """
+    _ensure_log_dir()
+    _install_signal_handlers()
+    log("batch_start")
+    out = sys.stdout
+    script = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with script, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            failed = await run_script(script, out, jobs)
+    log(f"batch_end failed={failed}")
+    return 1 if failed else 0
+
+
+def parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="letsgo.py")
+    parser.add_argument(
+        "--script",
+        metavar="FILE",
+        help="run the commands in FILE ('-' for stdin) and print JSON lines",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="with --script, run up to this many independent commands at once",
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="print each command's exit code before the prompt, for the bridge",
+    )
+    return parser.parse_args(argv)
+
+
+async def main(status: bool = False) -> None:
     _ensure_log_dir()
+    _install_signal_handlers()
+    METRICS.start()
+    _TASKS.add(asyncio.create_task(record_trends()))
+    _TASKS.add(asyncio.create_task(flush_telemetry()))
+    _TASKS.add(asyncio.create_task(compact_logs()))
     HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
     try:
         readline.read_history_file(str(HISTORY_PATH))
@@ -594,24 +1618,11 @@ async def main() -> None:
     readline.parse_and_bind(r'"\C-r": reverse-search-history')
 
     def completer(text: str, state: int) -> str | None:
-        buffer = readline.get_line_buffer()
-        if buffer.startswith("/run "):
-            path = Path(text)
-            directory = path.parent if path.parent != Path(".") else Path(".")
-            try:
-                entries = os.listdir(directory)
-            except OSError:
-                matches: list[str] = []
-            else:
-                matches = [
-                    str(directory / entry) if directory != Path(".") else entry
-                    for entry in entries
-                    if entry.startswith(path.name)
-                ]
-        else:
-            matches = [cmd for cmd in COMMAND_HANDLERS if cmd.startswith(text)]
-        return matches[state] if state < len(matches) else None
+        line = readline.get_line_buffer()[: readline.get_endidx()]
+        return COMPLETER.complete(line, text, state)
 
+    # complete whole words, so /run and paths keep their slashes
+    readline.set_completer_delims(" \t\n")
     readline.set_completer(completer)
     atexit.register(readline.write_history_file, str(HISTORY_PATH))
     atexit.register(_save_settings)
@@ -627,44 +1638,20 @@ async def main() -> None:
             user = await async_input(color(SETTINGS.prompt, SETTINGS.cyan))
         except EOFError:
             break
+        user, parent = tracing.extract(user)
         if user.strip().lower() in {"exit", "quit"}:
             break
-        if not user.startswith("/"):
-            if looks_like_python(user):
-                memory.log("user", user)
-                log(f"user:{user}")
-                reply, colored = await handle_py(f"/py {user}")
-            elif COMPANION_ACTIVE:
-                log(f"user:{user}")
-                reply = await asyncio.to_thread(JOHNY.query, user)
-                print(reply)
-                memory.log("reply", reply)
-                log(f"{COMPANION_ACTIVE}:{reply}")
-                continue
-            else:
-                memory.log("user", user)
-                log(f"user:{user}")
-                reply, colored = await handle_run(f"/run {user}")
-            if colored is not None:
-                print(colored)
-            memory.log("reply", reply)
-            log(f"letsgo:{reply}")
-            continue
-        memory.log("user", user)
-        log(f"user:{user}")
-        base = user.split()[0]
-        handler = COMMAND_HANDLERS.get(base)
-        if handler:
-            reply, colored = await handler(user)
-        else:
-            reply = f"Unknown command: {base}. Try /help for guidance."
-            colored = color(reply, SETTINGS.red)
-        if colored is not None:
-            print(colored)
-        memory.log("reply", reply)
-        log(f"letsgo:{reply}")
+        words = user.split()
+        with tracing.span("letsgo.dispatch", parent, command=words[0] if words else ""):
+            await dispatch(user)
+        if status:
+            # on a line of its own, behind a character nobody types
+            print(f"{tracing.MARKER}{LAST_RC}")
     log("session_end")
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    ARGS = parse_args()
+    if ARGS.script is not None:
+        sys.exit(asyncio.run(batch(ARGS.script, ARGS.jobs)))
+    asyncio.run(main(ARGS.status))
@@ -0,0 +1,549 @@
+"""letsgo-agent: the daemon that keeps letsgo sessions alive across bridge restarts.
+
+``python -m spirits.agent`` owns one letsgo.py child per session key, such
+as ``tg:<user>`` or ``ws:<sid>``, and serves them on a Unix socket. The
+bridge reaches a session through an ``AgentSession``, which has the methods
+of ``LetsGoProcess``. A deploy that restarts the bridge then finds every
+shell where it was, and spawning and reading the children happens off the
+web server's event loop. The first ``AgentSession`` that finds no agent
+listening starts one in the background.
+
+Every request opens a connection of its own and sends a single frame. The
+agent answers with frames until one that ends the request. A frame is a
+``>IB`` header (the payload length and the type) followed by the payload:
+
+=======  ====  ==========  ==================================================
+type     byte  direction   payload
+=======  ====  ==========  ==================================================
+OPEN     1     client      session key; the session is started unless running
+RUN      2     client      key, NUL, command line with ``tracing.inject``
+STOP     3     client      session key
+LIST     4     client      empty
+READY    16    agent       ``>i?`` pid of the session, whether it is new
+OUTPUT   17    agent       a chunk of output, sent as letsgo prints it
+EXIT     18    agent       the request is done; ``>i`` exit code after RUN
+ERROR    19    agent       a message, UTF-8
+=======  ====  ==========  ==================================================
+
+RUN starts the session when it isn't running. If the client goes away in
+the middle of a command, the agent still reads the rest of the reply, so
+the next command finds the prompt. A session left idle for ``AGENT_IDLE``
+seconds is stopped: the bridge that would have stopped it may be gone.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import signal
+import struct
+import subprocess
+import sys
+import time
+from contextlib import aclosing
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Tuple
+
+from . import telemetry, tracing
+
+# where the agent listens unless told otherwise
+AGENT_SOCKET = Path(
+    os.getenv(
+        "LETSGO_AGENT_SOCKET", str(Path.home() / ".letsgo" / "run" / "agent.sock")
+    )
+)
+# a session without commands for this many seconds is stopped
+AGENT_IDLE = float(os.getenv("LETSGO_AGENT_IDLE", "3600"))
+# how long a client waits for an agent it started to listen
+SPAWN_TIMEOUT = 10.0
+REAP_INTERVAL = 60.0
+TELEMETRY_INTERVAL = 5.0
+MAX_FRAME = 16 * 1024 * 1024
+ROOT = Path(__file__).resolve().parents[1]
+
+PROMPT = ">>"
+STOP_TIMEOUT = float(os.getenv("LETSGO_STOP_TIMEOUT", "5"))
+READ_CHUNK = 65536
+
+OPEN = 1
+RUN = 2
+STOP = 3
+LIST = 4
+READY = 16
+OUTPUT = 17
+EXIT = 18
+ERROR = 19
+
+_HEADER = struct.Struct(">IB")
+_READY = struct.Struct(">i?")
+_EXIT = struct.Struct(">i")
+# letsgo --status prints this and the command's exit code before the prompt
+STATUS = tracing.MARKER.encode()
+
+SPAWN_SECONDS = telemetry.Histogram(
+    "letsgo_bridge_spawn_seconds", "Time to start letsgo.py and reach its prompt"
+)
+QUEUE_SECONDS = telemetry.Histogram(
+    "letsgo_bridge_queue_seconds", "Time a command waits for its session"
+)
+EXECUTE_SECONDS = telemetry.Histogram(
+    "letsgo_bridge_execute_seconds", "Time from sending a command to its prompt"
+)
+AGENT_SESSIONS = telemetry.Gauge(
+    "letsgo_agent_sessions", "letsgo sessions kept by the agent"
+)
+
+
+class AgentError(Exception):
+    """The agent refused a request or sent something that isn't a frame."""
+
+
+def encode(kind: int, payload: bytes = b"") -> bytes:
+    return _HEADER.pack(len(payload), kind) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Return the next frame; IncompleteReadError once the peer has gone."""
+    size, kind = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if size > MAX_FRAME:
+        raise AgentError(f"frame of {size} bytes")
+    return kind, await reader.readexactly(size)
+
+
+def clean_reply(data: bytes) -> str:
+    text = data.decode(errors="replace")
+    if text.startswith(PROMPT + " "):
+        text = text[len(PROMPT) + 1 :]
+    return text.strip()
+
+
+class LetsGoProcess:
+    """Manage a persistent letsgo.py subprocess."""
+
+    def __init__(self) -> None:
+        self.proc: asyncio.subprocess.Process | None = None
+        # exit code of the last command streamed, set as its output ends
+        self.last_rc = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self) -> None:
+        started = time.perf_counter()
+        with tracing.span("bridge.spawn"):
+            # unbuffered so that output reaches websocket clients as printed
+            self.proc = await asyncio.create_subprocess_exec(
+                "python",
+                "-u",
+                "letsgo.py",
+                "--no-color",
+                "--status",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+            await self._read_until_prompt()
+        SPAWN_SECONDS.observe(time.perf_counter() - started)
+
+    async def _read_until_prompt(self) -> None:
+        if not self.proc or not self.proc.stdout:
+            return
+        async for _ in self._read_reply():
+            pass
+
+    async def _read_reply(self) -> AsyncIterator[bytes]:
+        """Yield stdout as it arrives until letsgo prints its prompt again.
+
+        A chunk ending in what could be the start of the prompt keeps those
+        bytes back until the next chunk shows whether the prompt follows, and
+        so does everything from a ``STATUS`` mark on. The exit code behind
+        the mark goes to ``last_rc`` instead of the output.
+        """
+        prompt = (PROMPT + " ").encode()
+        tail = b""
+        self.last_rc = 0
+        while True:
+            chunk = await self.proc.stdout.read(READ_CHUNK)
+            if not chunk:
+                if tail:
+                    yield tail
+                return
+            data = tail + chunk
+            if data.endswith(prompt):
+                body, mark, rc = data[: -len(prompt)].rpartition(STATUS)
+                if mark and rc.strip().lstrip(b"-").isdigit():
+                    self.last_rc = int(rc)
+                else:
+                    body = data[: -len(prompt)]
+                if body:
+                    yield body
+                return
+            mark = data.rfind(STATUS)
+            hold = next(
+                (n for n in range(len(prompt) - 1, 0, -1) if data.endswith(prompt[:n])),
+                0,
+            )
+            if mark >= 0:
+                hold = max(hold, len(data) - mark)
+            if len(data) > hold:
+                yield data[: len(data) - hold]
+            tail = data[len(data) - hold :]
+
+    async def stream(self, cmd: str) -> AsyncIterator[bytes]:
+        """Send ``cmd`` and yield its output in chunks as letsgo writes it."""
+        if not self.proc or not self.proc.stdin or not self.proc.stdout:
+            raise RuntimeError("process not started")
+        queued = time.perf_counter()
+        with tracing.span("bridge.queue"):
+            await self._lock.acquire()
+        try:
+            started = time.perf_counter()
+            QUEUE_SECONDS.observe(started - queued)
+            words = cmd.split()
+            with tracing.span(
+                "bridge.execute", command=words[0] if words else ""
+            ) as attrs:
+                # the child continues this span's trace, see spirits.tracing
+                self.proc.stdin.write((tracing.inject(cmd) + "\n").encode())
+                await self.proc.stdin.drain()
+                attrs["bytes"] = 0
+                async for chunk in self._read_reply():
+                    attrs["bytes"] += len(chunk)
+                    yield chunk
+            EXECUTE_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            self._lock.release()
+
+    async def run(self, cmd: str) -> str:
+        chunks = [chunk async for chunk in self.stream(cmd)]
+        return clean_reply(b"".join(chunks))
+
+    async def stop(self) -> None:
+        """Stop letsgo.py; it terminates its in-flight commands on SIGTERM."""
+        proc, self.proc = self.proc, None
+        if not proc:
+            return
+        if proc.stdin:
+            proc.stdin.close()
+        if proc.returncode is None:
+            try:
+                proc.terminate()
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    pass
+        await proc.wait()
+
+
+class Agent:
+    """The sessions kept by one agent, by key."""
+
+    def __init__(
+        self, idle: float = AGENT_IDLE, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.idle = idle
+        self.clock = clock
+        self.sessions: Dict[str, LetsGoProcess] = {}
+        self.last_used: Dict[str, float] = {}
+        self._starting: Dict[str, asyncio.Task] = {}
+
+    async def open(self, key: str) -> Tuple[LetsGoProcess, bool]:
+        """Return the session ``key`` and whether it was started for this call."""
+        self.last_used[key] = self.clock()
+        proc = self.sessions.get(key)
+        if proc is not None and proc.alive:
+            return proc, False
+        # concurrent opens share one start, which a cancelled caller can't stop
+        starting = self._starting.get(key)
+        fresh = starting is None
+        if fresh:
+            starting = self._starting[key] = asyncio.create_task(self._start(key))
+        return await asyncio.shield(starting), fresh
+
+    async def _start(self, key: str) -> LetsGoProcess:
+        try:
+            old = self.sessions.pop(key, None)
+            if old is not None:
+                await old.stop()
+            proc = LetsGoProcess()
+            with tracing.span("agent.session", key=key):
+                await proc.start()
+            self.sessions[key] = proc
+            AGENT_SESSIONS.set(len(self.sessions))
+            return proc
+        finally:
+            del self._starting[key]
+
+    async def stop(self, key: str) -> None:
+        proc = self.sessions.pop(key, None)
+        self.last_used.pop(key, None)
+        AGENT_SESSIONS.set(len(self.sessions))
+        if proc is not None:
+            await proc.stop()
+
+    async def reap(self) -> List[str]:
+        """Stop the sessions that died or sat idle too long; return their keys."""
+        now = self.clock()
+        stale = [
+            key
+            for key, proc in self.sessions.items()
+            if not proc.alive or now - self.last_used.get(key, now) > self.idle
+        ]
+        for key in stale:
+            await self.stop(key)
+        return stale
+
+    async def close(self) -> None:
+        await asyncio.gather(*(self.stop(key) for key in list(self.sessions)))
+
+    async def _run(
+        self, key: str, line: str, writer: asyncio.StreamWriter
+    ) -> int | None:
+        """Stream the reply to ``line``; return its exit code, None if the client left."""
+        proc, _ = await self.open(key)
+        cmd, parent = tracing.extract(line)
+        gone = False
+        with tracing.span("agent.run", parent, key=key):
+            async with aclosing(proc.stream(cmd)) as chunks:
+                async for chunk in chunks:
+                    if gone:
+                        continue
+                    writer.write(encode(OUTPUT, chunk))
+                    try:
+                        await writer.drain()
+                    except ConnectionError:
+                        # read on to the prompt for the session's next command
+                        gone = True
+        self.last_used[key] = self.clock()
+        return None if gone else proc.last_rc
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve the one request of a connection."""
+        try:
+            kind, payload = await read_frame(reader)
+            if kind == OPEN:
+                proc, fresh = await self.open(payload.decode())
+                writer.write(encode(READY, _READY.pack(proc.proc.pid, fresh)))
+            elif kind == RUN:
+                key, _, line = payload.partition(b"\0")
+                rc = await self._run(key.decode(), line.decode(), writer)
+                if rc is None:
+                    return
+                writer.write(encode(EXIT, _EXIT.pack(rc)))
+            elif kind == STOP:
+                await self.stop(payload.decode())
+                writer.write(encode(EXIT))
+            elif kind == LIST:
+                now = self.clock()
+                listing = {
+                    key: {
+                        "pid": proc.proc.pid if proc.proc else None,
+                        "idle": round(now - self.last_used.get(key, now), 1),
+                    }
+                    for key, proc in self.sessions.items()
+                }
+                writer.write(encode(OUTPUT, json.dumps(listing).encode()))
+                writer.write(encode(EXIT))
+            else:
+                writer.write(encode(ERROR, f"unknown request {kind}".encode()))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, AgentError):
+            pass
+        except (OSError, RuntimeError) as exc:
+            # letsgo.py could not be started or died under the command
+            writer.write(encode(ERROR, str(exc).encode()))
+        finally:
+            writer.close()
+
+
+async def _every(interval: float, action: Callable[[], object]) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = action()
+            if asyncio.iscoroutine(result):
+                await result
+        except OSError:
+            pass
+
+
+async def serve(path: Path = AGENT_SOCKET, idle: float = AGENT_IDLE) -> int:
+    """Serve sessions on ``path`` until SIGTERM; 1 if an agent already does."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the pid file's lock, not the socket, says whether an agent is running
+    pidfile = open(path.with_suffix(".pid"), "a+")
+    try:
+        fcntl.flock(pidfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        pidfile.close()
+        return 1
+    pidfile.truncate(0)
+    pidfile.write(f"{os.getpid()}\n")
+    pidfile.flush()
+    tracing.SERVICE = "agent"
+    agent = Agent(idle)
+    path.unlink(missing_ok=True)
+    server = await asyncio.start_unix_server(agent.handle, path=str(path))
+    os.chmod(path, 0o600)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    tasks = [
+        asyncio.create_task(_every(REAP_INTERVAL, agent.reap)),
+        asyncio.create_task(_every(TELEMETRY_INTERVAL, telemetry.dump)),
+    ]
+    try:
+        await stopping.wait()
+    finally:
+        server.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await agent.close()
+        path.unlink(missing_ok=True)
+        telemetry.discard()
+        pidfile.close()
+    return 0
+
+
+def spawn(path: Path = AGENT_SOCKET) -> subprocess.Popen:
+    """Start an agent on ``path`` in a session of its own, so it outlives us."""
+    return subprocess.Popen(
+        [sys.executable, "-m", "spirits.agent", "--socket", str(path)],
+        cwd=ROOT,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+class AgentSession:
+    """The session ``key`` of the agent on ``path``, used like a LetsGoProcess."""
+
+    def __init__(self, key: str, path: Path = AGENT_SOCKET) -> None:
+        self.key = key
+        self.path = Path(path)
+        self.pid: int | None = None
+        self.last_rc = 0
+
+    async def _connect(
+        self, start: bool = True
+    ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await asyncio.open_unix_connection(str(self.path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not start:
+                raise
+        spawn(self.path)
+        deadline = time.monotonic() + SPAWN_TIMEOUT
+        while True:
+            await asyncio.sleep(0.05)
+            try:
+                return await asyncio.open_unix_connection(str(self.path))
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise AgentError(f"no agent listening on {self.path}")
+
+    async def _request(
+        self, kind: int, payload: bytes, start: bool = True
+    ) -> AsyncIterator[Tuple[int, bytes]]:
+        """Send a request and yield the frames of its answer."""
+        reader, writer = await self._connect(start)
+        try:
+            writer.write(encode(kind, payload))
+            await writer.drain()
+            while True:
+                try:
+                    kind, payload = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    # the agent went away, and the session with it
+                    return
+                if kind == ERROR:
+                    raise AgentError(payload.decode(errors="replace"))
+                yield kind, payload
+                if kind in (READY, EXIT):
+                    return
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        async with aclosing(self._request(OPEN, self.key.encode())) as frames:
+            async for kind, payload in frames:
+                if kind == READY:
+                    self.pid, _ = _READY.unpack(payload)
+
+    async def stream(self, cmd: str) -> AsyncIterator[bytes]:
+        """Send ``cmd`` and yield its output in chunks as letsgo writes it."""
+        payload = self.key.encode() + b"\0" + tracing.inject(cmd).encode()
+        self.last_rc = 0
+        async with aclosing(self._request(RUN, payload)) as frames:
+            async for kind, chunk in frames:
+                if kind == OUTPUT:
+                    yield chunk
+                elif kind == EXIT and len(chunk) == _EXIT.size:
+                    (self.last_rc,) = _EXIT.unpack(chunk)
+
+    async def run(self, cmd: str) -> str:
+        chunks = [chunk async for chunk in self.stream(cmd)]
+        return clean_reply(b"".join(chunks))
+
+    async def stop(self) -> None:
+        try:
+            async with aclosing(
+                self._request(STOP, self.key.encode(), start=False)
+            ) as frames:
+                async for _ in frames:
+                    pass
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+
+
+async def sessions(path: Path = AGENT_SOCKET) -> Dict[str, Dict[str, float]]:
+    """Return the agent's sessions with their pid and idle seconds."""
+    listing: Dict[str, Dict[str, float]] = {}
+    async with aclosing(AgentSession("", path)._request(LIST, b"", False)) as frames:
+        async for kind, payload in frames:
+            if kind == OUTPUT:
+                listing = json.loads(payload)
+    return listing
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="letsgo-agent")
+    parser.add_argument("--socket", type=Path, default=AGENT_SOCKET)
+    parser.add_argument("--idle", type=float, default=AGENT_IDLE)
+    parser.add_argument(
+        "--list", action="store_true", help="show the sessions of a running agent"
+    )
+    args = parser.parse_args(argv)
+    if args.list:
+        try:
+            listing = asyncio.run(sessions(args.socket))
+        except (FileNotFoundError, ConnectionRefusedError):
+            print(f"no agent listening on {args.socket}")
+            return 1
+        for key, info in sorted(listing.items()):
+            print(f"{key}\tpid {info['pid']}\tidle {info['idle']}s")
+        return 0
+    if asyncio.run(serve(args.socket, args.idle)):
+        print(f"an agent is already running for {args.socket}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
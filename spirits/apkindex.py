@@ -0,0 +1,310 @@
+"""A queryable copy of the apk package database in SQLite.
+
+``apk search`` and ``apk info`` parse every ``APKINDEX`` and the installed
+database again on each call. ``PackageIndex`` parses them once into SQLite and
+afterwards only re-reads a source whose size or mtime changed, so a
+substring or dependency query over tens of thousands of packages is a single
+indexed lookup.
+
+Both files hold records of ``X:value`` lines separated by blank lines (see
+``apk_pkg_add_info`` in ``apk-tools/src/package.c``); repository indexes are
+the ``APKINDEX`` member of a gzipped tar.
+"""
+
+from __future__ import annotations
+
+import io
+import re
+import sqlite3
+import tarfile
+import threading
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Tuple
+
+# installed databases, newest layout first, relative to the apk root
+INSTALLED_PATHS = ("lib/apk/db/installed", "var/lib/apk/installed")
+INDEX_GLOBS = (
+    "var/cache/apk/APKINDEX.*.tar.gz",
+    "etc/apk/cache/APKINDEX.*.tar.gz",
+    "var/lib/apk/APKINDEX.*.tar.gz",
+)
+_FIELDS = {
+    "P": "name",
+    "V": "version",
+    "T": "description",
+    "A": "arch",
+    "S": "size",
+    "I": "installed_size",
+    "U": "url",
+    "L": "license",
+    "o": "origin",
+}
+_COLUMNS = tuple(_FIELDS.values())
+# a dependency atom: optional !, the name, then an optional constraint
+_ATOM = re.compile(r"^(!?)([^<>=~!]+)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    installed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    installed INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT,
+    description TEXT,
+    arch TEXT,
+    size INTEGER,
+    installed_size INTEGER,
+    url TEXT,
+    license TEXT,
+    origin TEXT
+);
+CREATE TABLE IF NOT EXISTS depends (pkg INTEGER NOT NULL, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS provides (pkg INTEGER NOT NULL, name TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE INDEX IF NOT EXISTS packages_source ON packages (source);
+CREATE INDEX IF NOT EXISTS packages_installed ON packages (name) WHERE installed = 1;
+CREATE INDEX IF NOT EXISTS depends_name ON depends (name);
+CREATE INDEX IF NOT EXISTS depends_pkg ON depends (pkg);
+CREATE INDEX IF NOT EXISTS provides_name ON provides (name);
+CREATE INDEX IF NOT EXISTS provides_pkg ON provides (pkg);
+"""
+
+Record = Dict[str, List[str]]
+
+
+def parse_records(lines: Iterable[str]) -> Iterator[Record]:
+    """Yield each ``X:value`` record in ``lines`` as field -> values."""
+    record: Record = {}
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line:
+            if record:
+                yield record
+                record = {}
+            continue
+        field, sep, value = line.partition(":")
+        if sep and len(field) == 1:
+            record.setdefault(field, []).append(value)
+    if record:
+        yield record
+
+
+def _atoms(value: str) -> Iterator[str]:
+    """Yield the package names in a ``D:`` or ``p:`` list, skipping conflicts."""
+    for atom in value.split():
+        match = _ATOM.match(atom)
+        if match and not match.group(1):
+            yield match.group(2)
+
+
+def _open_index(path: Path) -> IO[str]:
+    """Return the ``APKINDEX`` text inside the gzipped tar at ``path``."""
+    # signed indexes are a signature tar followed by the index tar
+    with tarfile.open(path, "r:gz", ignore_zeros=True) as tar:
+        for member in tar:
+            if member.name == "APKINDEX":
+                data = tar.extractfile(member).read()
+                return io.StringIO(data.decode("utf-8", "replace"))
+    raise tarfile.ReadError(f"{path}: no APKINDEX member")
+
+
+class PackageIndex:
+    """The packages known to apk under ``root``, indexed in ``db_path``."""
+
+    def __init__(self, db_path: Path, root: Path | str = "/") -> None:
+        self.db_path = Path(db_path)
+        self.root = Path(root)
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def sources(self) -> List[Tuple[Path, bool]]:
+        """Return the databases and indexes present, with whether installed."""
+        found = [
+            (self.root / rel, True)
+            for rel in INSTALLED_PATHS
+            if (self.root / rel).is_file()
+        ][:1]
+        for pattern in INDEX_GLOBS:
+            found += [(path, False) for path in sorted(self.root.glob(pattern))]
+        return found
+
+    def refresh(self) -> int:
+        """Re-read the sources that changed; return how many were read."""
+        with self._lock:
+            db = self.db
+            known = {
+                path: (mtime, size)
+                for path, mtime, size in db.execute(
+                    "SELECT path, mtime_ns, size FROM sources"
+                )
+            }
+            current = {}
+            for path, installed in self.sources():
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                current[str(path)] = (stat.st_mtime_ns, stat.st_size, installed)
+            changed = [
+                path
+                for path, (mtime, size, _) in current.items()
+                if known.get(path) != (mtime, size)
+            ]
+            gone = [path for path in known if path not in current]
+            if not changed and not gone:
+                return 0
+            with db:
+                for path in changed + gone:
+                    self._drop(path)
+                for path in changed:
+                    mtime, size, installed = current[path]
+                    try:
+                        self._load(Path(path), installed)
+                    except (OSError, EOFError, tarfile.TarError):
+                        continue
+                    db.execute(
+                        "INSERT INTO sources VALUES (?, ?, ?, ?)",
+                        (path, mtime, size, installed),
+                    )
+            return len(changed)
+
+    def _drop(self, path: str) -> None:
+        db = self.db
+        for table in ("depends", "provides"):
+            db.execute(
+                f"DELETE FROM {table} WHERE pkg IN "
+                "(SELECT id FROM packages WHERE source = ?)",
+                (path,),
+            )
+        db.execute("DELETE FROM packages WHERE source = ?", (path,))
+        db.execute("DELETE FROM sources WHERE path = ?", (path,))
+
+    def _load(self, path: Path, installed: bool) -> None:
+        db = self.db
+        if installed:
+            fh: IO[str] = path.open(encoding="utf-8", errors="replace")
+        else:
+            fh = _open_index(path)
+        next_id = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM packages")
+        pkg_id = next_id.fetchone()[0]
+        packages, depends, provides = [], [], []
+        with fh:
+            for record in parse_records(fh):
+                if "P" not in record:
+                    continue
+                values = [record.get(field, [None])[0] for field in _FIELDS]
+                packages.append((pkg_id, str(path), installed, *values))
+                for value in record.get("D", ()):
+                    depends += [(pkg_id, name) for name in _atoms(value)]
+                for value in record.get("p", ()):
+                    provides += [(pkg_id, name) for name in _atoms(value)]
+                pkg_id += 1
+        columns = ", ".join(("id", "source", "installed") + _COLUMNS)
+        marks = ", ".join("?" * (3 + len(_COLUMNS)))
+        db.executemany(f"INSERT INTO packages ({columns}) VALUES ({marks})", packages)
+        db.executemany("INSERT INTO depends VALUES (?, ?)", depends)
+        db.executemany("INSERT INTO provides VALUES (?, ?)", provides)
+
+    def _rows(self, sql: str, *params) -> list:
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def search(
+        self, term: str, description: bool = False, limit: int = 50
+    ) -> List[Tuple[str, str, str, bool]]:
+        """Return ``(name, version, description, installed)`` for each match.
+
+        ``term`` is matched as a substring of the name, or also of the
+        description when ``description`` is set; an installed package is
+        listed once, ahead of the repository copies.
+        """
+        self.refresh()
+        pattern = (
+            "%"
+            + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            + "%"
+        )
+        where = "name LIKE ? ESCAPE '\\'"
+        params: Tuple = (pattern,)
+        if description:
+            where += " OR description LIKE ? ESCAPE '\\'"
+            params += (pattern,)
+        return self._rows(
+            "SELECT name, version, COALESCE(description, ''), MAX(installed)"
+            f" FROM packages WHERE {where}"
+            " GROUP BY name ORDER BY name LIMIT ?",
+            *params,
+            limit,
+        )
+
+    def installed(self, term: str = "") -> List[Tuple[str, str]]:
+        """Return ``(name, version)`` of installed packages containing ``term``."""
+        self.refresh()
+        return self._rows(
+            "SELECT name, version FROM packages"
+            " WHERE installed = 1 AND instr(name, ?)"
+            " ORDER BY name",
+            term,
+        )
+
+    def info(self, name: str) -> Dict[str, object] | None:
+        """Return what is known about ``name``; None when no source has it."""
+        self.refresh()
+        rows = self._rows(
+            f"SELECT id, installed, {', '.join(_COLUMNS)} FROM packages"
+            " WHERE name = ? ORDER BY installed DESC, id",
+            name,
+        )
+        if not rows:
+            return None
+        pkg_id, installed, *values = rows[0]
+        info: Dict[str, object] = dict(zip(_COLUMNS, values))
+        info["installed"] = bool(installed)
+        info["versions"] = sorted({row[3] for row in rows if row[3]})
+        info["depends"] = [
+            row[0]
+            for row in self._rows(
+                "SELECT name FROM depends WHERE pkg = ? ORDER BY rowid", pkg_id
+            )
+        ]
+        info["provides"] = [
+            row[0]
+            for row in self._rows(
+                "SELECT name FROM provides WHERE pkg = ? ORDER BY rowid", pkg_id
+            )
+        ]
+        # anything depending on the package or on one of the names it provides
+        info["required_by"] = [
+            row[0]
+            for row in self._rows(
+                "SELECT DISTINCT p.name FROM depends d JOIN packages p ON p.id = d.pkg"
+                " WHERE d.name = ? OR d.name IN"
+                " (SELECT name FROM provides WHERE pkg = ?)"
+                " ORDER BY p.name",
+                name,
+                pkg_id,
+            )
+        ]
+        return info
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,161 @@
+"""Who owns what when several bridge workers serve the same port.
+
+Each worker process registers itself in a SQLite database shared by all of
+them, along with the Unix socket it also listens on, and keeps a heartbeat
+there. A websocket session belongs to the worker that created it:
+``claim`` returns the address of the live owner of a key, or makes the caller
+the owner when there is none or the owner stopped beating. Rate limits
+are kept in the same database, so a client can't get around one by landing
+on another worker.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+# a worker that has not beaten for this many seconds is considered gone
+WORKER_TTL = 15.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    address TEXT NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS owners (key TEXT PRIMARY KEY, worker TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS rate (client TEXT PRIMARY KEY, last REAL NOT NULL);
+"""
+
+
+class Broker:
+    """One worker's handle on the shared ownership table at ``path``."""
+
+    def __init__(
+        self,
+        path: Path,
+        worker: str,
+        address: str,
+        ttl: float = WORKER_TTL,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = Path(path)
+        self.worker = worker
+        self.address = address
+        self.ttl = ttl
+        self.clock = clock
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(
+            self.path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def _write(self, *statements) -> List[sqlite3.Cursor]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cursors = [self._db.execute(sql, params) for sql, params in statements]
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return cursors
+
+    def register(self) -> None:
+        """Join, replacing an earlier worker that listened on the same address."""
+        earlier = "SELECT id FROM workers WHERE address = ? AND id != ?"
+        self._write(
+            (
+                f"DELETE FROM owners WHERE worker IN ({earlier})",
+                (self.address, self.worker),
+            ),
+            (
+                "DELETE FROM workers WHERE address = ? AND id != ?",
+                (self.address, self.worker),
+            ),
+            (
+                "INSERT OR REPLACE INTO workers VALUES (?, ?, ?)",
+                (self.worker, self.address, self.clock()),
+            ),
+        )
+
+    def heartbeat(self) -> None:
+        self._write(
+            (
+                "INSERT OR REPLACE INTO workers VALUES (?, ?, ?)",
+                (self.worker, self.address, self.clock()),
+            )
+        )
+
+    def retire(self) -> None:
+        """Drop this worker and everything it owns."""
+        self._write(
+            ("DELETE FROM owners WHERE worker = ?", (self.worker,)),
+            ("DELETE FROM workers WHERE id = ?", (self.worker,)),
+        )
+
+    def claim(self, key: str, unreachable: str | None = None) -> str:
+        """Return the address of the worker owning ``key``, claiming it if free.
+
+        An owner that missed its heartbeats, or whose address is
+        ``unreachable``, loses the key to the caller.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT w.address, w.heartbeat FROM owners o"
+                    " JOIN workers w ON w.id = o.worker WHERE o.key = ?",
+                    (key,),
+                ).fetchone()
+                if (
+                    row is not None
+                    and self.clock() - row[1] <= self.ttl
+                    and row[0] != unreachable
+                ):
+                    return row[0]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO owners VALUES (?, ?)", (key, self.worker)
+                )
+                return self.address
+            finally:
+                self._db.execute("COMMIT")
+
+    def release(self, key: str) -> None:
+        self._write(
+            (
+                "DELETE FROM owners WHERE key = ? AND worker = ?",
+                (key, self.worker),
+            )
+        )
+
+    def allow(self, client: str, interval: float) -> bool:
+        """Record a call by ``client`` unless its last one is under ``interval`` old."""
+        now = self.clock()
+        [cursor] = self._write(
+            (
+                "INSERT INTO rate VALUES (?, ?) ON CONFLICT (client) DO UPDATE"
+                " SET last = excluded.last WHERE excluded.last - rate.last >= ?",
+                (client, now, interval),
+            )
+        )
+        return cursor.rowcount > 0
+
+    def workers(self) -> Dict[str, str]:
+        """Return the address of every live worker by id."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, address FROM workers WHERE heartbeat >= ?",
+                (self.clock() - self.ttl,),
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
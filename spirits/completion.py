@@ -0,0 +1,208 @@
+"""Tab completion for the letsgo prompt without rescanning on every keypress.
+
+readline asks for one match at a time, calling the completer with ``state``
+0, 1, 2, ... for the same text until it returns None. ``Completer`` computes
+the matches once per cycle and serves the rest from that list. Directory
+listings are kept sorted and reused until the directory's mtime changes, so
+a prefix costs a binary search even in a directory of 100k entries, and the
+executables on ``$PATH`` live in a prefix trie that is rebuilt only when
+``$PATH`` or one of its directories changes. Commands can register argument
+completers of their own.
+"""
+
+from __future__ import annotations
+
+import os
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+# (args before the word, word) -> candidates; filtered by prefix afterwards
+ArgCompleter = Callable[[List[str], str], Iterable[str]]
+MAX_DIRS = 64
+
+
+class DirCache:
+    """Sorted directory listings, revalidated against the directory's mtime."""
+
+    def __init__(self, limit: int = MAX_DIRS) -> None:
+        self.limit = limit
+        self._entries: OrderedDict[str, Tuple[int, List[str], frozenset]] = (
+            OrderedDict()
+        )
+
+    def listing(self, directory: str) -> Tuple[List[str], frozenset]:
+        """Return the sorted names in ``directory`` and the subset of dirs."""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return [], frozenset()
+        cached = self._entries.get(directory)
+        if cached is not None and cached[0] == mtime:
+            self._entries.move_to_end(directory)
+            return cached[1], cached[2]
+        names: List[str] = []
+        dirs = set()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    names.append(entry.name)
+                    try:
+                        if entry.is_dir():
+                            dirs.add(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            return [], frozenset()
+        names.sort()
+        self._entries[directory] = (mtime, names, frozenset(dirs))
+        self._entries.move_to_end(directory)
+        while len(self._entries) > self.limit:
+            self._entries.popitem(last=False)
+        return names, frozenset(dirs)
+
+    def starting_with(self, directory: str, prefix: str) -> Iterator[str]:
+        """Yield the names in ``directory`` beginning with ``prefix``; dirs end in /."""
+        names, dirs = self.listing(directory)
+        for name in names[bisect_left(names, prefix) :]:
+            if not name.startswith(prefix):
+                break
+            yield name + "/" if name in dirs else name
+
+
+class Trie:
+    """Prefix tree over strings."""
+
+    __slots__ = ("children", "terminal")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, Trie] = {}
+        self.terminal = False
+
+    def add(self, word: str) -> None:
+        node = self
+        for char in word:
+            node = node.children.setdefault(char, Trie())
+        node.terminal = True
+
+    def starting_with(self, prefix: str) -> List[str]:
+        node = self
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        found: List[str] = []
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            if node.terminal:
+                found.append(word)
+            stack.extend((child, word + c) for c, child in node.children.items())
+        return sorted(found)
+
+
+class Executables:
+    """The commands on ``$PATH``, rebuilt when PATH or a directory changes."""
+
+    def __init__(self, path: Callable[[], str] = lambda: os.getenv("PATH", "")):
+        self.path = path
+        self.trie = Trie()
+        self._stamp: Tuple[Tuple[str, int], ...] | None = None
+
+    def _current_stamp(self) -> Tuple[Tuple[str, int], ...]:
+        stamp = []
+        for directory in dict.fromkeys(filter(None, self.path().split(os.pathsep))):
+            try:
+                stamp.append((directory, os.stat(directory).st_mtime_ns))
+            except OSError:
+                pass
+        return tuple(stamp)
+
+    def refresh(self) -> bool:
+        """Rebuild the trie if anything changed; return whether it was rebuilt."""
+        stamp = self._current_stamp()
+        if stamp == self._stamp:
+            return False
+        trie = Trie()
+        for directory, _ in stamp:
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file() and os.access(entry.path, os.X_OK):
+                                trie.add(entry.name)
+                        except OSError:
+                            pass
+            except OSError:
+                pass
+        self.trie, self._stamp = trie, stamp
+        return True
+
+    def starting_with(self, prefix: str) -> List[str]:
+        self.refresh()
+        return self.trie.starting_with(prefix)
+
+
+class Completer:
+    """Complete letsgo commands, their arguments, executables and paths."""
+
+    def __init__(
+        self,
+        commands: Callable[[], Iterable[str]],
+        dirs: DirCache | None = None,
+        executables: Executables | None = None,
+    ) -> None:
+        self.commands = commands
+        self.dirs = dirs or DirCache()
+        self.executables = executables or Executables()
+        self.arguments: Dict[str, ArgCompleter] = {}
+        self._cycle: Tuple[str, str] | None = None
+        self._matches: List[str] = []
+
+    def register(self, command: str, completer: ArgCompleter) -> None:
+        self.arguments[command] = completer
+
+    def complete(self, line: str, text: str, state: int) -> str | None:
+        """Return match number ``state`` for ``text`` at the end of ``line``."""
+        key = (line, text)
+        if state == 0 or key != self._cycle:
+            self._cycle = key
+            self._matches = self.matches(line, text)
+        return self._matches[state] if state < len(self._matches) else None
+
+    def matches(self, line: str, text: str) -> List[str]:
+        words = line.split()
+        if line and not line[-1].isspace() and words:
+            words = words[:-1]
+        if not words:
+            return sorted(cmd for cmd in self.commands() if cmd.startswith(text))
+        command, args = words[0], words[1:]
+        if command == "/run":
+            if not args and "/" not in text:
+                return self.executables.starting_with(text)
+            return self.paths(text)
+        completer = self.arguments.get(command)
+        if completer is None:
+            return []
+        return [c for c in completer(args, text) if c.startswith(text)]
+
+    def paths(self, text: str) -> List[str]:
+        head, _, prefix = text.rpartition("/")
+        if text.startswith("/") and not head:
+            head = "/"
+        directory = os.path.expanduser(head) if head else "."
+        if not prefix.startswith("."):
+            found = (
+                name
+                for name in self.dirs.starting_with(directory, prefix)
+                if not name.startswith(".")
+            )
+        else:
+            found = self.dirs.starting_with(directory, prefix)
+        base = "" if not head else head if head.endswith("/") else head + "/"
+        return [base + name for name in found]
+
+
+def choices(*options: str) -> ArgCompleter:
+    """An argument completer offering the same ``options`` everywhere."""
+    return lambda args, text: [o for o in options if o not in args]
@@ -0,0 +1,212 @@
+"""Failures grouped by what went wrong rather than by where.
+
+``signature`` reduces the output of a failed command to its error line, with
+paths, numbers, addresses and quoted names replaced by placeholders. With
+that, ``cat: /etc/shadow: Permission denied`` and
+``cat: /root/.ssh/id_rsa: Permission denied`` are one failure.
+``SignatureIndex`` follows ``errors.log`` as letsgo appends to it and counts
+each signature in SQLite. It also keeps the explanation Johny gave the first
+time, so the same failure is explained again without asking him.
+
+``errors.log`` entries are written by ``letsgo.log_error`` as
+``<iso time> <command> | <status> | <output>``; the output may span lines.
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+# a line mentioning one of these is taken as the error line of an output
+_ERROR_WORDS = re.compile(
+    r"error|denied|not found|no such|fail|cannot|can't|unable|invalid|fatal"
+    r"|refused|timed out|no space|not permitted|unknown|exception|killed",
+    re.IGNORECASE,
+)
+# most specific first: a URL holds a path and a path may hold numbers
+_PLACEHOLDERS = (
+    (re.compile(r"\b\w+://\S+"), "<url>"),
+    (re.compile(r"'[^'\n]*'|\"[^\"\n]*\"|`[^`'\n]*'"), "'<s>'"),
+    (re.compile(r"(?:~|\.{1,2})?(?:/[\w.@+-]+)+/?|~"), "<path>"),
+    (re.compile(r"\b0x[0-9a-fA-F]+\b|\b[0-9a-f]{8,}\b"), "<hex>"),
+    (re.compile(r"\b\d+(?:[.:]\d+)*\b"), "<n>"),
+)
+SIGNATURE_WIDTH = 200
+_ENTRY = re.compile(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?) ", re.MULTILINE)
+_MESSAGE = re.compile(
+    r"(?P<command>.*?) \| код возврата: (?P<rc>-?\d+),[^|\n]*\| ?(?P<output>.*)",
+    re.DOTALL,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    signature TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    command TEXT NOT NULL,
+    output TEXT NOT NULL,
+    explanation TEXT
+);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def error_line(output: str) -> str:
+    """Return the line of ``output`` saying what went wrong."""
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    for line in reversed(lines):
+        if _ERROR_WORDS.search(line):
+            return line
+    return lines[-1] if lines else ""
+
+
+def signature(output: str) -> str:
+    """Return the error line of ``output`` with the specifics taken out.
+
+    In ``prog: arg: message`` lines the arguments between the program and
+    the message become ``<arg>`` too, as ``sh: foo: not found`` names the
+    missing command there.
+    """
+    line = error_line(output)
+    for pattern, placeholder in _PLACEHOLDERS:
+        line = pattern.sub(placeholder, line)
+    parts = line.split(": ")
+    if len(parts) > 2:
+        line = ": ".join([parts[0]] + ["<arg>"] * (len(parts) - 2) + [parts[-1]])
+    return " ".join(line.split())[:SIGNATURE_WIDTH]
+
+
+def parse_log(text: str) -> Iterator[Tuple[float, str, int, str]]:
+    """Yield ``(time, command, rc, output)`` for each entry of ``text``."""
+    starts = list(_ENTRY.finditer(text))
+    for match, following in zip(starts, starts[1:] + [None]):
+        end = following.start() if following else len(text)
+        message = _MESSAGE.fullmatch(text[match.end() : end].rstrip("\n"))
+        if message is None:
+            continue
+        stamp = datetime.fromisoformat(match.group(1)).replace(tzinfo=timezone.utc)
+        yield (
+            stamp.timestamp(),
+            message["command"],
+            int(message["rc"]),
+            message["output"],
+        )
+
+
+class SignatureIndex:
+    """Signatures of the failures in ``log_path``, counted in ``db_path``."""
+
+    def __init__(self, db_path: Path, log_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self.log_path = Path(log_path)
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        # explanations never change once given, so hits skip SQLite
+        self._explained: Dict[str, str] = {}
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def refresh(self) -> int:
+        """Count the entries appended to the log since the last call."""
+        with self._lock:
+            db = self.db
+            try:
+                stat = self.log_path.stat()
+            except OSError:
+                return 0
+            row = db.execute(
+                "SELECT inode, offset FROM sources WHERE path = ?",
+                (str(self.log_path),),
+            ).fetchone()
+            offset = 0
+            if row is not None and row[0] == stat.st_ino and row[1] <= stat.st_size:
+                offset = row[1]
+            if offset == stat.st_size:
+                return 0
+            with self.log_path.open("rb") as fh:
+                fh.seek(offset)
+                data = fh.read(stat.st_size - offset)
+            # an entry still being written is read on the next call
+            data = data[: data.rfind(b"\n") + 1]
+            entries = list(parse_log(data.decode("utf-8", "replace")))
+            with db:
+                for stamp, command, _, output in entries:
+                    db.execute(
+                        "INSERT INTO signatures VALUES (?, 1, ?, ?, ?, ?, NULL)"
+                        " ON CONFLICT (signature) DO UPDATE SET"
+                        " count = count + 1, last_seen = excluded.last_seen",
+                        (signature(output), stamp, stamp, command, output[:4096]),
+                    )
+                db.execute(
+                    "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                    (str(self.log_path), stat.st_ino, offset + len(data)),
+                )
+            return len(entries)
+
+    def explanation(self, sig: str) -> str | None:
+        """Return what Johny said about ``sig`` the first time, if he was asked."""
+        if sig in self._explained:
+            return self._explained[sig]
+        with self._lock:
+            row = self.db.execute(
+                "SELECT explanation FROM signatures WHERE signature = ?", (sig,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        self._explained[sig] = row[0]
+        return row[0]
+
+    def explain(self, sig: str, text: str, command: str = "", output: str = "") -> None:
+        """Keep ``text`` as the explanation of ``sig`` unless it already has one."""
+        now = datetime.now(timezone.utc).timestamp()
+        with self._lock, self.db as db:
+            db.execute(
+                "INSERT INTO signatures VALUES (?, 0, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (signature) DO UPDATE SET"
+                " explanation = COALESCE(explanation, excluded.explanation)",
+                (sig, now, now, command, output[:4096], text),
+            )
+
+    def count(self, sig: str) -> int:
+        with self._lock:
+            row = self.db.execute(
+                "SELECT count FROM signatures WHERE signature = ?", (sig,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def report(self, limit: int = 10) -> List[Tuple[str, int, float, bool]]:
+        """Return ``(signature, count, last_seen, explained)``, most frequent first."""
+        self.refresh()
+        with self._lock:
+            return [
+                (sig, count, last_seen, bool(explained))
+                for sig, count, last_seen, explained in self.db.execute(
+                    "SELECT signature, count, last_seen, explanation IS NOT NULL"
+                    " FROM signatures WHERE count > 0"
+                    " ORDER BY count DESC, last_seen DESC LIMIT ?",
+                    (limit,),
+                )
+            ]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
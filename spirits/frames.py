@@ -0,0 +1,144 @@
+"""Binary websocket framing between the bridge and the web terminal.
+
+A client opts in by offering the ``SUBPROTOCOL`` websocket subprotocol;
+clients that don't keep the original text protocol. Every message is one
+binary frame: a type byte followed by its payload.
+
+===========  ====  ==========  ============================================
+type         byte  direction   payload
+===========  ====  ==========  ============================================
+OUTPUT       1     server      a chunk of output, sent as it is produced
+EXIT         2     server      ``>i`` exit status; ends the current command
+HEARTBEAT    3     both        ``>d`` send time; the client echoes it back
+RESIZE       4     client      ``>HH`` rows and columns
+COMMAND      5     client      a command line, UTF-8
+INPUT        6     client      raw keystrokes for a program on a PTY
+PTY          7     server      a program started on a PTY; raw until EXIT
+CLOSE        8     client      end the session
+RESUMED      9     server      ``>QQ?`` first and next sequence number, raw
+===========  ====  ==========  ============================================
+
+OUTPUT, EXIT and PTY frames are numbered from 0 in the order a session
+sends them, and the bridge keeps the latest of them in a ``Scrollback``.
+A client reconnects with ``?resume=<seq>``, the number of frames it has
+seen, and the first thing it gets is a RESUMED frame: replay starts at
+``first``, is complete at ``next`` and ``raw`` says a PTY program was
+already running at ``first``. ``first`` above ``seq`` means output was
+dropped from the scrollback, below it that the session is a new one.
+
+Compression is left to the websocket layer (permessage-deflate), which
+compresses each frame with a context kept across the connection.
+"""
+
+from __future__ import annotations
+
+import struct
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Tuple
+
+SUBPROTOCOL = "letsgo.v1"
+
+OUTPUT = 1
+EXIT = 2
+HEARTBEAT = 3
+RESIZE = 4
+COMMAND = 5
+INPUT = 6
+PTY = 7
+CLOSE = 8
+RESUMED = 9
+
+_EXIT = struct.Struct(">i")
+_HEARTBEAT = struct.Struct(">d")
+_RESIZE = struct.Struct(">HH")
+_RESUMED = struct.Struct(">QQ?")
+
+
+class FrameError(ValueError):
+    """A frame that is empty, of an unknown type or with a bad payload."""
+
+
+def encode(kind: int, payload: bytes = b"") -> bytes:
+    return bytes((kind,)) + payload
+
+
+def decode(frame: bytes) -> Tuple[int, bytes]:
+    if not frame or not OUTPUT <= frame[0] <= RESUMED:
+        raise FrameError("unknown frame type")
+    return frame[0], frame[1:]
+
+
+def exit_payload(rc: int) -> bytes:
+    return _EXIT.pack(rc)
+
+
+def exit_frame(rc: int) -> bytes:
+    return encode(EXIT, exit_payload(rc))
+
+
+def heartbeat_frame(sent: float) -> bytes:
+    return encode(HEARTBEAT, _HEARTBEAT.pack(sent))
+
+
+def resize_frame(rows: int, cols: int) -> bytes:
+    return encode(RESIZE, _RESIZE.pack(rows, cols))
+
+
+def resumed_frame(first: int, next_seq: int, raw: bool) -> bytes:
+    return encode(RESUMED, _RESUMED.pack(first, next_seq, raw))
+
+
+def exit_status(payload: bytes) -> int:
+    try:
+        return _EXIT.unpack(payload)[0]
+    except struct.error as exc:
+        raise FrameError("bad exit payload") from exc
+
+
+def size(payload: bytes) -> Tuple[int, int]:
+    try:
+        rows, cols = _RESIZE.unpack(payload)
+    except struct.error as exc:
+        raise FrameError("bad resize payload") from exc
+    if not rows or not cols:
+        raise FrameError("empty window size")
+    return rows, cols
+
+
+def resumed(payload: bytes) -> Tuple[int, int, bool]:
+    try:
+        return _RESUMED.unpack(payload)
+    except struct.error as exc:
+        raise FrameError("bad resumed payload") from exc
+
+
+class Scrollback:
+    """The latest frames of a session, at most ``limit`` bytes of them.
+
+    The newest frame is always kept, so a single frame may exceed the limit.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.first = 0
+        self._frames: Deque[bytes] = deque()
+        self._size = 0
+
+    @property
+    def next(self) -> int:
+        """The sequence number the next frame will get."""
+        return self.first + len(self._frames)
+
+    def append(self, frame: bytes) -> int:
+        self._frames.append(frame)
+        self._size += len(frame)
+        while self._size > self.limit and len(self._frames) > 1:
+            self._size -= len(self._frames.popleft())
+            self.first += 1
+        return self.next - 1
+
+    def since(self, seq: int) -> Tuple[int, List[bytes]]:
+        """Return the frames from ``seq`` on, or from the oldest one kept."""
+        start = min(max(seq, self.first), self.next)
+        return start, list(islice(self._frames, start - self.first, None))
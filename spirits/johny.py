@@ -1,7 +1,14 @@
 import os
 import requests
 import re
-from . import memory
+from . import memory, tracing
+from .telemetry import Histogram
+
+QUERY_SECONDS = Histogram(
+    "letsgo_johny_query_seconds",
+    "Perplexity API time per Johny query, split by request phase",
+    ("phase",),
+)
 
 
 class SonarProDive:
@@ -19,7 +26,8 @@ class SonarProDive:
             "Always finish your answer fully (never stop mid-sentence). If the answer would be too long, always summarize, ending at a natural pause."  # noqa: E501
         )
 
-    def query(self, user_message):
+    def query(self, user_message, context=()):
+        """Ask Johny; ``context`` holds earlier ``(role, content)`` events."""
         memory.log("johny_user", user_message)
         if not self.api_key:
             err = "❌ Johny Error: PERPLEXITY_API_KEY not set"
@@ -31,10 +39,18 @@ class SonarProDive:
             "Content-Type": "application/json",
         }
 
+        # past exchanges go into the request only, never into memory
+        system = self.system_prompt
+        if context:
+            system += "\nEarlier exchanges with this user:\n" + "\n".join(
+                f"{'Johny' if role == 'johny' else 'User'}: {content}"
+                for role, content in context
+            )
+
         payload = {
             "model": "sonar-pro",
             "messages": [
-                {"role": "system", "content": self.system_prompt},
+                {"role": "system", "content": system},
                 {"role": "user", "content": user_message},
             ],
             "temperature": 0.35,
@@ -46,7 +62,8 @@ class SonarProDive:
 
         try:
             # Первый запрос
-            response = requests.post(self.base_url, headers=headers, json=payload)
+            with QUERY_SECONDS.time("api"), tracing.span("johny.api"):
+                response = requests.post(self.base_url, headers=headers, json=payload)
             response.raise_for_status()
             result = response.json()
             answer = result["choices"][0]["message"]["content"]
@@ -67,9 +84,10 @@ class SonarProDive:
                     "temperature": 0.35,
                     "max_tokens": 400,
                 }
-                follow_resp = requests.post(
-                    self.base_url, headers=headers, json=follow_payload
-                )
+                with QUERY_SECONDS.time("followup"), tracing.span("johny.followup"):
+                    follow_resp = requests.post(
+                        self.base_url, headers=headers, json=follow_payload
+                    )
                 follow_resp.raise_for_status()
                 cont = follow_resp.json()["choices"][0]["message"]["content"]
                 answer = (answer + " " + cont).strip()
@@ -0,0 +1,385 @@
+"""Resource limits and usage accounting for commands run by letsgo.
+
+Three backends are available:
+
+- ``plain`` runs commands unrestricted.
+- ``rlimit`` applies ``setrlimit`` limits in the child before exec.
+- ``cgroup`` places each command in its own cgroup v2 leaf and falls back to
+  ``rlimit`` when no writable cgroup v2 hierarchy is available, or when a
+  leaf can't be made or joined.
+
+Every backend reports the resources a command used. Commands are started
+by ``spawn`` and reaped with ``os.wait4``, which returns the usage of that
+command and the processes it waited for, so commands running side by side
+are not charged for each other. The cgroup backend reads exact figures
+from the leaf instead, including processes the command left running.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import math
+import os
+import resource
+import subprocess
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+CGROUP_FS = Path("/sys/fs/cgroup")
+CONTROLLERS = ("cpu", "memory", "pids", "io")
+CPU_PERIOD_USEC = 100_000
+
+
+@dataclass
+class Limits:
+    cpu_quota: int = 0  # percent of one CPU, 0 = unlimited
+    memory_max: int = 0  # MiB, 0 = unlimited
+    pids_max: int = 0  # 0 = unlimited
+
+
+@dataclass
+class Usage:
+    cpu_user: float = 0.0
+    cpu_sys: float = 0.0
+    max_rss: int = 0  # KiB, 0 = unknown
+    minflt: int = 0
+    majflt: int = 0
+    nvcsw: int = 0
+    nivcsw: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+    @property
+    def cpu(self) -> float:
+        return self.cpu_user + self.cpu_sys
+
+    def summary(self) -> str:
+        rss = f"{self.max_rss // 1024} MiB" if self.max_rss else "n/a"
+        return (
+            f"cpu: {self.cpu:.2f}s, rss: {rss}, "
+            f"io: {self.read_bytes // 1024}/{self.write_bytes // 1024} KiB"
+        )
+
+
+def _usage(rusage: resource.struct_rusage | None, floor: int = 0) -> Usage:
+    """Turn a ``wait4`` rusage into a ``Usage``.
+
+    exec carries the high-water mark of the process it replaces over, so a
+    command's ``ru_maxrss`` is at least ``floor``, letsgo's own peak when it
+    forked. A smaller peak can't be told apart and is left out (0).
+    """
+    if rusage is None:
+        return Usage()
+    return Usage(
+        cpu_user=rusage.ru_utime,
+        cpu_sys=rusage.ru_stime,
+        max_rss=rusage.ru_maxrss if rusage.ru_maxrss > floor else 0,
+        minflt=rusage.ru_minflt,
+        majflt=rusage.ru_majflt,
+        nvcsw=rusage.ru_nvcsw,
+        nivcsw=rusage.ru_nivcsw,
+        read_bytes=rusage.ru_inblock * 512,
+        write_bytes=rusage.ru_oublock * 512,
+    )
+
+
+class Child:
+    """A command started by ``spawn``, reaped here rather than by asyncio.
+
+    asyncio's child watcher reaps with ``waitpid``, which drops the usage
+    ``wait4`` would return, so the exit is awaited on a pidfd instead, or on
+    a thread of its own where there are no pidfds.
+    """
+
+    def __init__(self, popen: subprocess.Popen) -> None:
+        self.popen = popen
+        self.pid = popen.pid
+        self.stdin = popen.stdin
+        self.stdout: asyncio.StreamReader | None = None
+        self.stderr: asyncio.StreamReader | None = None
+        self.returncode: int | None = None
+        self.rusage: resource.struct_rusage | None = None
+        self.floor = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self._exited: asyncio.Future | None = None
+
+    async def wait(self) -> int:
+        if self._exited is None:
+            self._exited = self._watch()
+        # the exit is recorded even when the waiter is cancelled
+        await asyncio.shield(self._exited)
+        assert self.returncode is not None
+        return self.returncode
+
+    def _watch(self) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            threading.Thread(
+                target=self._wait_thread, args=(loop, exited), daemon=True
+            ).start()
+            return exited
+
+        def _readable() -> None:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+            self._reap(exited)
+
+        loop.add_reader(pidfd, _readable)
+        return exited
+
+    def _wait_thread(self, loop: asyncio.AbstractEventLoop, exited: Any) -> None:
+        result = os.wait4(self.pid, 0)
+        try:
+            loop.call_soon_threadsafe(self._reap, exited, result)
+        except RuntimeError:
+            # the loop is closed; the child is reaped all the same
+            pass
+
+    def _reap(self, exited: asyncio.Future, result: Any = None) -> None:
+        _, status, self.rusage = result or os.wait4(self.pid, 0)
+        self.returncode = os.waitstatus_to_exitcode(status)
+        # Popen must not try to reap it again
+        self.popen.returncode = self.returncode
+        if not exited.done():
+            exited.set_result(None)
+
+
+async def spawn(
+    slot: Slot,
+    args: str | Sequence[str],
+    *,
+    shell: bool = False,
+    preexec: Callable[[], None] | None = None,
+    **kwargs: Any,
+) -> Child:
+    """Start ``args`` in a session of its own, inside ``slot``.
+
+    ``stdout`` and ``stderr`` pipes come back as ``asyncio.StreamReader``.
+    ``preexec`` runs in the child after the slot's own; without either,
+    ``subprocess`` can use ``vfork``, which is also safe in a process with
+    threads, where ``preexec_fn`` is not.
+    """
+    hooks = [hook for hook in (slot.preexec, preexec) if hook is not None]
+
+    def _preexec() -> None:
+        for hook in hooks:
+            hook()
+
+    popen = subprocess.Popen(
+        args,
+        shell=shell,
+        start_new_session=True,
+        preexec_fn=_preexec if hooks else None,
+        **kwargs,
+    )
+    child = slot.child = Child(popen)
+    loop = asyncio.get_running_loop()
+    for name in ("stdout", "stderr"):
+        pipe = getattr(popen, name)
+        if pipe is not None:
+            reader = asyncio.StreamReader()
+            protocol = asyncio.StreamReaderProtocol(reader)
+            await loop.connect_read_pipe(lambda: protocol, pipe)
+            setattr(child, name, reader)
+    return child
+
+
+class Slot:
+    """Resources reserved for a single command."""
+
+    # run in the child between fork and exec, if anything needs to be
+    preexec: Callable[[], None] | None = None
+
+    def __init__(self) -> None:
+        self.child: Child | None = None
+
+    def close(self) -> Usage:
+        """Release the slot and return what the command used."""
+        if self.child is None:
+            return Usage()
+        return _usage(self.child.rusage, self.child.floor)
+
+
+class RlimitSlot(Slot):
+    def __init__(self, limits: Limits, timeout: float) -> None:
+        super().__init__()
+        self._rlimits: List[tuple[int, int]] = []
+        if limits.cpu_quota > 0 and timeout > 0:
+            # rlimits cannot cap a rate, so cap the CPU time the quota
+            # would allow over the command's wall-clock budget instead;
+            # interactive commands (timeout 0) have no budget to scale
+            seconds = max(1, math.ceil(timeout * limits.cpu_quota / 100))
+            self._rlimits.append((resource.RLIMIT_CPU, seconds))
+        if limits.memory_max > 0:
+            self._rlimits.append((resource.RLIMIT_AS, limits.memory_max * 1024**2))
+        if limits.pids_max > 0:
+            # per user rather than per command, and ignored for root
+            self._rlimits.append((resource.RLIMIT_NPROC, limits.pids_max))
+        if self._rlimits:
+            self.preexec = self.apply
+
+    def apply(self) -> None:
+        for which, value in self._rlimits:
+            try:
+                resource.setrlimit(which, (value, value))
+            except (ValueError, OSError):
+                pass
+
+
+class CgroupSlot(Slot):
+    def __init__(self, path: Path, limits: Limits, timeout: float = 0) -> None:
+        super().__init__()
+        self.path = path
+        path.mkdir()
+        # for a child that fails to join the leaf
+        self._fallback = RlimitSlot(limits, timeout)
+        self.preexec = self.join
+        if limits.cpu_quota > 0:
+            quota = limits.cpu_quota * CPU_PERIOD_USEC // 100
+            self._write("cpu.max", f"{quota} {CPU_PERIOD_USEC}")
+        if limits.memory_max > 0:
+            self._write("memory.max", str(limits.memory_max * 1024**2))
+        if limits.pids_max > 0:
+            self._write("pids.max", str(limits.pids_max))
+        self._procs = str(path / "cgroup.procs")
+
+    def _write(self, name: str, value: str) -> None:
+        try:
+            (self.path / name).write_text(value)
+        except OSError:
+            pass
+
+    def _read_stat(self, name: str) -> Dict[str, int]:
+        """Parse flat ``key value`` files and ``dev key=value`` files alike."""
+        values: Dict[str, int] = {}
+        try:
+            text = (self.path / name).read_text()
+        except OSError:
+            return values
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[1].isdigit():
+                values[fields[0]] = int(fields[1])
+                continue
+            for field in fields:
+                key, _, value = field.partition("=")
+                if value.isdigit():
+                    values[key] = values.get(key, 0) + int(value)
+        return values
+
+    def join(self) -> None:
+        try:
+            with open(self._procs, "w") as fh:
+                fh.write(str(os.getpid()))
+        except OSError:
+            self._fallback.apply()
+
+    def close(self) -> Usage:
+        usage = super().close()
+        cpu = self._read_stat("cpu.stat")
+        # no CPU time at all: the command never ran in the leaf
+        if cpu.get("usage_usec"):
+            self._read_usage(usage, cpu)
+        # the command is over: take down anything it left behind
+        self._write("cgroup.kill", "1")
+        _remove_leaf(self.path)
+        return usage
+
+    def _read_usage(self, usage: Usage, cpu: Dict[str, int]) -> None:
+        if "user_usec" in cpu:
+            usage.cpu_user = cpu["user_usec"] / 1e6
+            usage.cpu_sys = cpu.get("system_usec", 0) / 1e6
+        mem = self._read_stat("memory.stat")
+        if "pgfault" in mem:
+            usage.majflt = mem.get("pgmajfault", 0)
+            usage.minflt = mem["pgfault"] - usage.majflt
+        try:
+            usage.max_rss = int((self.path / "memory.peak").read_text()) // 1024
+        except (OSError, ValueError):
+            pass
+        io = self._read_stat("io.stat")
+        if "rbytes" in io:
+            usage.read_bytes = io["rbytes"]
+            usage.write_bytes = io.get("wbytes", 0)
+
+
+_STALE: List[Path] = []
+
+
+def _remove_leaf(path: Path) -> None:
+    try:
+        path.rmdir()
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # still populated for a moment after cgroup.kill; retry later
+        _STALE.append(path)
+
+
+class Backend:
+    """Unrestricted execution, usage from ``wait4``."""
+
+    name = "plain"
+
+    def __init__(self, limits: Limits) -> None:
+        self.limits = limits
+
+    def open(self, timeout: float) -> Slot:
+        return Slot()
+
+
+class RlimitBackend(Backend):
+    name = "rlimit"
+
+    def open(self, timeout: float) -> Slot:
+        return RlimitSlot(self.limits, timeout)
+
+
+class CgroupBackend(Backend):
+    name = "cgroup"
+
+    def __init__(self, limits: Limits, root: Path) -> None:
+        super().__init__(limits)
+        self.root = root
+        self._ids = itertools.count()
+
+    def open(self, timeout: float) -> Slot:
+        for stale in list(_STALE):
+            _STALE.remove(stale)
+            _remove_leaf(stale)
+        leaf = self.root / f"{os.getpid()}-{next(self._ids)}"
+        try:
+            return CgroupSlot(leaf, self.limits, timeout)
+        except OSError:
+            return RlimitSlot(self.limits, timeout)
+
+
+def _cgroup_root_ready(root: Path) -> bool:
+    """Create ``root`` and delegate controllers to its leaves if possible."""
+    if not (CGROUP_FS / "cgroup.controllers").exists():
+        return False
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        available = (root / "cgroup.controllers").read_text().split()
+        wanted = [c for c in CONTROLLERS if c in available]
+        (root / "cgroup.subtree_control").write_text(" ".join(f"+{c}" for c in wanted))
+    except OSError:
+        return False
+    return os.access(root, os.W_OK)
+
+
+def select_backend(name: str, limits: Limits, cgroup_root: str) -> Backend:
+    """Return the backend called ``name``, degrading when it is unavailable."""
+    if name == "cgroup":
+        root = Path(cgroup_root)
+        if _cgroup_root_ready(root):
+            return CgroupBackend(limits, root)
+        return RlimitBackend(limits)
+    if name == "rlimit":
+        return RlimitBackend(limits)
+    return Backend(limits)
@@ -0,0 +1,236 @@
+"""Session logs split into segments, with the cold ones compressed.
+
+Each letsgo session appends to ``<session>.log``, where the session name ends
+in ``-<pid>`` of the process writing it. Once that file passes a size or an
+age it is renamed to ``<session>.<n>.log`` and a fresh one is started, so no
+single file grows without bound. Segments that are no longer written to,
+because they were rotated away or their process has exited, are compressed in
+the background (zstd when the interpreter ships ``compression.zstd``, gzip
+otherwise). The oldest compressed segments are removed once the directory
+passes its disk budget. Every session runs ``compact``, so it holds a lock on
+the directory while it works. ``iter_lines`` reads plain and compressed
+segments alike, oldest first.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import gzip
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+try:  # Python 3.14+
+    from compression import zstd
+except ImportError:  # pragma: no cover - depends on the interpreter
+    zstd = None
+
+# suffix -> opener for compressed segments; new ones use the first
+OPENERS: Dict[str, Callable[..., IO]] = {".gz": gzip.open}
+if zstd is not None:  # pragma: no cover - depends on the interpreter
+    OPENERS = {".zst": zstd.open, **OPENERS}
+SUFFIX = next(iter(OPENERS))
+# a plain log nobody has written to for this long is closed
+COLD_AFTER = 3600
+LOCK_NAME = ".compact.lock"
+
+
+class SegmentedLog:
+    """Append lines to ``directory/<name>.log``, rotating it by size and age."""
+
+    def __init__(
+        self,
+        directory: Path,
+        name: str,
+        max_bytes: int = 0,
+        max_age: float = 0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.directory = directory
+        self.name = name
+        self.path = directory / f"{name}.log"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.clock = clock
+        self.size: int | None = None
+        self.started = 0.0
+
+    def _due(self, now: float) -> bool:
+        if not self.size:
+            return False
+        if self.max_bytes and self.size >= self.max_bytes:
+            return True
+        return bool(self.max_age) and now - self.started >= self.max_age
+
+    def write(self, line: str) -> None:
+        now = self.clock()
+        if self.size is None:
+            try:
+                stat = self.path.stat()
+                self.size, self.started = stat.st_size, stat.st_mtime
+            except FileNotFoundError:
+                self.size, self.started = 0, now
+        if self._due(now):
+            self.rotate()
+        data = line.encode()
+        with self.path.open("ab") as fh:
+            fh.write(data)
+        self.size += len(data)
+
+    def rotate(self) -> Path | None:
+        """Close the current segment; return the name it was given."""
+        taken = [
+            _segment_key(path)[1] for path in self.directory.glob(f"{self.name}.*.log*")
+        ]
+        index = 1 + int(max((i for i in taken if i != float("inf")), default=0))
+        target = self.directory / f"{self.name}.{index:04d}.log"
+        try:
+            os.replace(self.path, target)
+        except FileNotFoundError:
+            target = None
+        self.size, self.started = 0, self.clock()
+        return target
+
+
+def _segment_key(path: Path) -> Tuple[str, float]:
+    """Order segments by session, then by index; the open segment comes last."""
+    parts = path.name.split(".")
+    if len(parts) > 2 and parts[1].isdigit():
+        return parts[0], int(parts[1])
+    return parts[0], float("inf")
+
+
+def _compressed(path: Path) -> bool:
+    return path.suffix in OPENERS
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def owner(path: Path) -> int | None:
+    """Return the pid at the end of the session name of ``path``, if any."""
+    _, sep, pid = _segment_key(path)[0].rpartition("-")
+    return int(pid) if sep and pid.isdigit() and int(pid) > 0 else None
+
+
+def segments(directory: Path) -> List[Path]:
+    """Return every log segment in ``directory``, oldest first."""
+    found = [
+        path
+        for path in directory.glob("*.log*")
+        if path.suffix == ".log" or _compressed(path)
+    ]
+    return sorted(found, key=_segment_key)
+
+
+def open_segment(path: Path) -> IO[str]:
+    if _compressed(path):
+        return OPENERS[path.suffix](path, "rt", errors="replace")
+    return path.open(errors="replace")
+
+
+def iter_lines(directory: Path) -> Iterator[str]:
+    """Yield the lines of every segment in ``directory`` without newlines."""
+    for path in segments(directory):
+        try:
+            fh = open_segment(path)
+        except FileNotFoundError:
+            continue  # compressed or removed since it was listed
+        with fh:
+            try:
+                for line in fh:
+                    yield line.rstrip("\n")
+            except (EOFError, OSError):
+                continue  # a segment cut short, e.g. by a crash mid-compression
+
+
+def compress(path: Path) -> Path:
+    """Replace ``path`` by a compressed copy with the same mtime."""
+    target = path.with_name(path.name + SUFFIX)
+    partial = path.with_name(f".{target.name}.{os.getpid()}.part")
+    stat = path.stat()
+    with path.open("rb") as src, OPENERS[SUFFIX](partial, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.utime(partial, (stat.st_atime, stat.st_mtime))
+    os.replace(partial, target)
+    path.unlink()
+    return target
+
+
+def compact(
+    directory: Path,
+    active: Iterable[Path] = (),
+    budget: int = 0,
+    now: float | None = None,
+) -> Tuple[int, int]:
+    """Compress closed segments, then trim the oldest ones to ``budget`` bytes.
+
+    A plain segment is closed once it has been rotated away, or once it has
+    not been written to for ``COLD_AFTER`` seconds and the process named in
+    it is gone. Files in ``active`` are never touched. Returns how many
+    segments were compressed and removed; nothing is done while another
+    process is compacting ``directory``.
+    """
+    try:
+        lock = (directory / LOCK_NAME).open("a")
+    except OSError:
+        return 0, 0
+    with lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return 0, 0
+        return _compact(directory, active, budget, now)
+
+
+def _compact(
+    directory: Path, active: Iterable[Path], budget: int, now: float | None
+) -> Tuple[int, int]:
+    now = time.time() if now is None else now
+    active = {Path(p) for p in active}
+    compressed = removed = 0
+    for path in segments(directory):
+        if path in active or _compressed(path):
+            continue
+        try:
+            rotated = _segment_key(path)[1] != float("inf")
+            pid = owner(path)
+            if not rotated and pid is not None and _alive(pid):
+                continue
+            if rotated or now - path.stat().st_mtime >= COLD_AFTER:
+                compress(path)
+                compressed += 1
+        except OSError:
+            continue
+    if budget <= 0:
+        return compressed, removed
+    sizes = {}
+    for path in segments(directory):
+        try:
+            sizes[path] = path.stat()
+        except FileNotFoundError:
+            pass
+    total = sum(stat.st_size for stat in sizes.values())
+    cold = sorted(
+        (path for path in sizes if _compressed(path)),
+        key=lambda p: sizes[p].st_mtime,
+    )
+    for path in cold:
+        if total <= budget:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= sizes[path].st_size
+        removed += 1
+    return compressed, removed
@@ -1,23 +1,101 @@
+import math
+import os
+import re
 import sqlite3
 import time
 from pathlib import Path
+from typing import Any, List, Tuple
 
-DB_PATH = Path(__file__).with_name("memory.db")
+from .telemetry import Histogram
+
+DB_PATH = Path(os.getenv("LETSGO_MEMORY_DB", Path(__file__).with_name("memory.db")))
+
+USAGE_FIELDS = (
+    "cpu_user",
+    "cpu_sys",
+    "max_rss",
+    "minflt",
+    "majflt",
+    "nvcsw",
+    "nivcsw",
+    "read_bytes",
+    "write_bytes",
+)
+
+COMMIT_SECONDS = Histogram(
+    "letsgo_memory_commit_seconds", "Time spent committing memory.log events"
+)
+RECALL_SECONDS = Histogram("letsgo_memory_recall_seconds", "Latency of memory.recall")
+
+# recall ranks only the newest matches of a query, so that a word found in
+# millions of events costs no more than a rare one
+RECALL_WINDOW = 1000
+
+# external content: the index keeps no copy of the text, the triggers keep
+# it in step with events
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+    content, content='events', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, content)
+    VALUES ('delete', old.rowid, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_update AFTER UPDATE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, content)
+    VALUES ('delete', old.rowid, old.content);
+    INSERT INTO events_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+"""
+FTS = True
+_WORD = re.compile(r"\w+")
 
 
 def _init_db() -> None:
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute("CREATE TABLE IF NOT EXISTS events (ts REAL, role TEXT, content TEXT)")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS commands (ts REAL, session TEXT, command TEXT, "
+        "rc INTEGER, duration REAL, "
+        + ", ".join(f"{name} REAL" for name in USAGE_FIELDS)
+        + ")"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS commands_session_ts ON commands (session, ts)"
+    )
     conn.commit()
+    _init_fts(conn)
     conn.close()
 
 
+def _init_fts(conn: sqlite3.Connection) -> None:
+    """Create the full-text index of events, indexing the ones already there."""
+    global FTS
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'events_fts'"
+    ).fetchone()
+    try:
+        conn.executescript(_FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        # an SQLite built without FTS5: recall falls back to a scan
+        FTS = False
+        return
+    FTS = True
+    if not exists:
+        conn.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+        conn.commit()
+
+
 def log(role: str, content: str) -> None:
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
     cur.execute("INSERT INTO events VALUES (?, ?, ?)", (time.time(), role, content))
-    conn.commit()
+    with COMMIT_SECONDS.time():
+        conn.commit()
     conn.close()
 
 
@@ -45,4 +123,148 @@ def last_real_command() -> str:
     return row[0] if row else ""
 
 
+def _match(query: str, any_term: bool) -> str:
+    """Quote each word of ``query`` so that FTS5 syntax in it means nothing."""
+    terms = ['"' + word.replace('"', '""') + '"' for word in query.split()]
+    return (" OR " if any_term else " ").join(terms)
+
+
+def _rank(
+    rows: List[Tuple[float, str, str]], words: List[str]
+) -> List[Tuple[float, str, str]]:
+    """Sort ``rows``, given newest first, by their BM25 score for ``words``.
+
+    Term frequencies are taken from ``rows`` themselves: FTS5's ``bm25()``
+    counts the documents of each term across the whole index, which is a
+    scan of millions of rows for a common word.
+    """
+    docs = [_WORD.findall(content.lower()) for _, _, content in rows]
+    if not docs:
+        return []
+    average = sum(map(len, docs)) / len(docs) or 1.0
+    weights = {}
+    for word in words:
+        found = sum(word in doc for doc in docs)
+        weights[word] = math.log(1 + (len(docs) - found + 0.5) / (found + 0.5))
+    scores = []
+    for doc in docs:
+        norm = 1.2 * (0.25 + 0.75 * len(doc) / average)
+        score = 0.0
+        for word, weight in weights.items():
+            tf = doc.count(word)
+            if tf:
+                score += weight * tf * 2.2 / (tf + norm)
+        scores.append(score)
+    # sorted() is stable, so equal scores stay newest first
+    order = sorted(range(len(rows)), key=lambda i: -scores[i])
+    return [rows[i] for i in order]
+
+
+def recall(
+    query: str,
+    limit: int = 10,
+    roles: Tuple[str, ...] = (),
+    any_term: bool = False,
+) -> List[Tuple[float, str, str]]:
+    """Return ``(ts, role, content)`` of the events best matching ``query``.
+
+    Every word must match unless ``any_term`` is set. Only the newest
+    ``RECALL_WINDOW`` matches are ranked.
+    """
+    words = _WORD.findall(query.lower())
+    if not words:
+        return []
+    role_in = f"role IN ({', '.join('?' * len(roles))})" if roles else "1"
+    conn = sqlite3.connect(DB_PATH)
+    with RECALL_SECONDS.time():
+        if FTS:
+            rows = conn.execute(
+                f"""
+                SELECT ts, role, content FROM events WHERE rowid IN (
+                    SELECT rowid FROM events_fts WHERE events_fts MATCH ?
+                    ORDER BY rowid DESC LIMIT ?
+                ) AND {role_in} ORDER BY rowid DESC
+                """,
+                (_match(query, any_term), RECALL_WINDOW, *roles),
+            ).fetchall()
+        else:
+            joined = " OR " if any_term else " AND "
+            rows = conn.execute(
+                f"""
+                SELECT ts, role, content FROM events
+                WHERE ({joined.join("content LIKE ?" for _ in words)}) AND {role_in}
+                ORDER BY rowid DESC LIMIT ?
+                """,
+                (*(f"%{word}%" for word in words), *roles, RECALL_WINDOW),
+            ).fetchall()
+        ranked = _rank(rows, words)[:limit]
+    conn.close()
+    return ranked
+
+
+def context(
+    query: str, budget: int, roles: Tuple[str, ...] = ("johny_user", "johny")
+) -> List[Tuple[str, str]]:
+    """Return ``(role, content)`` of past events relevant to ``query``.
+
+    Events are taken best first while their text fits in ``budget``
+    characters; one that doesn't fit is skipped for a shorter one.
+    """
+    picked: List[Tuple[str, str]] = []
+    seen = {query.strip()}
+    for _, role, content in recall(query, 20, roles, any_term=True):
+        content = content.strip()
+        if content in seen or len(content) > budget:
+            continue
+        seen.add(content)
+        picked.append((role, content))
+        budget -= len(content)
+    return picked
+
+
+def log_command(
+    session: str, command: str, rc: int, duration: float, usage: Any
+) -> None:
+    """Record the resources used by one command."""
+    values = [getattr(usage, name) for name in USAGE_FIELDS]
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute(
+        f"INSERT INTO commands VALUES ({', '.join('?' * (5 + len(USAGE_FIELDS)))})",
+        (time.time(), session, command, rc, duration, *values),
+    )
+    conn.commit()
+    conn.close()
+
+
+def top_commands(
+    order: str, session: str | None = None, limit: int = 5, window: int = 500
+) -> List[Tuple]:
+    """Return the ``limit`` costliest of the last ``window`` commands.
+
+    ``order`` is ``duration``, ``cpu`` or ``max_rss``. Rows are
+    ``(ts, session, command, rc, duration, cpu, max_rss)``.
+    """
+    key = {
+        "duration": "duration",
+        "cpu": "cpu_user + cpu_sys",
+        "max_rss": "max_rss",
+    }[order]
+    where = "WHERE session = ?" if session else ""
+    params: tuple = (session,) if session else ()
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT ts, session, command, rc, duration, cpu_user + cpu_sys, max_rss
+        FROM (SELECT * FROM commands {where} ORDER BY ts DESC LIMIT ?)
+        ORDER BY {key} DESC LIMIT ?
+        """,
+        (*params, window, limit),
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return rows
+
+
 _init_db()
@@ -0,0 +1,241 @@
+"""Telegram bot state in SQLite, written a row at a time.
+
+``PicklePersistence`` pickles the data of every user into one file and
+rewrites all of it whenever anything changes, so each flush costs more as
+users and their data pile up. ``SQLitePersistence`` keeps user, chat, bot
+and callback data and conversation states in rows of their own. The
+application only hands over what changed. Values are pickled on the event
+loop as they are handed over, since the handlers keep changing the dicts,
+and the rows queued by one run of ``Application.update_persistence`` are
+written in a single transaction on a worker thread. A batch that fails to
+commit stays queued, behind any newer writes to the same rows, and goes with
+the next one.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+Data = Dict[Any, Any]
+Write = Tuple[str, Tuple[Any, ...]]
+
+_LOG = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS singletons (name TEXT PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+_UPSERT_USER = "INSERT OR REPLACE INTO user_data (id, data) VALUES (?, ?)"
+_UPSERT_CHAT = "INSERT OR REPLACE INTO chat_data (id, data) VALUES (?, ?)"
+_UPSERT_SINGLETON = "INSERT OR REPLACE INTO singletons (name, data) VALUES (?, ?)"
+_UPSERT_STATE = (
+    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)"
+)
+
+
+def _dump(value: Any) -> bytes:
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """Read ``PicklePersistence`` files, which stand the bot in as an id.
+
+    The bot does not exist yet when the file is imported; like
+    ``PicklePersistence`` without a bot, put None in its place.
+    """
+
+    def persistent_load(self, pid: Any) -> None:
+        return None
+
+
+class SQLitePersistence(BasePersistence[Data, Data, Data]):
+    """Store what ``Application`` persists in the SQLite database at ``path``."""
+
+    def __init__(
+        self,
+        path: str | Path,
+        store_data: PersistenceInput | None = None,
+        update_interval: float = 60,
+    ) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.path = Path(path)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._pending: Dict[Hashable, Write] = {}
+        self._writer: asyncio.Task | None = None
+
+    def _commit(self, writes: Iterable[Write]) -> None:
+        with self._lock, self._db:
+            for sql, params in writes:
+                self._db.execute(sql, params)
+
+    def _queue(self, key: Hashable, sql: str, *params: Any) -> None:
+        # a later write to the same row in the same batch replaces the earlier
+        self._pending[key] = (sql, params)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_batch())
+
+    async def _write_batch(self) -> None:
+        # update_persistence gathers its update_* calls, and none of them
+        # awaits anything, so one turn of the loop later the batch is complete
+        await asyncio.sleep(0)
+        while self._pending:
+            if not await self._write_pending():
+                return
+
+    async def _write_pending(self) -> bool:
+        """Commit what is queued; keep it queued and return False if that fails."""
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(self._commit, list(batch.values()))
+        except sqlite3.Error as exc:
+            _LOG.error("persisting %d rows failed, will retry: %s", len(batch), exc)
+            self._pending = {**batch, **self._pending}
+            return False
+        return True
+
+    def _rows(self, sql: str, *params: Any) -> list:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    async def _load(self, table: str) -> Dict[int, Data]:
+        rows = await asyncio.to_thread(self._rows, f"SELECT id, data FROM {table}")
+        return {row_id: pickle.loads(data) for row_id, data in rows}
+
+    async def _singleton(self, name: str) -> Any:
+        rows = await asyncio.to_thread(
+            self._rows, "SELECT data FROM singletons WHERE name = ?", name
+        )
+        return pickle.loads(rows[0][0]) if rows else None
+
+    async def get_user_data(self) -> Dict[int, Data]:
+        return await self._load("user_data")
+
+    async def get_chat_data(self) -> Dict[int, Data]:
+        return await self._load("chat_data")
+
+    async def get_bot_data(self) -> Data:
+        return await self._singleton("bot_data") or {}
+
+    async def get_callback_data(self) -> Any:
+        return await self._singleton("callback_data")
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        rows = await asyncio.to_thread(
+            self._rows, "SELECT key, state FROM conversations WHERE name = ?", name
+        )
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_user_data(self, user_id: int, data: Data) -> None:
+        self._queue(("user", user_id), _UPSERT_USER, user_id, _dump(data))
+
+    async def update_chat_data(self, chat_id: int, data: Data) -> None:
+        self._queue(("chat", chat_id), _UPSERT_CHAT, chat_id, _dump(data))
+
+    async def update_bot_data(self, data: Data) -> None:
+        self._queue("bot_data", _UPSERT_SINGLETON, "bot_data", _dump(data))
+
+    async def update_callback_data(self, data: Any) -> None:
+        self._queue("callback_data", _UPSERT_SINGLETON, "callback_data", _dump(data))
+
+    async def update_conversation(
+        self, name: str, key: Tuple[Any, ...], new_state: object | None
+    ) -> None:
+        encoded = json.dumps(list(key))
+        if new_state is None:
+            sql = "DELETE FROM conversations WHERE name = ? AND key = ?"
+            self._queue(("state", name, encoded), sql, name, encoded)
+        else:
+            self._queue(
+                ("state", name, encoded),
+                _UPSERT_STATE,
+                name,
+                encoded,
+                _dump(new_state),
+            )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        sql = "DELETE FROM user_data WHERE id = ?"
+        self._queue(("user", user_id), sql, user_id)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        sql = "DELETE FROM chat_data WHERE id = ?"
+        self._queue(("chat", chat_id), sql, chat_id)
+
+    async def refresh_user_data(self, user_id: int, user_data: Data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Write whatever is still queued; called when the application stops."""
+        if self._writer is not None:
+            await asyncio.gather(self._writer, return_exceptions=True)
+        if self._pending:
+            await self._write_pending()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def import_pickle(self, path: Path, drop: Iterable[str] = ()) -> bool:
+        """Copy a ``PicklePersistence`` file into a database that is empty.
+
+        Keys listed in ``drop`` are left out of every user's data. Returns
+        whether anything was imported.
+        """
+        if self._rows(
+            "SELECT 1 FROM user_data UNION ALL SELECT 1 FROM chat_data"
+            " UNION ALL SELECT 1 FROM singletons LIMIT 1"
+        ):
+            return False
+        try:
+            with path.open("rb") as fh:
+                state = _LegacyUnpickler(fh).load()
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        drop = set(drop)
+        writes = [
+            (
+                _UPSERT_USER,
+                (uid, _dump({k: v for k, v in data.items() if k not in drop})),
+            )
+            for uid, data in (state.get("user_data") or {}).items()
+        ]
+        writes += [
+            (_UPSERT_CHAT, (cid, _dump(data)))
+            for cid, data in (state.get("chat_data") or {}).items()
+        ]
+        for name in ("bot_data", "callback_data"):
+            if state.get(name):
+                writes.append((_UPSERT_SINGLETON, (name, _dump(state[name]))))
+        for name, states in (state.get("conversations") or {}).items():
+            writes += [
+                (_UPSERT_STATE, (name, json.dumps(list(key)), _dump(value)))
+                for key, value in states.items()
+            ]
+        self._commit(writes)
+        return True
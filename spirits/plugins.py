@@ -0,0 +1,220 @@
+"""Commands contributed by plugins, imported the first time they are called.
+
+A plugin describes its commands in a manifest, either a TOML file in the
+``modules/`` directory::
+
+    # modules/weather.toml
+    [[commands]]
+    name = "/weather"
+    description = "forecast for a city"
+    module = "modules.weather"
+    handler = "handle"          # optional, this is the default
+
+or an entry point in the ``letsgo.commands`` group of an installed
+distribution (``weather = "letsgo_weather:handle"``), whose description is the
+distribution's summary. Handlers have the signature of the core ones,
+``async def handle(user: str) -> tuple[str, str | None]``, and may also return
+a plain string.
+
+Startup only reads the manifests, never the plugin modules, and the list it
+builds is cached on disk until a manifest, the ``modules/`` directory or a
+``site-packages`` directory changes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib
+import importlib.metadata as importlib_metadata
+import json
+import os
+import re
+import sys
+import tomllib
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+GROUP = "letsgo.commands"
+_VERSION = 1
+# Telegram accepts 1-32 lowercase letters, digits and underscores
+_NAME = re.compile(r"/[a-z0-9_]{1,32}")
+
+Stamp = List[Tuple[str, int]]
+
+
+class PluginError(Exception):
+    """A plugin could not be imported or has no usable handler."""
+
+
+@dataclass(frozen=True)
+class PluginCommand:
+    name: str
+    description: str
+    module: str
+    handler: str = "handle"
+    source: str = ""
+
+
+class LazyHandler:
+    """Import ``command.module`` on the first call and delegate to its handler."""
+
+    def __init__(self, command: PluginCommand) -> None:
+        self.command = command
+        self._func: Callable[[str], Awaitable[Any]] | None = None
+
+    def resolve(self) -> Callable[[str], Awaitable[Any]]:
+        if self._func is None:
+            try:
+                module = importlib.import_module(self.command.module)
+                func = getattr(module, self.command.handler)
+            except Exception as exc:
+                raise PluginError(
+                    f"{self.command.name}: cannot load "
+                    f"{self.command.module}.{self.command.handler}: {exc}"
+                ) from exc
+            if not callable(func):
+                raise PluginError(f"{self.command.name}: handler is not callable")
+            self._func = func
+        return self._func
+
+    @property
+    def loaded(self) -> bool:
+        return self._func is not None
+
+    async def __call__(self, user: str) -> Tuple[str, str | None]:
+        try:
+            func = self.resolve()
+        except PluginError as exc:
+            return str(exc), str(exc)
+        result = await func(user)
+        if isinstance(result, str):
+            return result, result
+        return result
+
+
+def _mtime(path: Path | str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _parse_manifest(path: Path) -> List[PluginCommand]:
+    with path.open("rb") as fh:
+        data = tomllib.load(fh)
+    commands = []
+    for entry in data.get("commands", []):
+        name = str(entry.get("name", ""))
+        if not name.startswith("/"):
+            name = "/" + name
+        if not _NAME.fullmatch(name) or not entry.get("module"):
+            continue
+        commands.append(
+            PluginCommand(
+                name=name,
+                description=str(entry.get("description", "")),
+                module=str(entry["module"]),
+                handler=str(entry.get("handler", "handle")),
+                source=path.name,
+            )
+        )
+    return commands
+
+
+def _entry_point_commands(group: str) -> List[PluginCommand]:
+    commands = []
+    for ep in importlib_metadata.entry_points(group=group):
+        name = "/" + ep.name
+        module, _, attr = ep.value.partition(":")
+        if not _NAME.fullmatch(name) or not attr:
+            continue
+        summary = ep.dist.metadata.get("Summary", "") if ep.dist else ""
+        source = ep.dist.name if ep.dist else ""
+        commands.append(
+            PluginCommand(name, summary or "", module.strip(), attr.strip(), source)
+        )
+    return commands
+
+
+class Registry:
+    """Plugin commands from ``directory`` and the ``group`` entry points."""
+
+    def __init__(
+        self,
+        directory: Path,
+        cache_dir: Path,
+        group: str = GROUP,
+        search_path: List[str] | None = None,
+    ) -> None:
+        self.directory = directory
+        self.group = group
+        # installing or removing a distribution touches its site directory
+        self.search_path = [
+            p
+            for p in (sys.path if search_path is None else search_path)
+            if p.endswith(("site-packages", "dist-packages"))
+        ]
+        # every interpreter has site directories of its own; keep a cache for each
+        key = hashlib.sha1(
+            "\0".join([str(directory)] + self.search_path).encode()
+        ).hexdigest()[:12]
+        self.cache_path = cache_dir / f"plugins-{key}.json"
+        self.scans = 0
+
+    def _stamp(self) -> Stamp:
+        paths = [self.directory, *sorted(self.directory.glob("*.toml"))]
+        paths += [Path(p) for p in self.search_path]
+        return [(str(p), _mtime(p)) for p in paths]
+
+    def _scan(self) -> List[PluginCommand]:
+        self.scans += 1
+        commands: List[PluginCommand] = []
+        for path in sorted(self.directory.glob("*.toml")):
+            try:
+                commands += _parse_manifest(path)
+            except (OSError, tomllib.TOMLDecodeError):
+                continue
+        try:
+            commands += _entry_point_commands(self.group)
+        except Exception:
+            pass
+        return commands
+
+    def _read_cache(self, stamp: Stamp) -> List[PluginCommand] | None:
+        try:
+            data = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != _VERSION or data.get("stamp") != stamp:
+            return None
+        try:
+            return [PluginCommand(**entry) for entry in data["commands"]]
+        except (KeyError, TypeError):
+            return None
+
+    def _write_cache(self, stamp: Stamp, commands: List[PluginCommand]) -> None:
+        data = {
+            "version": _VERSION,
+            "stamp": stamp,
+            "commands": [asdict(c) for c in commands],
+        }
+        partial = self.cache_path.with_name(f".{self.cache_path.name}.{os.getpid()}")
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            partial.write_text(json.dumps(data))
+            os.replace(partial, self.cache_path)
+        except OSError:
+            pass
+
+    def load(self) -> Dict[str, PluginCommand]:
+        """Return the plugin commands by name; the first manifest wins a clash."""
+        stamp = [list(item) for item in self._stamp()]
+        commands = self._read_cache(stamp)
+        if commands is None:
+            commands = self._scan()
+            self._write_cache(stamp, commands)
+        found: Dict[str, PluginCommand] = {}
+        for command in commands:
+            found.setdefault(command.name, command)
+        return found
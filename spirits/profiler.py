@@ -0,0 +1,134 @@
+"""Low-overhead sampling profiler writing collapsed stacks.
+
+A daemon thread wakes every ``interval`` seconds, walks the stacks of all
+other threads via ``sys._current_frames`` and counts each distinct stack.
+``dump`` writes the counts in the collapsed format read by ``flamegraph.pl``
+and speedscope: one ``frame;frame;frame count`` line per stack.
+
+The module uses only the standard library so that it can also be run as a
+script around a ``/py`` snippet::
+
+    python -I spirits/profiler.py OUT.folded CODE
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+DEFAULT_INTERVAL = 0.005
+# tells apart profiles taken by one process within the same second
+_SEQUENCE = itertools.count()
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename.rsplit("/", 1)[-1]
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Sample the stacks of every other thread in this process."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="letsgo-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self) -> None:
+        self.stacks = {}
+        self.samples = 0
+
+    def _loop(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = _collapse(frame)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def dump(self, path: Path) -> Path:
+        """Write the collected stacks to ``path`` in collapsed format."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stacks = dict(self.stacks)
+        with path.open("w") as fh:
+            for stack, count in sorted(stacks.items()):
+                fh.write(f"{stack} {count}\n")
+        return path
+
+
+def profile_path(directory: Path, label: str) -> Path:
+    """Return a fresh file name under ``directory`` for ``label``.
+
+    The time stamp keeps names in order; the pid and a per-process counter
+    keep two profiles taken in the same second from sharing one.
+    """
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+    return directory / f"{stamp}-{os.getpid()}-{next(_SEQUENCE)}-{label}.folded"
+
+
+def control(sampler: Sampler, action: str, directory: Path, label: str) -> str:
+    """Apply ``start``, ``stop`` or ``dump`` to ``sampler``; return a reply."""
+    if action == "start":
+        if sampler.running:
+            return "profiler already running"
+        sampler.reset()
+        sampler.start()
+        return "profiler started"
+    if action in {"stop", "dump"}:
+        if not sampler.running:
+            return "profiler not running"
+        if action == "stop":
+            sampler.stop()
+        path = sampler.dump(profile_path(directory, label))
+        return f"{sampler.samples} samples written to {path}"
+    return "Usage: start|stop|dump"
+
+
+def _main(argv: list[str]) -> int:
+    out, code = Path(argv[1]), argv[2]
+    sampler = Sampler()
+    sampler.start()
+    try:
+        exec(compile(code, "<py>", "exec"), {"__name__": "__main__"})
+    finally:
+        sampler.stop()
+        sampler.dump(out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,192 @@
+"""Run commands on a pseudo-terminal.
+
+Behind pipes, programs block-buffer their output and full-screen programs
+such as ``top``, ``vim`` or ``less`` refuse to draw or wait forever.
+``PtyProcess`` gives the command a controlling terminal of a given size and
+relays raw bytes both ways, so letsgo can wire it to the local terminal and
+the bridge to a websocket.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import os
+import pty
+import re
+import signal
+import struct
+import termios
+from typing import Callable, Dict
+
+from . import limits
+
+TUI_PROGRAMS = frozenset(
+    {
+        "htop",
+        "less",
+        "man",
+        "mc",
+        "more",
+        "nano",
+        "nvim",
+        "screen",
+        "tmux",
+        "top",
+        "vi",
+        "vim",
+        "watch",
+    }
+)
+CHUNK = 65536
+# input a program isn't reading is dropped beyond this
+MAX_PENDING = 1024 * 1024
+
+_ANSI = re.compile(r"\x1b(\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(\x07|\x1b\\)|[@-Z\\-_])")
+
+
+def is_tui(command: str) -> bool:
+    """Whether ``command`` starts a known full-screen program."""
+    words = command.split()
+    return bool(words) and os.path.basename(words[0]) in TUI_PROGRAMS
+
+
+def plain(data: bytes) -> str:
+    """Turn captured terminal output into text lines.
+
+    Escape sequences are dropped and a carriage return keeps only what was
+    drawn after it, the way progress bars end up on screen.
+    """
+    text = _ANSI.sub("", data.decode(errors="replace"))
+    lines = [line.rstrip("\r").rsplit("\r", 1)[-1] for line in text.split("\n")]
+    return "\n".join(lines)
+
+
+def _set_size(fd: int, rows: int, cols: int) -> None:
+    fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+
+class PtyProcess:
+    """A command whose stdin, stdout and stderr are one pseudo-terminal."""
+
+    def __init__(self, proc: limits.Child, master: int) -> None:
+        self.proc = proc
+        self.master = master
+        self._loop = asyncio.get_running_loop()
+        self._pending = bytearray()
+        self._writing = False
+
+    @classmethod
+    async def spawn(
+        cls,
+        command: str,
+        rows: int = 24,
+        cols: int = 80,
+        slot: limits.Slot | None = None,
+        env: Dict[str, str] | None = None,
+    ) -> "PtyProcess":
+        master, slave = pty.openpty()
+        _set_size(master, rows, cols)
+        os.set_blocking(master, False)
+        env = dict(os.environ if env is None else env)
+        env.setdefault("TERM", "xterm-256color")
+
+        def _preexec() -> None:
+            # the child is already a session leader; adopt the PTY as its tty
+            fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+        try:
+            proc = await limits.spawn(
+                slot or limits.Slot(),
+                command,
+                shell=True,
+                preexec=_preexec,
+                stdin=slave,
+                stdout=slave,
+                stderr=slave,
+                env=env,
+            )
+        except BaseException:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+        return cls(proc, master)
+
+    async def _ready(self, add: Callable, remove: Callable) -> None:
+        future = self._loop.create_future()
+        add(self.master, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            remove(self.master)
+
+    async def read(self) -> bytes:
+        """Return the next chunk of output, or b"" once the terminal closes."""
+        while True:
+            try:
+                return os.read(self.master, CHUNK)
+            except BlockingIOError:
+                await self._ready(self._loop.add_reader, self._loop.remove_reader)
+            except OSError:
+                # EIO: every process holding the slave side has exited
+                return b""
+
+    def write(self, data: bytes) -> None:
+        """Queue ``data`` as keyboard input without blocking the loop."""
+        if len(self._pending) + len(data) > MAX_PENDING:
+            return
+        self._pending += data
+        self._flush()
+
+    def _flush(self) -> None:
+        while self._pending:
+            try:
+                written = os.write(self.master, self._pending)
+            except BlockingIOError:
+                break
+            except OSError:
+                self._pending.clear()
+                break
+            del self._pending[:written]
+        if self._pending and not self._writing:
+            self._loop.add_writer(self.master, self._flush)
+            self._writing = True
+        elif not self._pending and self._writing:
+            self._loop.remove_writer(self.master)
+            self._writing = False
+
+    def resize(self, rows: int, cols: int) -> None:
+        """Change the window size; the kernel sends SIGWINCH to the program."""
+        try:
+            _set_size(self.master, rows, cols)
+        except OSError:
+            pass
+
+    async def wait(self) -> int:
+        return await self.proc.wait()
+
+    async def terminate(self, grace: float = 2) -> None:
+        """Hang up the terminal's process group, then kill what is left."""
+        for sig in (signal.SIGHUP, signal.SIGKILL):
+            try:
+                os.killpg(self.proc.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                break
+            if sig == signal.SIGHUP:
+                # the leader may exit on the hangup while jobs that ignore it
+                # stay in the group, so the group is killed either way
+                try:
+                    await asyncio.wait_for(asyncio.shield(self.proc.wait()), grace)
+                except asyncio.TimeoutError:
+                    pass
+        await self.proc.wait()
+
+    def close(self) -> None:
+        if self._writing:
+            self._loop.remove_writer(self.master)
+            self._writing = False
+        try:
+            os.close(self.master)
+        except OSError:
+            pass
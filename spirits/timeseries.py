@@ -0,0 +1,233 @@
+"""Fixed-size, multi-resolution history of system metrics.
+
+Each named series keeps three ring buffers backed by ``array('d')``: one point
+per second for five minutes, one per minute for a day and one per hour for a
+month. Finer points are averaged into the coarser rings as they fill, so the
+memory used per series is constant (about 20 KiB).
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List
+
+# (name, seconds per point, capacity)
+LEVELS = (("1s", 1, 300), ("1m", 60, 1440), ("1h", 3600, 720))
+MAX_SERIES = 32
+SPARKS = "▁▂▃▄▅▆▇█"
+
+_MAGIC = b"LGTS"
+_VERSION = 2
+_HEADER = struct.Struct("<4sHH")
+# pos, size and the number of points ever appended, which tells a reader
+# how many of the slots changed since it last looked
+_RING = struct.Struct("<IIQ")
+_RING_V1 = struct.Struct("<II")
+_ACC = struct.Struct("<dI")
+
+
+class Ring:
+    """Circular buffer of floats with a fixed capacity."""
+
+    __slots__ = ("data", "pos", "size", "total")
+
+    def __init__(self, capacity: int) -> None:
+        self.data = array("d", bytes(8 * capacity))
+        self.pos = 0
+        self.size = 0
+        self.total = 0
+
+    def append(self, value: float) -> None:
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.data)
+        if self.size < len(self.data):
+            self.size += 1
+        self.total += 1
+
+    def values(self) -> List[float]:
+        """Return the stored points, oldest first."""
+        start = (self.pos - self.size) % len(self.data)
+        if start + self.size <= len(self.data):
+            return self.data[start : start + self.size].tolist()
+        return (self.data[start:] + self.data[: self.pos]).tolist()
+
+
+class Series:
+    """One metric at every resolution in ``LEVELS``."""
+
+    __slots__ = ("rings", "acc")
+
+    def __init__(self) -> None:
+        self.rings = [Ring(capacity) for _, _, capacity in LEVELS]
+        # running (sum, count) that feeds each coarser ring
+        self.acc = [[0.0, 0] for _ in LEVELS[1:]]
+
+    def add(self, value: float) -> None:
+        self.rings[0].append(value)
+        for level in range(1, len(LEVELS)):
+            acc = self.acc[level - 1]
+            acc[0] += value
+            acc[1] += 1
+            if acc[1] < LEVELS[level][1] // LEVELS[level - 1][1]:
+                break
+            value = acc[0] / acc[1]
+            acc[0], acc[1] = 0.0, 0
+            self.rings[level].append(value)
+
+
+class History:
+    """Named ``Series`` with binary persistence."""
+
+    def __init__(self) -> None:
+        self.series: Dict[str, Series] = {}
+
+    def record(self, values: Dict[str, float]) -> None:
+        """Add one per-second sample for every metric in ``values``."""
+        for name, value in values.items():
+            series = self.series.get(name)
+            if series is None:
+                if len(self.series) >= MAX_SERIES:
+                    continue
+                series = self.series[name] = Series()
+            series.add(value)
+
+    def window(self, name: str, seconds: int) -> List[float]:
+        """Return the points of ``name`` covering the last ``seconds``.
+
+        The finest resolution that spans the whole window is used.
+        """
+        series = self.series.get(name)
+        if series is None:
+            return []
+        for level, (_, step, capacity) in enumerate(LEVELS):
+            if seconds <= step * capacity or level == len(LEVELS) - 1:
+                points = series.rings[level].values()
+                return points[-max(1, seconds // step) :]
+        return []
+
+    def save(self, path: Path) -> None:
+        """Write all series to ``path`` atomically."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # per process, so two writers never interleave in one temporary file
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp.open("wb") as fh:
+                fh.write(_HEADER.pack(_MAGIC, _VERSION, len(self.series)))
+                for name, series in self.series.items():
+                    encoded = name.encode()
+                    fh.write(struct.pack("<H", len(encoded)) + encoded)
+                    for ring in series.rings:
+                        fh.write(_RING.pack(ring.pos, ring.size, ring.total))
+                        ring.data.tofile(fh)
+                    for total, count in series.acc:
+                        fh.write(_ACC.pack(total, count))
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> "History":
+        """Read a history written by ``save``; start empty if unreadable."""
+        history = cls()
+        try:
+            with path.open("rb") as fh:
+                magic, version, count = _HEADER.unpack(fh.read(_HEADER.size))
+                if magic != _MAGIC or version not in (1, _VERSION):
+                    return history
+                header = _RING if version == _VERSION else _RING_V1
+                for _ in range(min(count, MAX_SERIES)):
+                    (length,) = struct.unpack("<H", fh.read(2))
+                    name = fh.read(length).decode()
+                    series = Series()
+                    for ring, (_, _, capacity) in zip(series.rings, LEVELS):
+                        ring.pos, ring.size, *total = header.unpack(
+                            fh.read(header.size)
+                        )
+                        ring.total = total[0] if total else ring.size
+                        if ring.pos >= capacity or ring.size > capacity:
+                            return cls()
+                        ring.data = array("d")
+                        ring.data.fromfile(fh, capacity)
+                    for acc in series.acc:
+                        acc[0], acc[1] = _ACC.unpack(fh.read(_ACC.size))
+                    history.series[name] = series
+        except (OSError, EOFError, struct.error, UnicodeDecodeError):
+            return cls()
+        return history
+
+    def refresh(self, path: Path) -> None:
+        """Catch up with a later ``save`` of this history at ``path``.
+
+        Only the points appended since this history was loaded or refreshed
+        are read. A file that does not continue it is loaded whole.
+        """
+        try:
+            with path.open("rb") as fh:
+                if self._read_new(fh):
+                    return
+        except (OSError, EOFError, struct.error):
+            pass
+        self.series = type(self).load(path).series
+
+    def _read_new(self, fh: BinaryIO) -> bool:
+        magic, version, count = _HEADER.unpack(fh.read(_HEADER.size))
+        if (magic, version, count) != (_MAGIC, _VERSION, len(self.series)):
+            return False
+        for name, series in self.series.items():
+            encoded = name.encode()
+            if fh.read(2 + len(encoded)) != struct.pack("<H", len(encoded)) + encoded:
+                return False
+            for ring in series.rings:
+                pos, size, total = _RING.unpack(fh.read(_RING.size))
+                start = fh.tell()
+                capacity = len(ring.data)
+                new = total - ring.total
+                if new < 0 or size != min(capacity, ring.size + new):
+                    return False
+                if (ring.pos + new) % capacity != pos:
+                    return False
+                if new >= capacity:
+                    _read_slots(fh, start, ring, 0, capacity)
+                else:
+                    first = min(new, capacity - ring.pos)
+                    _read_slots(fh, start, ring, ring.pos, first)
+                    _read_slots(fh, start, ring, 0, new - first)
+                ring.pos, ring.size, ring.total = pos, size, total
+                fh.seek(start + 8 * capacity)
+            for acc in series.acc:
+                acc[0], acc[1] = _ACC.unpack(fh.read(_ACC.size))
+        return True
+
+
+def _read_slots(fh: BinaryIO, start: int, ring: Ring, index: int, count: int) -> None:
+    """Copy ``count`` points from slot ``index`` of a ring saved at ``start``."""
+    if count:
+        fh.seek(start + 8 * index)
+        points = array("d")
+        points.fromfile(fh, count)
+        ring.data[index : index + count] = points
+
+
+def sparkline(values: Iterable[float], width: int = 60) -> str:
+    """Render ``values`` as a sparkline at most ``width`` characters wide."""
+    points = [v for v in values if not math.isnan(v)]
+    if not points:
+        return ""
+    if len(points) > width:
+        step = len(points) / width
+        points = [
+            sum(chunk) / len(chunk)
+            for chunk in (
+                points[int(i * step) : int((i + 1) * step)] for i in range(width)
+            )
+            if chunk
+        ]
+    low, high = min(points), max(points)
+    span = (high - low) or 1.0
+    top = len(SPARKS) - 1
+    return "".join(SPARKS[round((v - low) / span * top)] for v in points)
@@ -0,0 +1,361 @@
+"""Trace spans from the bridge through letsgo sessions down to Johny.
+
+A trace starts at a bridge entry point (Telegram message, ``POST /run`` or a
+websocket command). ``LetsGoProcess.run`` prefixes the line it writes to the
+session's stdin with ``MARKER`` and a W3C ``traceparent`` value, and letsgo
+strips it again with ``extract`` so the spans recorded in the child join the
+same trace. The current span lives in a context variable, which follows
+``await`` and ``asyncio.to_thread`` without being passed around.
+
+Finished spans are appended as JSON lines to
+``TRACE_DIR/<service>-<pid>.jsonl``. Every session is a process of its own, so
+files pile up: each time a process opens its file, ``prune`` removes the files
+of exited processes that are older than ``MAX_AGE`` or that exceed
+``DIR_BYTES`` together. ``export_otlp`` turns spans into an OTLP/JSON document
+for a collector, and ``python -m spirits.tracing`` prints the slowest recent
+traces with the time spent in each stage.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, List, Tuple
+
+TRACE_DIR = Path(os.getenv("LETSGO_TRACE_DIR", str(Path.home() / ".letsgo" / "traces")))
+ENABLED = os.getenv("LETSGO_TRACE", "1").lower() not in {"0", "false", "no", "off"}
+MAX_BYTES = 4 * 1024 * 1024
+# budget for the files of processes that have exited
+DIR_BYTES = 64 * 1024 * 1024
+MAX_AGE = 7 * 86400
+# how far back ``load`` reads by default
+RECENT = 86400
+# ASCII record separator: never typed at the prompt, so it can't collide
+MARKER = "\x1e"
+SERVICE = "letsgo"
+
+Context = Tuple[str, str]
+
+_CURRENT: ContextVar[Context | None] = ContextVar("letsgo_trace", default=None)
+_FILE: IO[str] | None = None
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def current() -> Context | None:
+    """Return ``(trace_id, span_id)`` of the active span, if any."""
+    return _CURRENT.get()
+
+
+def traceparent() -> str | None:
+    context = _CURRENT.get()
+    if context is None:
+        return None
+    return f"00-{context[0]}-{context[1]}-01"
+
+
+def parse(header: str | None) -> Context | None:
+    """Parse a ``traceparent`` value, returning None if it is malformed."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    trace_id, span_id = parts[1].lower(), parts[2].lower()
+    try:
+        if not int(trace_id, 16) or not int(span_id, 16):
+            return None
+    except ValueError:
+        return None
+    return trace_id, span_id
+
+
+def inject(line: str) -> str:
+    """Prefix ``line`` with the active span so the child can continue it."""
+    header = traceparent()
+    return f"{MARKER}{header} {line}" if header else line
+
+
+def extract(line: str) -> Tuple[str, Context | None]:
+    """Split a line written by ``inject`` into the command and its parent."""
+    if not line.startswith(MARKER):
+        return line, None
+    header, _, rest = line[len(MARKER) :].partition(" ")
+    return rest, parse(header)
+
+
+@contextmanager
+def span(
+    name: str, parent: Context | None = None, **attrs: Any
+) -> Iterator[Dict[str, Any]]:
+    """Record ``name`` as a child of ``parent`` or of the active span.
+
+    The attribute dict is yielded so callers can add results such as an exit
+    code before the span ends.
+    """
+    if not ENABLED:
+        yield attrs
+        return
+    parent = parent or _CURRENT.get()
+    trace_id = parent[0] if parent else _new_id(16)
+    span_id = _new_id(8)
+    token = _CURRENT.set((trace_id, span_id))
+    start = time.time_ns()
+    error = None
+    try:
+        yield attrs
+    except BaseException as exc:
+        error = type(exc).__name__
+        raise
+    finally:
+        _CURRENT.reset(token)
+        _write(
+            {
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_id": parent[1] if parent else None,
+                "name": name,
+                "service": SERVICE,
+                "start": start,
+                "end": time.time_ns(),
+                "attrs": attrs,
+                "error": error,
+            }
+        )
+
+
+def _path() -> Path:
+    return TRACE_DIR / f"{SERVICE}-{os.getpid()}.jsonl"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _owner(path: Path) -> int | None:
+    """Return the pid in ``<service>-<pid>.jsonl[.1]``."""
+    pid = path.name.partition(".jsonl")[0].rpartition("-")[2]
+    return int(pid) if pid.isdigit() else None
+
+
+def prune(
+    directory: Path | None = None,
+    budget: int = DIR_BYTES,
+    max_age: float = MAX_AGE,
+) -> int:
+    """Remove trace files of exited processes; return how many were removed.
+
+    Files older than ``max_age`` seconds go first, then the oldest ones until
+    the rest fit in ``budget`` bytes. Files of live processes are kept: each
+    is bounded by ``MAX_BYTES`` and one rotated segment.
+    """
+    directory = directory or TRACE_DIR
+    files = []
+    for path in directory.glob("*.jsonl*"):
+        pid = _owner(path)
+        if pid is None or pid == os.getpid() or _alive(pid):
+            continue
+        try:
+            info = path.stat()
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, path))
+    files.sort()
+    cutoff = time.time() - max_age
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= budget:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _write(record: Dict[str, Any]) -> None:
+    global _FILE
+    try:
+        if _FILE is None:
+            TRACE_DIR.mkdir(parents=True, exist_ok=True)
+            prune()
+            _FILE = _path().open("a", buffering=1)
+        _FILE.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+        if _FILE.tell() > MAX_BYTES:
+            # keep one rotated segment so a busy process stays bounded
+            path = Path(_FILE.name)
+            close()
+            os.replace(path, path.with_name(path.name + ".1"))
+    except OSError:
+        pass
+
+
+def close() -> None:
+    """Close the trace file; the next span reopens it under ``TRACE_DIR``."""
+    global _FILE
+    if _FILE is not None:
+        _FILE.close()
+        _FILE = None
+
+
+def load(directory: Path | None = None, since: float = RECENT) -> List[Dict[str, Any]]:
+    """Read the spans of the files under ``directory`` written in ``since`` seconds."""
+    directory = directory or TRACE_DIR
+    cutoff = time.time() - since
+    spans = []
+    for path in sorted(directory.glob("*.jsonl*")):
+        try:
+            if path.stat().st_mtime < cutoff:
+                continue
+            with path.open() as fh:
+                for line in fh:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return spans
+
+
+def group(spans: Iterable[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for record in spans:
+        traces.setdefault(record["trace_id"], []).append(record)
+    for records in traces.values():
+        records.sort(key=lambda record: record["start"])
+    return traces
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def export_otlp(spans: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Convert spans to an OTLP/JSON ``ExportTraceServiceRequest``."""
+    services: Dict[str, List[Dict[str, Any]]] = {}
+    for record in spans:
+        otlp = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(record["start"]),
+            "endTimeUnixNano": str(record["end"]),
+            "attributes": [_attribute(k, v) for k, v in record["attrs"].items()],
+            "status": (
+                {"code": 2, "message": record["error"]}
+                if record.get("error")
+                else {"code": 0}
+            ),
+        }
+        if record.get("parent_id"):
+            otlp["parentSpanId"] = record["parent_id"]
+        services.setdefault(record["service"], []).append(otlp)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_attribute("service.name", service)]},
+                "scopeSpans": [{"scope": {"name": "letsgo"}, "spans": records}],
+            }
+            for service, records in sorted(services.items())
+        ]
+    }
+
+
+def _duration(record: Dict[str, Any]) -> float:
+    return (record["end"] - record["start"]) / 1e9
+
+
+def _roots(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    ids = {record["span_id"] for record in records}
+    return [record for record in records if record.get("parent_id") not in ids]
+
+
+def render(records: List[Dict[str, Any]]) -> str:
+    """Show one trace as an indented tree of offsets and durations."""
+    children: Dict[str | None, List[Dict[str, Any]]] = {}
+    for record in records:
+        children.setdefault(record.get("parent_id"), []).append(record)
+    roots = _roots(records)
+    origin = min(record["start"] for record in records)
+    lines = [f"trace {records[0]['trace_id']}"]
+
+    def _walk(record: Dict[str, Any], depth: int) -> None:
+        attrs = " ".join(f"{k}={v}" for k, v in record["attrs"].items())
+        error = f" error={record['error']}" if record.get("error") else ""
+        lines.append(
+            f"{'  ' * depth}+{(record['start'] - origin) / 1e9:.3f}s "
+            f"{_duration(record):8.3f}s {record['service']}:{record['name']}"
+            f"{' ' + attrs if attrs else ''}{error}"
+        )
+        for child in children.get(record["span_id"], []):
+            _walk(child, depth + 1)
+
+    for root in roots:
+        _walk(root, 1)
+    return "\n".join(lines)
+
+
+def slowest(spans: Iterable[Dict[str, Any]], limit: int = 5) -> str:
+    traces = group(spans)
+    ranked = sorted(
+        traces.values(),
+        key=lambda records: max(_duration(root) for root in _roots(records)),
+        reverse=True,
+    )
+    return "\n\n".join(render(records) for records in ranked[:limit])
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m spirits.tracing")
+    parser.add_argument("--dir", type=Path, default=None)
+    parser.add_argument("--trace", help="show only this trace id")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument(
+        "--hours", type=float, default=RECENT / 3600, help="read files this recent"
+    )
+    parser.add_argument("--otlp", type=Path, help="write an OTLP/JSON export here")
+    args = parser.parse_args(argv)
+
+    spans = load(args.dir, args.hours * 3600)
+    if args.trace:
+        spans = [record for record in spans if record["trace_id"] == args.trace]
+    if args.otlp:
+        args.otlp.write_text(json.dumps(export_otlp(spans)))
+        print(f"{len(spans)} spans written to {args.otlp}")
+        return 0
+    if not spans:
+        print("no traces recorded")
+        return 1
+    print(slowest(spans, args.limit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
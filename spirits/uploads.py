@@ -0,0 +1,262 @@
+"""Uploads stored once per content, however often and under whatever name.
+
+Every upload is written to a temporary file while its SHA-256 is computed,
+then moved to ``.blobs/<2 hex>/<62 hex>`` under the upload directory, unless
+a blob with that digest is already there, in which case the copy is dropped.
+That holds for uploads of the same data racing each other too: the first
+to store the blob wins and the others use it.
+The name it was uploaded under is a hard link to the blob, so re-uploading
+a multi-GB artifact costs no space, and a client that knows the digest can
+check for the blob first and skip the transfer altogether.
+
+A blob's link count tells how many names use it: ``collect`` removes the
+blobs whose names are all gone. Writing to one name in place changes every
+other name of the same blob. Blobs are made read-only, which keeps editors
+that rename a new file over the old one from doing that, but not root or
+anyone who chmods the file first. So a blob is hashed again before it is
+reused, unless it kept the size and mtime it had when last hashed, and one
+that no longer matches its digest is dropped from the store.
+
+Telegram sends no digest, only a ``file_unique_id`` that stays the same for
+the same file; ``remember`` keeps which blob such a key was stored as.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import stat
+import tempfile
+import time
+from pathlib import Path
+from typing import IO, Dict, Tuple
+
+BLOB_DIR = ".blobs"
+CHUNK = 1 << 20
+# temporary files and fresh blobs younger than this are left to collect
+GRACE = 3600.0
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+_KEY = re.compile(r"[\w-]{1,128}")
+
+
+class UploadError(ValueError):
+    """A name, digest or upload the store can't accept."""
+
+
+def safe_name(name: str) -> str:
+    """Return the file part of ``name``, refusing names that leave the store."""
+    base = name.replace("\\", "/").rpartition("/")[2]
+    if base in ("", ".", "..", BLOB_DIR) or "\0" in base:
+        raise UploadError(f"invalid file name: {name!r}")
+    return base
+
+
+class Writer:
+    """A blob being written: it is hashed as the data goes in."""
+
+    def __init__(self, store: UploadStore) -> None:
+        self.store = store
+        fd, path = tempfile.mkstemp(dir=store.tmp_dir)
+        self.path = Path(path)
+        self._fh = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self._fh.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def commit(self, name: str, expected: str | None = None) -> Tuple[str, bool]:
+        """Store the data under ``name``; return its digest and whether it was new.
+
+        ``expected`` is the digest the client announced: data that doesn't
+        match it, such as a truncated transfer, is dropped.
+        """
+        self._fh.close()
+        digest = self._hash.hexdigest()
+        try:
+            if expected is not None and expected != digest:
+                raise UploadError(f"sha256 mismatch: got {digest}")
+            blob = self.store.blob(digest)
+            while True:
+                try:
+                    self.store.link(digest, name)
+                    return digest, False
+                except FileNotFoundError:
+                    # not stored, or collected meanwhile: keep this copy
+                    pass
+                blob.parent.mkdir(exist_ok=True)
+                os.chmod(self.path, 0o444)
+                try:
+                    # unlike a rename this fails, rather than replacing the
+                    # blob, when an upload of the same data stored it first
+                    os.link(self.path, blob)
+                except FileExistsError:
+                    continue
+                self.store._hashed(digest, blob.stat())
+                self.store.link(digest, name)
+                return digest, True
+        finally:
+            self.path.unlink(missing_ok=True)
+
+    def discard(self) -> None:
+        self._fh.close()
+        self.path.unlink(missing_ok=True)
+
+    def __enter__(self) -> Writer:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        # a no-op once committed
+        self.discard()
+
+
+class UploadStore:
+    """Content-addressed blobs under ``root``, named by hard links."""
+
+    def __init__(self, root: Path | str) -> None:
+        self.root = Path(root)
+        self.blob_dir = self.root / BLOB_DIR
+        self.tmp_dir = self.blob_dir / "tmp"
+        self.key_dir = self.blob_dir / "keys"
+        # digest -> (inode, size, mtime) of the blob when its hash last matched
+        self._checked: Dict[str, Tuple[int, int, int]] = {}
+
+    def blob(self, digest: str) -> Path:
+        if not _DIGEST.fullmatch(digest):
+            raise UploadError(f"invalid sha256: {digest!r}")
+        return self.blob_dir / digest[:2] / digest[2:]
+
+    def _hashed(self, digest: str, info: os.stat_result) -> None:
+        self._checked[digest] = (info.st_ino, info.st_size, info.st_mtime_ns)
+
+    def size(self, digest: str) -> int | None:
+        """Return the size of the blob ``digest``, or ``None`` if it isn't stored.
+
+        A blob written to since it was stored no longer holds ``digest``: it
+        is unlinked from the store, leaving its names as they are.
+        """
+        blob = self.blob(digest)
+        try:
+            info = blob.stat()
+        except FileNotFoundError:
+            return None
+        if self._checked.get(digest) == (info.st_ino, info.st_size, info.st_mtime_ns):
+            return info.st_size
+        sha = hashlib.sha256()
+        try:
+            with blob.open("rb") as fh:
+                while data := fh.read(CHUNK):
+                    sha.update(data)
+        except FileNotFoundError:
+            return None
+        if sha.hexdigest() != digest:
+            self._checked.pop(digest, None)
+            blob.unlink(missing_ok=True)
+            return None
+        self._hashed(digest, info)
+        return info.st_size
+
+    def writer(self) -> Writer:
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        return Writer(self)
+
+    def add(
+        self, source: IO[bytes], name: str, expected: str | None = None
+    ) -> Tuple[str, bool]:
+        """Store what ``source`` reads as under ``name``; see ``Writer.commit``."""
+        with self.writer() as writer:
+            while True:
+                data = source.read(CHUNK)
+                if not data:
+                    break
+                writer.write(data)
+            return writer.commit(name, expected)
+
+    def link(self, digest: str, name: str) -> Path:
+        """Name the stored blob ``digest``; raise ``FileNotFoundError`` if absent.
+
+        A blob that no longer matches ``digest`` counts as absent.
+        """
+        dest = self.root / safe_name(name)
+        if self.size(digest) is None:
+            raise FileNotFoundError(self.blob(digest))
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.tmp_dir / f"link-{os.getpid()}-{time.monotonic_ns()}"
+        os.link(self.blob(digest), tmp)
+        # replacing the old name in one step: readers see one file or the other
+        os.replace(tmp, dest)
+        return dest
+
+    def remember(self, key: str, digest: str) -> None:
+        """Note that the file the client calls ``key`` is the blob ``digest``."""
+        if not _KEY.fullmatch(key):
+            raise UploadError(f"invalid key: {key!r}")
+        self.key_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.tmp_dir / f"key-{os.getpid()}-{time.monotonic_ns()}"
+        tmp.write_text(digest)
+        os.replace(tmp, self.key_dir / key)
+
+    def recall(self, key: str) -> str | None:
+        """Return the digest remembered for ``key`` if that blob is still stored."""
+        if not _KEY.fullmatch(key):
+            return None
+        try:
+            digest = (self.key_dir / key).read_text()
+        except FileNotFoundError:
+            return None
+        return digest if self.size(digest) is not None else None
+
+    def collect(self, grace: float = GRACE) -> Tuple[int, int]:
+        """Remove unnamed blobs and stale leftovers; return their count and bytes.
+
+        Anything younger than ``grace`` seconds is kept, being possibly
+        about to be named by an upload in progress.
+        """
+        cutoff = time.time() - grace
+        count = freed = 0
+        blobs = [
+            (blob, True)
+            for sub in sorted(self.blob_dir.glob("[0-9a-f][0-9a-f]"))
+            for blob in sub.iterdir()
+        ]
+        for path, is_blob in blobs + [(p, False) for p in self.tmp_dir.glob("*")]:
+            try:
+                info = path.lstat()
+            except FileNotFoundError:
+                # another worker collecting at the same time
+                continue
+            if info.st_mtime > cutoff or not stat.S_ISREG(info.st_mode):
+                continue
+            if is_blob and info.st_nlink > 1:
+                continue
+            path.unlink(missing_ok=True)
+            count += 1
+            freed += info.st_size
+        for key in self.key_dir.glob("*"):
+            if self.recall(key.name) is None:
+                key.unlink(missing_ok=True)
+        return count, freed
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m spirits.uploads",
+        description="Remove uploaded blobs that no name refers to any more.",
+    )
+    parser.add_argument("root", type=Path, help="the upload directory")
+    parser.add_argument(
+        "--grace", type=float, default=GRACE, help="keep files younger than this"
+    )
+    args = parser.parse_args(argv)
+    count, freed = UploadStore(args.root).collect(args.grace)
+    print(f"removed {count} files, {freed} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
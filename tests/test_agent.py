@@ -0,0 +1,99 @@
+import asyncio
+import os
+import signal
+import time
+from contextlib import aclosing
+from types import SimpleNamespace
+
+import pytest
+
+from spirits import agent
+
+
+def test_frames_are_length_prefixed():
+    async def _read(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await agent.read_frame(reader)
+
+    frame = agent.encode(agent.RUN, b"tg:1\0/ping")
+    assert asyncio.run(_read(frame + b"rest")) == (agent.RUN, b"tg:1\0/ping")
+    with pytest.raises(asyncio.IncompleteReadError):
+        asyncio.run(_read(frame[:-1]))
+    with pytest.raises(agent.AgentError):
+        asyncio.run(_read(agent._HEADER.pack(agent.MAX_FRAME + 1, agent.OUTPUT)))
+
+
+def test_idle_and_dead_sessions_are_reaped(monkeypatch):
+    started = []
+
+    async def _start(self):
+        started.append(self)
+        self.proc = SimpleNamespace(pid=len(started), returncode=None)
+
+    async def _stop(self):
+        self.proc = None
+
+    monkeypatch.setattr(agent.LetsGoProcess, "start", _start)
+    monkeypatch.setattr(agent.LetsGoProcess, "stop", _stop)
+    now = [0.0]
+    keeper = agent.Agent(idle=10, clock=lambda: now[0])
+
+    async def _run():
+        opened = await asyncio.gather(keeper.open("a"), keeper.open("a"))
+        assert [fresh for _, fresh in opened] == [True, False]
+        assert opened[0][0] is opened[1][0] and len(started) == 1
+        await keeper.open("b")
+        now[0] = 5
+        await keeper.open("b")
+        now[0] = 11
+        assert await keeper.reap() == ["a"]
+        started[1].proc.returncode = 1
+        assert await keeper.reap() == ["b"]
+        _, fresh = await keeper.open("b")
+        assert fresh and len(started) == 3
+
+    asyncio.run(_run())
+
+
+def test_sessions_outlive_their_clients(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("LETSGO_MEMORY_DB", str(tmp_path / "memory.db"))
+    monkeypatch.setenv("LETSGO_TELEMETRY_DIR", str(tmp_path / "telemetry"))
+    path = tmp_path / "run" / "agent.sock"
+
+    async def _run():
+        # the first client finds no agent and starts one
+        first = agent.AgentSession("tg:1", path)
+        await first.start()
+        async with aclosing(first.stream("/run sleep 0.3; echo late")) as chunks:
+            async for _ in chunks:
+                break
+        # a bridge that restarted gets the same letsgo back
+        second = agent.AgentSession("tg:1", path)
+        await second.start()
+        assert second.pid == first.pid
+        assert await second.run("/ping") == "pong"
+        reply = await second.run("/run echo $PPID")
+        assert str(first.pid) in reply.split()
+        # the exit code comes back in the EXIT frame, not in the output
+        assert "no" in (await second.run("/run echo no; exit 3")).splitlines()
+        assert second.last_rc == 3
+        assert await second.run("/ping") == "pong" and second.last_rc == 0
+        assert list(await agent.sessions(path)) == ["tg:1"]
+        assert await agent.serve(path) == 1
+        await second.stop()
+        assert await agent.sessions(path) == {}
+        return first.pid
+
+    try:
+        pid = asyncio.run(_run())
+    finally:
+        os.kill(int(path.with_suffix(".pid").read_text()), signal.SIGTERM)
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+    deadline = time.monotonic() + 10
+    while path.exists():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
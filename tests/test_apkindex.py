@@ -0,0 +1,119 @@
+import asyncio
+import io
+import os
+import sys
+import tarfile
+import time
+from pathlib import Path
+
+import pytest
+
+from spirits import apkindex
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import letsgo  # noqa: E402
+
+PACKAGES = 50_000
+
+
+def _record(i, installed=False):
+    lines = [
+        f"P:pkg{i:05d}",
+        f"V:1.{i % 10}-r0",
+        f"T:synthetic package number {i}",
+        "A:x86_64",
+        f"S:{1000 + i}",
+        f"I:{4000 + i}",
+        f"D:pkg{(i + 1) % PACKAGES:05d}>=1.0 so:libc.musl-x86_64.so.1 !pkg{i + 2:05d}",
+        f"p:so:libpkg{i}.so.1=1.0",
+    ]
+    if installed:
+        lines += ["F:usr/lib", f"R:libpkg{i}.so.1"]
+    return "\n".join(lines) + "\n\n"
+
+
+def _write_index(path, records):
+    data = "".join(records).encode()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(path, "w:gz") as tar:
+        member = tarfile.TarInfo("DESCRIPTION")
+        member.size = 4
+        tar.addfile(member, io.BytesIO(b"main"))
+        member = tarfile.TarInfo("APKINDEX")
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+
+
+def _write_installed(root, ids):
+    path = root / "lib/apk/db/installed"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(_record(i, installed=True) for i in ids))
+    return path
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    root = tmp_path_factory.mktemp("root")
+    _write_index(
+        root / "var/cache/apk/APKINDEX.0123abcd.tar.gz",
+        (_record(i) for i in range(PACKAGES)),
+    )
+    _write_installed(root, range(0, 100, 10))
+    index = apkindex.PackageIndex(root / "apk.db", root)
+    assert index.refresh() == 2
+    yield index
+    index.close()
+
+
+def test_parse_records_and_dependency_atoms():
+    text = "P:a\nV:1\nD:b>=2 !c so:libz.so.1\nR:x\nR:y\n\nP:b\n"
+    records = list(apkindex.parse_records(io.StringIO(text)))
+    assert [r["P"] for r in records] == [["a"], ["b"]]
+    assert records[0]["R"] == ["x", "y"]
+    assert list(apkindex._atoms(records[0]["D"][0])) == ["b", "so:libz.so.1"]
+
+
+def test_queries_over_fifty_thousand_packages(index):
+    start = time.perf_counter()
+    found = index.search("pkg4999")
+    info = index.info("pkg00010")
+    installed = index.installed()
+    elapsed = time.perf_counter() - start
+    assert [row[0] for row in found] == [f"pkg4999{d}" for d in range(10)]
+    assert info["installed"] and info["version"] == "1.0-r0"
+    assert info["depends"] == ["pkg00011", "so:libc.musl-x86_64.so.1"]
+    assert info["provides"] == ["so:libpkg10.so.1"]
+    assert info["required_by"] == ["pkg00009"]
+    assert len(installed) == 10 and installed[0] == ("pkg00000", "1.0-r0")
+    assert index.search("number 4242", description=True)[0][0] == "pkg04242"
+    assert index.search("100%") == []
+    assert elapsed < 0.5
+
+
+def test_only_changed_sources_are_read_again(index):
+    assert index.refresh() == 0
+    installed = _write_installed(index.root, [7])
+    stat = installed.stat()
+    os.utime(installed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert index.refresh() == 1
+    assert index.installed() == [("pkg00007", "1.7-r0")]
+    assert len(index.search("pkg", limit=PACKAGES * 2)) == PACKAGES
+
+
+def test_pkg_command(tmp_path, monkeypatch):
+    _write_installed(tmp_path, [3])
+    monkeypatch.setattr(
+        letsgo, "PKG_INDEX", apkindex.PackageIndex(tmp_path / "apk.db", tmp_path)
+    )
+    reply, _ = asyncio.run(letsgo.handle_pkg("/pkg info pkg00003"))
+    assert reply.splitlines()[:2] == [
+        "pkg00003-1.3-r0 [installed]",
+        "synthetic package number 3",
+    ]
+    reply, _ = asyncio.run(letsgo.handle_pkg("/pkg search 0003"))
+    assert reply == "pkg00003-1.3-r0 - synthetic package number 3 [installed]"
+    reply, _ = asyncio.run(letsgo.handle_pkg("/pkg installed"))
+    assert reply == "pkg00003-1.3-r0"
+    reply, _ = asyncio.run(letsgo.handle_pkg("/pkg"))
+    assert reply == letsgo.PKG_USAGE
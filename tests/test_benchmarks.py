@@ -0,0 +1,26 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.harness import compare  # noqa: E402
+
+
+def test_compare_flags_regressions_by_direction():
+    baseline = {
+        "latency": {"value": 1.0, "unit": "s", "better": "lower"},
+        "rate": {"value": 100.0, "unit": "req/s", "better": "higher"},
+        "steady": {"value": 10.0, "unit": "s", "better": "lower"},
+    }
+    current = {
+        "latency": {"value": 1.5, "unit": "s", "better": "lower"},
+        "rate": {"value": 70.0, "unit": "req/s", "better": "higher"},
+        "steady": {"value": 10.5, "unit": "s", "better": "lower"},
+    }
+    regressions = compare(current, baseline, 0.2)
+    assert [line.split(":")[0] for line in regressions] == ["latency", "rate"]
+
+
+def test_compare_ignores_missing_results():
+    baseline = {"gone": {"value": 1.0, "unit": "s", "better": "lower"}}
+    assert compare({}, baseline, 0.2) == []
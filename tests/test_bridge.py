@@ -0,0 +1,291 @@
+import asyncio
+import hashlib
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bridge  # noqa: E402
+from spirits import frames  # noqa: E402
+
+
+def test_metrics_requires_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(bridge, "API_TOKEN", "secret")
+    monkeypatch.setattr(bridge.telemetry, "TELEMETRY_DIR", tmp_path)
+    client = TestClient(bridge.app)
+    assert client.get("/metrics", auth=("ops", "wrong")).status_code == 401
+    bridge.MESSAGES.inc("http")
+    response = client.get("/metrics", auth=("ops", "secret"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE letsgo_bridge_messages_total counter" in response.text
+    assert 'letsgo_bridge_messages_total{channel="http"}' in response.text
+
+
+def test_profile_endpoint(monkeypatch, tmp_path):
+    monkeypatch.setattr(bridge, "API_TOKEN", "secret")
+    monkeypatch.setattr(bridge, "PROFILE_DIR", tmp_path)
+    client = TestClient(bridge.app)
+    auth = ("ops", "secret")
+    assert client.post("/profile?action=start", auth=("ops", "x")).status_code == 401
+    assert client.post("/profile?action=bogus", auth=auth).status_code == 400
+    start = client.post("/profile?action=start", auth=auth)
+    assert start.json() == {"output": "profiler started"}
+    stop = client.post("/profile?action=stop", auth=auth)
+    assert "samples written to" in stop.json()["output"]
+    assert list(tmp_path.glob("*-bridge.folded"))
+
+
+def test_pty_command_selection():
+    assert bridge._pty_command("/run -t ls") == "ls"
+    assert bridge._pty_command("/run top -d 1") == "top -d 1"
+    assert bridge._pty_command("vim notes.txt") == "vim notes.txt"
+    assert bridge._pty_command("/run ls") is None
+    assert bridge._pty_command("/status") is None
+    assert bridge._pty_command("ls -l") is None
+
+
+def test_websocket_pty_passthrough(monkeypatch):
+    async def _noop(self):
+        pass
+
+    async def _stream(self, cmd):
+        yield f"ran {cmd}\n".encode()
+
+    logged = []
+    monkeypatch.setattr(bridge, "API_TOKEN", "secret")
+    monkeypatch.setattr(bridge.LetsGoProcess, "start", _noop)
+    monkeypatch.setattr(bridge.LetsGoProcess, "stop", _noop)
+    monkeypatch.setattr(bridge.LetsGoProcess, "stream", _stream)
+    monkeypatch.setattr(bridge.memory, "log_command", lambda *a: logged.append(a))
+    client = TestClient(bridge.app)
+    with client.websocket_connect("/ws?token=secret&sid=pty") as ws:
+        ws.send_text("__resize__ 30 100")
+        ws.send_text("/run -t sh -c 'stty size; read x; echo got:$x'")
+        output = b""
+        while b"30 100" not in output:
+            output += ws.receive_bytes()
+        ws.send_bytes(b"hi\n")
+        while True:
+            message = ws.receive()
+            if message.get("text"):
+                break
+            output += message["bytes"]
+        assert message["text"] == "__pty_exit__ 0"
+        assert b"got:hi" in output
+        ws.send_text("/ping")
+        assert ws.receive_text() == "ran /ping"
+        ws.send_text("__close__")
+    assert logged[0][1] == "sh -c 'stty size; read x; echo got:$x'"
+
+
+def _fake_session(monkeypatch, reply=b"ran it\n", rc=0):
+    async def _noop(self):
+        pass
+
+    async def _stream(self, cmd):
+        for i in range(0, len(reply), 4):
+            yield reply[i : i + 4]
+        self.last_rc = rc
+
+    monkeypatch.setattr(bridge, "API_TOKEN", "secret")
+    monkeypatch.setattr(bridge.LetsGoProcess, "start", _noop)
+    monkeypatch.setattr(bridge.LetsGoProcess, "stop", _noop)
+    monkeypatch.setattr(bridge.LetsGoProcess, "stream", _stream)
+    monkeypatch.setattr(bridge.memory, "log_command", lambda *a: None)
+
+
+def _resumed(ws):
+    kind, payload = frames.decode(ws.receive_bytes())
+    assert kind == frames.RESUMED
+    return frames.resumed(payload)
+
+
+def _eventually(client, predicate, timeout=2.0):
+    # the server handles a disconnect after the client side has returned
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return True
+        client.portal.call(asyncio.sleep, 0.01)
+    return predicate()
+
+
+def _until_exit(ws):
+    kinds, output = [], b""
+    while True:
+        kind, payload = frames.decode(ws.receive_bytes())
+        kinds.append(kind)
+        if kind == frames.OUTPUT:
+            output += payload
+        if kind == frames.EXIT:
+            return kinds, output, frames.exit_status(payload)
+
+
+def test_framed_protocol_streams_chunks(monkeypatch):
+    _fake_session(monkeypatch)
+    client = TestClient(bridge.app)
+    url = "/ws?token=secret&sid=framed"
+    with client.websocket_connect(url, subprotocols=[frames.SUBPROTOCOL]) as ws:
+        assert ws.accepted_subprotocol == frames.SUBPROTOCOL
+        assert _resumed(ws) == (0, 0, False)
+        ws.send_bytes(frames.encode(frames.COMMAND, b"/ping"))
+        kinds, output, rc = _until_exit(ws)
+        assert kinds == [frames.OUTPUT, frames.OUTPUT, frames.EXIT]
+        assert (output, rc) == (b"ran it\n", 0)
+
+        ws.send_bytes(frames.resize_frame(30, 100))
+        ws.send_bytes(frames.encode(frames.COMMAND, b"/run -t stty size; read x"))
+        assert frames.decode(ws.receive_bytes()) == (frames.PTY, b"")
+        ws.send_bytes(frames.encode(frames.INPUT, b"\n"))
+        kinds, output, rc = _until_exit(ws)
+        assert b"30 100" in output and rc == 0
+        ws.send_bytes(frames.encode(frames.CLOSE))
+
+
+def test_framed_exit_carries_the_return_code(monkeypatch):
+    _fake_session(monkeypatch, reply=b"no\n", rc=3)
+    client = TestClient(bridge.app)
+    url = "/ws?token=secret&sid=failing"
+    with client.websocket_connect(url, subprotocols=[frames.SUBPROTOCOL]) as ws:
+        _resumed(ws)
+        ws.send_bytes(frames.encode(frames.COMMAND, b"/run false"))
+        _, output, rc = _until_exit(ws)
+        assert (output, rc) == (b"no\n", 3)
+        ws.send_bytes(frames.encode(frames.CLOSE))
+
+
+def test_framed_protocol_heartbeat(monkeypatch):
+    _fake_session(monkeypatch)
+    monkeypatch.setattr(bridge, "HEARTBEAT_INTERVAL", 0.05)
+    client = TestClient(bridge.app)
+    url = "/ws?token=secret&sid=beat"
+    with client.websocket_connect(url, subprotocols=[frames.SUBPROTOCOL]) as ws:
+        _resumed(ws)
+        kind, payload = frames.decode(ws.receive_bytes())
+        assert kind == frames.HEARTBEAT and len(payload) == 8
+        ws.send_bytes(frames.encode(frames.CLOSE))
+
+
+def test_framed_session_resumes_after_a_disconnect(monkeypatch):
+    _fake_session(monkeypatch)
+    stopped = []
+
+    async def _stop(self):
+        stopped.append(self)
+
+    monkeypatch.setattr(bridge.LetsGoProcess, "stop", _stop)
+    protocols = [frames.SUBPROTOCOL]
+    url = "/ws?token=secret&sid=resume&resume=0"
+    # one portal, so the session's tasks outlive each connection
+    with TestClient(bridge.app) as client:
+        with client.websocket_connect(url, subprotocols=protocols) as ws:
+            assert _resumed(ws) == (0, 0, False)
+            ws.send_bytes(frames.encode(frames.COMMAND, b"/one"))
+            _until_exit(ws)
+            # the reply to this one is lost with the connection
+            ws.send_bytes(frames.encode(frames.COMMAND, b"/two"))
+        assert not stopped
+
+        with client.websocket_connect(url[:-1] + "3", subprotocols=protocols) as ws:
+            assert _resumed(ws) == (3, 6, False)
+            kinds, output, rc = _until_exit(ws)
+            assert (output, rc) == (b"ran it\n", 0)
+            # a second tab on the same sid takes the session over
+            with client.websocket_connect(url, subprotocols=protocols) as other:
+                assert _resumed(other) == (0, 6, False)
+                assert ws.receive()["code"] == bridge.WS_SUPERSEDED
+                other.send_bytes(frames.encode(frames.CLOSE))
+        assert _eventually(client, lambda: stopped)
+        assert "resume" not in bridge.sessions
+
+
+def test_detached_session_stops_after_the_grace_period(monkeypatch):
+    _fake_session(monkeypatch)
+    monkeypatch.setattr(bridge, "WS_GRACE", 0.05)
+    with TestClient(bridge.app) as client:
+        with client.websocket_connect("/ws?token=secret&sid=grace") as ws:
+            ws.send_text("/ping")
+            assert ws.receive_text() == "ran it"
+        assert "grace" in bridge.sessions
+        assert _eventually(client, lambda: "grace" not in bridge.sessions)
+
+
+def test_read_reply_finds_a_prompt_split_across_chunks():
+    async def _run():
+        reader = asyncio.StreamReader()
+        proc = bridge.LetsGoProcess()
+        proc.proc = SimpleNamespace(stdout=reader)
+
+        async def _feed():
+            for piece in (b"line one\n", b"line >", b"> two\n>", b"> "):
+                reader.feed_data(piece)
+                await asyncio.sleep(0.01)
+
+        feeder = asyncio.create_task(_feed())
+        chunks = [chunk async for chunk in proc._read_reply()]
+        await feeder
+        return chunks
+
+    chunks = asyncio.run(_run())
+    assert chunks[0] == b"line one\n"
+    assert b"".join(chunks) == b"line one\nline >> two\n"
+
+
+def test_history_file_stays_bounded(monkeypatch, tmp_path):
+    monkeypatch.setattr(bridge, "HISTORY_ROOT", tmp_path)
+    monkeypatch.setattr(bridge, "HISTORY_BYTES", 200)
+    for i in range(100):
+        bridge._append_history(1, f"/run echo {i}")
+    history = bridge._read_history(1)
+    assert bridge._history_path(1).stat().st_size <= 200
+    assert history[-1] == "/run echo 99"
+    assert all(line.startswith("/run echo ") for line in history)
+
+
+def test_uploads_are_deduplicated(monkeypatch, tmp_path):
+    monkeypatch.setattr(bridge, "API_TOKEN", "secret")
+    monkeypatch.setattr(bridge, "RATE_LIMIT", 0)
+    monkeypatch.setattr(bridge, "UPLOADS", bridge.uploads.UploadStore(tmp_path))
+    client = TestClient(bridge.app)
+    auth = ("ops", "secret")
+    data = b"artifact" * 1000
+    digest = hashlib.sha256(data).hexdigest()
+    assert client.head(f"/blobs/{digest}", auth=auth).status_code == 404
+    assert client.head("/blobs/nothex", auth=auth).status_code == 400
+    first = client.post("/upload", files={"file": ("a.bin", data)}, auth=auth)
+    assert first.json() == {"filename": "a.bin", "sha256": digest, "stored": True}
+    head = client.head(f"/blobs/{digest}", auth=auth)
+    assert head.status_code == 200
+    assert head.headers["content-length"] == str(len(data))
+    # known to the server: named without sending the data again
+    linked = client.put("/upload/b.bin", headers={"x-sha256": digest}, auth=auth)
+    assert linked.json() == {"filename": "b.bin", "sha256": digest, "stored": False}
+    streamed = client.put(
+        "/upload/c.bin", content=iter([data[:10], data[10:]]), auth=auth
+    )
+    assert streamed.json()["stored"] is False
+    cut = client.put(
+        "/upload/d.bin", content=data[:10], headers={"x-sha256": "0" * 64}, auth=auth
+    )
+    assert cut.status_code == 400 and not (tmp_path / "d.bin").exists()
+    with client.websocket_connect(
+        f"/upload?token=secret&name=e.bin&sha256={digest}"
+    ) as ws:
+        assert ws.receive_json()["stored"] is False
+    with client.websocket_connect("/upload?token=secret&name=f.bin") as ws:
+        ws.send_bytes(b"new ")
+        ws.send_bytes(b"data")
+        ws.send_bytes(b"")
+        assert ws.receive_json()["stored"] is True
+    names = ["a.bin", "b.bin", "c.bin", "e.bin"]
+    assert all(os.path.samefile(tmp_path / "a.bin", tmp_path / n) for n in names)
+    assert (tmp_path / "f.bin").read_bytes() == b"new data"
+    assert (
+        client.post("/upload", files={"file": ("..", data)}, auth=auth).status_code
+        == 400
+    )
+    assert client.put("/upload/a%00b", content=data, auth=auth).status_code == 400
@@ -0,0 +1,57 @@
+from spirits import broker
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _pair(tmp_path):
+    clock = _Clock()
+    path = tmp_path / "broker.db"
+    one = broker.Broker(path, "0:1", "/run/w0.sock", ttl=15, clock=clock)
+    two = broker.Broker(path, "1:2", "/run/w1.sock", ttl=15, clock=clock)
+    one.register()
+    two.register()
+    return clock, one, two
+
+
+def test_keys_stay_with_their_live_owner(tmp_path):
+    clock, one, two = _pair(tmp_path)
+    assert one.claim("ws:a") == "/run/w0.sock"
+    assert two.claim("ws:a") == "/run/w0.sock"
+    assert two.claim("ws:b") == "/run/w1.sock"
+    one.release("ws:a")
+    assert two.claim("ws:a") == "/run/w1.sock"
+    # an owner that stops beating, or can't be reached, loses its keys
+    clock.now += 16
+    two.heartbeat()
+    assert two.claim("ws:c") == "/run/w1.sock"
+    one.heartbeat()
+    assert one.claim("ws:c", unreachable="/run/w1.sock") == "/run/w0.sock"
+    clock.now += 16
+    one.heartbeat()
+    assert one.claim("ws:b") == "/run/w0.sock"
+    assert one.workers() == {"0:1": "/run/w0.sock"}
+
+
+def test_restarted_worker_replaces_its_predecessor(tmp_path):
+    clock, one, two = _pair(tmp_path)
+    assert one.claim("ws:a") == "/run/w0.sock"
+    again = broker.Broker(tmp_path / "broker.db", "0:3", "/run/w0.sock", clock=clock)
+    again.register()
+    assert set(two.workers()) == {"1:2", "0:3"}
+    assert two.claim("ws:a") == "/run/w1.sock"
+
+
+def test_rate_limit_is_shared(tmp_path):
+    clock, one, two = _pair(tmp_path)
+    assert one.allow("alice", 1.0)
+    assert not two.allow("alice", 1.0)
+    assert two.allow("bob", 1.0)
+    clock.now += 1
+    assert two.allow("alice", 1.0)
+    assert one.allow("alice", 0)
@@ -0,0 +1,78 @@
+import os
+import sys
+from pathlib import Path
+
+from spirits import completion
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import letsgo  # noqa: E402
+
+
+def _cycle(completer, line, text):
+    found = []
+    while (match := completer.complete(line, text, len(found))) is not None:
+        found.append(match)
+    return found
+
+
+def _bump(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_one_listing_per_cycle_and_per_directory_change(tmp_path, monkeypatch):
+    for name in ("alpha", "alps", "beta", ".hidden"):
+        (tmp_path / name).write_text("")
+    (tmp_path / "almanac").mkdir()
+    scans = []
+    scandir = os.scandir
+
+    def _scandir(path):
+        scans.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(completion.os, "scandir", _scandir)
+    completer = completion.Completer(lambda: [])
+    line = f"/run cat {tmp_path}/al"
+    expected = [f"{tmp_path}/{n}" for n in ("almanac/", "alpha", "alps")]
+    assert _cycle(completer, line, f"{tmp_path}/al") == expected
+    assert _cycle(completer, line, f"{tmp_path}/al") == expected
+    assert len(scans) == 1
+    assert _cycle(completer, f"/run cat {tmp_path}/.", f"{tmp_path}/.") == [
+        f"{tmp_path}/.hidden"
+    ]
+    (tmp_path / "alto").write_text("")
+    _bump(tmp_path)
+    assert f"{tmp_path}/alto" in _cycle(completer, line, f"{tmp_path}/al")
+    assert len(scans) == 2
+
+
+def test_executables_follow_path_changes(tmp_path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, mode in (("letsgo-a", 0o755), ("letsgo-b", 0o755), ("notes", 0o644)):
+        (bin_dir / name).write_text("")
+        (bin_dir / name).chmod(mode)
+    executables = completion.Executables(lambda: str(bin_dir))
+    completer = completion.Completer(lambda: [], executables=executables)
+    assert _cycle(completer, "/run lets", "lets") == ["letsgo-a", "letsgo-b"]
+    assert _cycle(completer, "/run no", "no") == []
+    assert not executables.refresh()
+    (bin_dir / "letsgo-c").write_text("")
+    (bin_dir / "letsgo-c").chmod(0o755)
+    _bump(bin_dir)
+    assert executables.refresh()
+    assert _cycle(completer, "/run letsgo-", "letsgo-")[-1] == "letsgo-c"
+
+
+def test_core_commands_and_their_arguments():
+    completer = letsgo.COMPLETER
+    assert _cycle(completer, "/hi", "/hi") == ["/history"]
+    assert _cycle(completer, "/summarize err --", "--") == ["--history"]
+    assert _cycle(completer, "/summarize --history --", "--") == []
+    assert _cycle(completer, "/history ", "") == ["10", "20", "50", "100"]
+    assert _cycle(completer, "/cpu 1", "1") == ["1h", "1d"]
+    assert _cycle(completer, "/profile s", "s") == ["start", "stop"]
+    assert _cycle(completer, "/profile /run pyth", "pyth")
+    assert _cycle(completer, "/ping ", "") == []
@@ -0,0 +1,99 @@
+import os
+
+from spirits import errorsig
+
+
+def test_signature_drops_paths_numbers_and_names():
+    same = [
+        "cat: /etc/shadow: Permission denied",
+        "cat: /root/.ssh/id_rsa: Permission denied",
+        "cat: 'my notes.txt': Permission denied",
+    ]
+    assert {errorsig.signature(output) for output in same} == {
+        "cat: <arg>: Permission denied"
+    }
+    assert errorsig.signature("kill: (12345) - No such process") == (
+        "kill: (<n>) - No such process"
+    )
+    assert errorsig.signature("sh: 1: frobnicate: not found") == (
+        errorsig.signature("sh: 7: gcc: not found")
+    )
+    # the error line is picked out of the rest of the output
+    traceback = 'Traceback (most recent call last):\n  File "<string>", line 1\n'
+    assert errorsig.signature(traceback + "ZeroDivisionError: division by zero") == (
+        "ZeroDivisionError: division by zero"
+    )
+    assert errorsig.signature(
+        "dd: error writing '/tmp/x': No space left on device\n3+0 records in"
+    ) == (  # noqa: E501
+        "dd: <arg>: No space left on device"
+    )
+    assert errorsig.signature("") == ""
+
+
+def test_log_entries_span_lines():
+    text = (
+        "written before the log had entries\n"
+        "2024-05-01T10:00:00.5 ls /x | код возврата: 2, длительность: 0.01s,"
+        " cpu: 0.00s | ls: cannot access '/x': No such file or directory\n"
+        "2024-05-01T10:00:01 python x.py | код возврата: 1, длительность: 0.10s,"
+        " cpu: 0.05s | Traceback (most recent call last):\n"
+        "KeyError: 'a'\n"
+        "2024-05-01T10:00:02 not an entry of ours\n"
+    )
+    entries = list(errorsig.parse_log(text))
+    assert [(command, rc) for _, command, rc, _ in entries] == [
+        ("ls /x", 2),
+        ("python x.py", 1),
+    ]
+    assert entries[1][3] == "Traceback (most recent call last):\nKeyError: 'a'"
+    assert entries[1][0] - entries[0][0] == 0.5
+
+
+def _entry(command, output):
+    return (
+        f"2024-05-01T10:00:00 {command} | код возврата: 1, длительность: 0.01s,"
+        f" cpu: 0.00s | {output}\n"
+    )
+
+
+def test_index_follows_the_log(tmp_path):
+    log = tmp_path / "errors.log"
+    index = errorsig.SignatureIndex(tmp_path / "errors.db", log)
+    assert index.refresh() == 0
+    log.write_text(_entry("cat /a", "cat: /a: Permission denied"))
+    assert index.refresh() == 1
+    with log.open("a") as fh:
+        fh.write(_entry("cat /b", "cat: /b: Permission denied"))
+        fh.write(_entry("gcc", "sh: gcc: not found"))
+        # not finished yet: counted once the newline is there
+        fh.write(_entry("make", "make: *** No targets. Stop.")[:30])
+    assert index.refresh() == 2
+    assert index.refresh() == 0
+    assert [(sig, count) for sig, count, _, _ in index.report()] == [
+        ("cat: <arg>: Permission denied", 2),
+        ("sh: <arg>: not found", 1),
+    ]
+    # a log that was replaced is read from the start
+    log.unlink()
+    log.write_text(_entry("gcc", "sh: gcc: not found"))
+    assert index.refresh() == 1
+    assert index.count("sh: <arg>: not found") == 2
+    index.close()
+
+
+def test_first_explanation_is_kept(tmp_path):
+    db = tmp_path / "errors.db"
+    index = errorsig.SignatureIndex(db, tmp_path / "errors.log")
+    sig = "sh: <arg>: not found"
+    assert index.explanation(sig) is None
+    index.explain(sig, "install it", "gcc", "sh: gcc: not found")
+    index.explain(sig, "something else")
+    assert index.explanation(sig) == "install it"
+    # explained but never logged: not in the report
+    assert index.report() == []
+    index.close()
+    reopened = errorsig.SignatureIndex(db, tmp_path / "errors.log")
+    assert reopened.explanation(sig) == "install it"
+    reopened.close()
+    assert not os.path.exists(tmp_path / "errors.log")
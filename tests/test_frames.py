@@ -0,0 +1,44 @@
+import pytest
+
+from spirits import frames
+
+
+def test_round_trips():
+    assert frames.decode(frames.encode(frames.OUTPUT, b"abc")) == (
+        frames.OUTPUT,
+        b"abc",
+    )
+    kind, payload = frames.decode(frames.exit_frame(-1))
+    assert kind == frames.EXIT and frames.exit_status(payload) == -1
+    kind, payload = frames.decode(frames.resize_frame(40, 120))
+    assert kind == frames.RESIZE and frames.size(payload) == (40, 120)
+    kind, payload = frames.decode(frames.resumed_frame(3, 7, True))
+    assert kind == frames.RESUMED and frames.resumed(payload) == (3, 7, True)
+
+
+@pytest.mark.parametrize("frame", [b"", b"\x00", b"\x0ax"])
+def test_unknown_frames_are_rejected(frame):
+    with pytest.raises(frames.FrameError):
+        frames.decode(frame)
+
+
+def test_bad_payloads_are_rejected():
+    with pytest.raises(frames.FrameError):
+        frames.size(b"\x00\x01")
+    with pytest.raises(frames.FrameError):
+        frames.size(b"\x00\x00\x00\x50")
+    with pytest.raises(frames.FrameError):
+        frames.exit_status(b"")
+
+
+def test_scrollback_keeps_the_newest_frames_within_its_limit():
+    scrollback = frames.Scrollback(10)
+    for i in range(5):
+        assert scrollback.append(bytes([frames.OUTPUT]) + b"abc") == i
+    assert (scrollback.first, scrollback.next) == (3, 5)
+    assert scrollback.since(4) == (4, [b"\x01abc"])
+    # asking for output already dropped starts at the oldest frame kept
+    assert scrollback.since(0) == (3, [b"\x01abc", b"\x01abc"])
+    assert scrollback.since(9) == (5, [])
+    scrollback.append(b"x" * 50)
+    assert (scrollback.first, scrollback.next) == (5, 6)
@@ -1,6 +1,11 @@
+import fcntl
+import io
+import json
 import os
 import re
+import subprocess
 import sys
+import time
 from pathlib import Path
 import asyncio
 
@@ -9,6 +14,7 @@ from tests.utils import _write_log
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 import letsgo  # noqa: E402
+from spirits import logstore  # noqa: E402
 
 
 def test_status_fields(monkeypatch):
@@ -22,6 +28,108 @@ def test_status_fields(monkeypatch):
     assert lines[2] == "IP: 1.2.3.4"
 
 
+def test_metrics_sampler_caches_network(monkeypatch):
+    calls = []
+
+    def fake_ip() -> str:
+        calls.append(1)
+        return "10.0.0.1"
+
+    monkeypatch.setattr(letsgo, "_first_ip", fake_ip)
+    monkeypatch.setattr(letsgo, "METRICS", letsgo.MetricsSampler(60))
+
+    async def _run() -> list[str]:
+        replies = [(await letsgo.handle_status("/status"))[0]]
+        await letsgo.METRICS.refresh()
+        replies.append((await letsgo.handle_net("/net"))[0])
+        letsgo.METRICS.invalidate_network()
+        await letsgo.METRICS.refresh()
+        return replies
+
+    status, net = asyncio.run(_run())
+    assert status.splitlines()[2] == "IP: 10.0.0.1"
+    assert net.startswith("IP: 10.0.0.1\nGateway: ")
+    assert len(calls) == 2
+
+
+def test_metrics_sampler_runs_in_background(monkeypatch):
+    monkeypatch.setattr(letsgo, "_first_ip", lambda: "10.0.0.2")
+    sampler = letsgo.MetricsSampler(0.01)
+
+    async def _run() -> letsgo.Snapshot | None:
+        sampler.start()
+        await asyncio.sleep(0.2)
+        snap = sampler.snapshot
+        await sampler.stop()
+        return snap
+
+    snap = asyncio.run(_run())
+    assert snap is not None
+    assert snap.ip == "10.0.0.2"
+    assert letsgo.cpu_load(snap).startswith("Load average")
+
+
+def test_cpu_window_renders_sparkline(monkeypatch):
+    trends = letsgo.timeseries.History()
+    for second in range(120):
+        trends.record({"load": second / 10})
+    monkeypatch.setattr(letsgo, "TRENDS", trends)
+    monkeypatch.setattr(letsgo, "METRICS", letsgo.MetricsSampler(60))
+    monkeypatch.setattr(letsgo, "_first_ip", lambda: "10.0.0.1")
+    reply, _ = asyncio.run(letsgo.handle_cpu("/cpu 1m"))
+    first, second = reply.splitlines()
+    assert first.startswith("Load average")
+    assert second.startswith("load 1m: ▁")
+    assert second.endswith("min 6.00 avg 8.95 max 11.90")
+    reply, _ = asyncio.run(letsgo.handle_disk("/disk 1h"))
+    assert reply.splitlines()[1] == "used 1h: no history yet"
+    assert len(asyncio.run(letsgo.handle_cpu("/cpu"))[0].splitlines()) == 1
+
+
+def test_one_session_samples_trends(monkeypatch, tmp_path):
+    monkeypatch.setattr(letsgo, "TRENDS_PATH", tmp_path / "metrics.bin")
+    monkeypatch.setattr(letsgo, "TRENDS_LOCK", tmp_path / "metrics.pid")
+    monkeypatch.setattr(letsgo, "TRENDS", letsgo.timeseries.History())
+    monkeypatch.setattr(letsgo, "TRENDS_SAVE_EVERY", 1)
+    monkeypatch.setattr(letsgo, "trend_sample", lambda *_: {"load": 1.0})
+    # another session samples and saves what it sampled
+    other = open(tmp_path / "metrics.pid", "a+")
+    fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    sampled = letsgo.timeseries.History()
+    sampled.record({"load": 2.0})
+    sampled.save(tmp_path / "metrics.bin")
+
+    async def _run():
+        task = asyncio.create_task(letsgo.record_trends(0.01))
+        await asyncio.sleep(0.1)
+        reader = letsgo.TRENDS.window("load", 300)
+        # it exits: this session takes over
+        other.close()
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return reader
+
+    assert asyncio.run(_run()) == [2.0]
+    points = letsgo.timeseries.History.load(tmp_path / "metrics.bin").window(
+        "load", 300
+    )
+    assert points[0] == 2.0 and len(points) > 2 and set(points[1:]) == {1.0}
+    assert (tmp_path / "metrics.pid").read_text() == f"{os.getpid()}\n"
+
+
+def test_trend_sample_rates(monkeypatch):
+    counters = iter([{"eth0": (1000, 0)}, {"eth0": (3048, 1024)}])
+    monkeypatch.setattr(letsgo, "_net_counters", lambda: next(counters))
+    state: dict = {}
+    first = letsgo.trend_sample(state, 1.0)
+    assert "rx:eth0" not in first
+    second = letsgo.trend_sample(state, 2.0)
+    assert second["rx:eth0"] == 1024
+    assert second["tx:eth0"] == 512
+    assert second["mem"] > 0
+
+
 def test_summarize_no_logs(tmp_path, monkeypatch):
     log_dir = tmp_path / "log"
     monkeypatch.setattr(letsgo, "LOG_DIR", log_dir)
@@ -38,6 +146,15 @@ def test_summarize_term_filter(tmp_path, monkeypatch):
     assert result == "foo\nfoo again"
 
 
+def test_settings_round_trip_keeps_prompt(tmp_path, monkeypatch):
+    monkeypatch.setattr(letsgo.SETTINGS, "prompt", ">> ")
+    path = tmp_path / "config"
+    letsgo._save_settings(path)
+    loaded = letsgo._load_settings(path)
+    assert loaded.prompt == ">> "
+    assert loaded.green == letsgo.SETTINGS.green
+
+
 def test_current_time_format():
     stamp = letsgo.current_time()
     assert re.match(r"^\d{4}-\d{2}-\d{2}T", stamp)
@@ -54,6 +171,9 @@ def test_run_command_mock(monkeypatch):
     """Ensure run_command handles async subprocesses."""
 
     class DummyProcess:
+        stdin = None
+        returncode = 0
+
         def __init__(self):
             self.stdout = asyncio.StreamReader()
             self.stdout.feed_data(b"done\n")
@@ -68,12 +188,10 @@ def test_run_command_mock(monkeypatch):
         async def communicate(self):
             return b"", b""
 
-    async def fake_create_subprocess_shell(cmd, stdout=None, stderr=None):
+    async def fake_spawn(slot, cmd, **kwargs):
         return DummyProcess()
 
-    monkeypatch.setattr(
-        asyncio, "create_subprocess_shell", fake_create_subprocess_shell
-    )
+    monkeypatch.setattr(letsgo.limits, "spawn", fake_spawn)
 
     lines: list[str] = []
 
@@ -86,6 +204,79 @@ def test_run_command_mock(monkeypatch):
     assert lines == ["done"]
 
 
+def _alive(pid: int) -> bool:
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except (FileNotFoundError, IndexError):
+        return False
+    return state != "Z"
+
+
+def _gone(pid: int, timeout: float = 2) -> bool:
+    """Whether ``pid`` exits within ``timeout``: SIGKILL is not instant."""
+    deadline = time.monotonic() + timeout
+    while _alive(pid):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_run_measured_on_a_pty():
+    async def _run():
+        return await letsgo.run_measured(
+            "test -t 1 && printf '\\033[32mtty\\033[0m\\n'", pty=True
+        )
+
+    output, rc, _, _ = asyncio.run(_run())
+    assert (output, rc) == ("tty", 0)
+    assert letsgo.split_tty_flag("-t top -d 1") == ("top -d 1", True)
+    assert letsgo.split_tty_flag("-tx") == ("-tx", False)
+
+
+def test_run_command_timeout_kills_group(tmp_path):
+    pidfile = tmp_path / "pid"
+    cmd = f"sleep 30 & echo $! > {pidfile}; wait"
+    output, rc, duration = asyncio.run(letsgo.run_command(cmd, timeout=0.5))
+    assert output == "command timed out"
+    assert rc == 124
+    assert duration < 10
+    assert _gone(int(pidfile.read_text()))
+
+
+def test_run_command_cancel_kills_group(tmp_path):
+    pidfile = tmp_path / "pid"
+    cmd = f"sleep 30 & echo $! > {pidfile}; wait"
+
+    async def _run() -> None:
+        task = asyncio.create_task(letsgo.run_command(cmd, timeout=30))
+        while not pidfile.exists() or not pidfile.read_text().strip():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert not letsgo._RUNNING
+
+    asyncio.run(_run())
+    assert _gone(int(pidfile.read_text()))
+
+
+def test_top_reports_session_commands(tmp_path, monkeypatch):
+    monkeypatch.setattr(letsgo.memory, "DB_PATH", tmp_path / "memory.db")
+    letsgo.memory._init_db()
+    assert letsgo.top_report() == "no commands recorded"
+    asyncio.run(letsgo.handle_run("/run sleep 0.2"))
+    asyncio.run(letsgo.handle_run("/run true"))
+    reply, _ = asyncio.run(letsgo.handle_top("/top 1"))
+    lines = reply.splitlines()
+    assert lines[0] == "slowest:"
+    assert lines[1].endswith("rc=0  sleep 0.2")
+    assert lines[2] == "heaviest:"
+    assert len(lines) == 4
+
+
 def test_clear_screen_returns_sequence():
     assert letsgo.clear_screen() == "\033c"
 
@@ -110,18 +301,19 @@ def test_show_history(tmp_path, monkeypatch):
     assert letsgo.show_history().splitlines() == ["foo", "bar"]
 
 
-def test_log_cleanup(tmp_path, monkeypatch):
+def test_summarize_reads_compressed_segments(tmp_path, monkeypatch):
     log_dir = tmp_path / "log"
     log_dir.mkdir()
     for i in range(5):
         p = log_dir / f"{i}.log"
-        p.write_text("x")
+        p.write_text(f"entry {i}\n")
         os.utime(p, (i, i))
     monkeypatch.setattr(letsgo, "LOG_DIR", log_dir)
-    monkeypatch.setattr(letsgo.SETTINGS, "max_log_files", 3)
     letsgo._ensure_log_dir()
-    remaining = sorted(f.name for f in log_dir.glob("*.log"))
-    assert remaining == ["2.log", "3.log", "4.log"]
+    assert logstore.compact(log_dir) == (5, 0)
+    assert letsgo.summarize("entry", limit=10).splitlines() == [
+        f"entry {i}" for i in range(5)
+    ]
 
 
 def test_search_history(tmp_path, monkeypatch):
@@ -160,7 +352,7 @@ def test_companion_commands(monkeypatch):
     assert "/deepdive" not in commands
     assert "/deepdiveoff" not in commands
     monkeypatch.setattr(letsgo.memory, "last_real_command", lambda: "ls")
-    monkeypatch.setattr(letsgo.JOHNY, "query", lambda msg: "ok")
+    monkeypatch.setattr(letsgo.JOHNY, "query", lambda msg, context=(): "ok")
     asyncio.run(handlers["/xplaine"]("/xplaine"))
     assert letsgo.COMPANION_ACTIVE == "johny"
     asyncio.run(handlers["/xplaineoff"]("/xplaineoff"))
@@ -174,7 +366,7 @@ def test_xplaine_without_prior_command(monkeypatch):
     letsgo.register_core(commands, handlers)
     monkeypatch.setattr(letsgo.memory, "last_real_command", lambda: "")
 
-    def fake_query(_: str) -> str:  # pragma: no cover
+    def fake_query(_: str, context=()) -> str:  # pragma: no cover
         raise AssertionError("query should not be called")
 
     monkeypatch.setattr(letsgo.JOHNY, "query", fake_query)
@@ -200,13 +392,36 @@ def test_help_ignores_arguments():
     assert output == letsgo.build_help_message()
 
 
-def test_handle_py_executes_code():
+def test_profile_py_writes_profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(letsgo, "PROFILE_DIR", tmp_path)
+    monkeypatch.setattr(letsgo.memory, "DB_PATH", tmp_path / "memory.db")
+    letsgo.memory._init_db()
+    reply, _ = asyncio.run(letsgo.handle_profile("/profile /py print('hi')"))
+    output, note = reply.splitlines()
+    assert output == "hi"
+    assert note.startswith(f"profile: {tmp_path}")
+    assert len(list(tmp_path.glob("*.folded"))) == 2
+
+
+def test_profile_usage():
+    reply, _ = asyncio.run(letsgo.handle_profile("/profile"))
+    assert reply.startswith("Usage: /profile start|stop|dump")
+
+
+def _private_memory(monkeypatch, tmp_path):
+    monkeypatch.setattr(letsgo.memory, "DB_PATH", tmp_path / "memory.db")
+    letsgo.memory._init_db()
+
+
+def test_handle_py_executes_code(monkeypatch, tmp_path):
+    _private_memory(monkeypatch, tmp_path)
     output, colored = asyncio.run(letsgo.handle_py("/py print('hi')"))
     assert output == "hi"
     assert colored == "hi"
 
 
-def test_handle_py_returns_errors():
+def test_handle_py_returns_errors(monkeypatch, tmp_path):
+    _private_memory(monkeypatch, tmp_path)
     output, colored = asyncio.run(letsgo.handle_py("/py 1/0"))
     assert "ZeroDivisionError" in output
     if letsgo.USE_COLOR:
@@ -215,7 +430,8 @@ def test_handle_py_returns_errors():
         assert colored is not None
 
 
-def test_handle_py_timeout(monkeypatch):
+def test_handle_py_timeout(monkeypatch, tmp_path):
+    _private_memory(monkeypatch, tmp_path)
     monkeypatch.setattr(letsgo, "PY_TIMEOUT", 0.1)
     output, colored = asyncio.run(letsgo.handle_py("/py import time; time.sleep(1)"))
     assert "timed out" in output
@@ -223,3 +439,113 @@ def test_handle_py_timeout(monkeypatch):
         assert colored.startswith("\033[31m")
     else:
         assert colored is not None
+
+
+def test_run_script_writes_records_in_order(monkeypatch, tmp_path):
+    _private_memory(monkeypatch, tmp_path)
+    script = [
+        "# provisioning\n",
+        "/run sleep 0.3; echo slow\n",
+        "\n",
+        "/run echo fast\n",
+        "/run exit 3\n",
+        "print(2 + 2)\n",
+        "/ping\n",
+        "/nosuch\n",
+    ]
+    out = io.StringIO()
+    start = time.perf_counter()
+    failed = asyncio.run(letsgo.run_script(script, out, jobs=4))
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(r["line"], r["output"], r["rc"]) for r in records] == [
+        (2, "slow", 0),
+        (4, "fast", 0),
+        (5, "", 3),
+        (6, "4", 0),
+        (7, "pong", 0),
+        (8, "Unknown command: /nosuch. Try /help for guidance.", 127),
+    ]
+    assert failed == 2
+    assert records[1]["duration"] < 0.3 < time.perf_counter() - start
+
+
+def test_script_option_reads_stdin(tmp_path):
+    result = subprocess.run(
+        [sys.executable, "letsgo.py", "--script", "-"],
+        input="/run echo one\n/run false\n",
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).resolve().parents[1],
+        env=dict(
+            os.environ,
+            HOME=str(tmp_path),
+            LETSGO_MEMORY_DB=str(tmp_path / "memory.db"),
+        ),
+        timeout=60,
+    )
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [(r["command"], r["rc"]) for r in records] == [
+        ("/run echo one", 0),
+        ("/run false", 1),
+    ]
+    assert result.returncode == 1
+
+
+def test_recall_command(monkeypatch, tmp_path):
+    monkeypatch.setattr(letsgo.memory, "DB_PATH", tmp_path / "memory.db")
+    letsgo.memory._init_db()
+    letsgo.memory.log("user", "tar xzf backup.tgz")
+    letsgo.memory.log("user", "/recall backup")
+    reply, _ = asyncio.run(letsgo.handle_recall("/recall backup"))
+    assert re.fullmatch(
+        r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d user: tar xzf backup.tgz", reply
+    )
+    assert asyncio.run(letsgo.handle_recall("/recall nothing"))[0] == "nothing found"
+    assert asyncio.run(letsgo.handle_recall("/recall"))[0] == "Usage: /recall <query>"
+
+
+def test_xplaine_sends_past_exchanges(monkeypatch, tmp_path):
+    monkeypatch.setattr(letsgo.memory, "DB_PATH", tmp_path / "memory.db")
+    letsgo.memory._init_db()
+    monkeypatch.setattr(letsgo, "COMPANION_ACTIVE", None)
+    letsgo.memory.log("johny", "gcc is missing: apk add build-base")
+    letsgo.memory.log("user", "gcc main.c")
+    asked = []
+    monkeypatch.setattr(
+        letsgo.JOHNY, "query", lambda msg, context=(): asked.append(context) or "ok"
+    )
+    asyncio.run(letsgo.handle_xplaine("/xplaine"))
+    assert asked == [[("johny", "gcc is missing: apk add build-base")]]
+
+
+def test_xplaine_reuses_explanations_of_known_failures(monkeypatch, tmp_path):
+    log = tmp_path / "errors.log"
+    monkeypatch.setattr(letsgo, "ERROR_LOG_PATH", log)
+    monkeypatch.setattr(
+        letsgo, "ERRORS", letsgo.errorsig.SignatureIndex(tmp_path / "errors.db", log)
+    )
+    monkeypatch.setattr(letsgo.memory, "DB_PATH", tmp_path / "memory.db")
+    letsgo.memory._init_db()
+    monkeypatch.setattr(letsgo, "SESSION_ID", "test")
+    monkeypatch.setattr(letsgo, "COMPANION_ACTIVE", None)
+    asked = []
+    monkeypatch.setattr(
+        letsgo.JOHNY,
+        "query",
+        lambda msg, context=(): asked.append(msg) or f"answer {len(asked)}",
+    )
+
+    async def _run():
+        await letsgo.handle_run("/run cat /nonexistent/a")
+        first = await letsgo.handle_xplaine("/xplaine")
+        await letsgo.handle_run("/run cat /nonexistent/b")
+        second = await letsgo.handle_xplaine("/xplaine")
+        return first[0], second[0]
+
+    assert asyncio.run(_run()) == ("answer 1", "answer 1")
+    assert len(asked) == 1 and "No such file or directory" in asked[0]
+    reply, _ = asyncio.run(letsgo.handle_errors("/errors"))
+    assert re.fullmatch(r" +2 [\d: -]+ \* cat: <arg>: No such file or directory", reply)
+    asyncio.run(letsgo.handle_run("/run true"))
+    assert letsgo.LAST_FAILURE is None
+    letsgo.ERRORS.close()
@@ -0,0 +1,97 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import letsgo  # noqa: E402
+from spirits import limits  # noqa: E402
+
+
+def test_select_backend_falls_back_without_cgroup(tmp_path, monkeypatch):
+    monkeypatch.setattr(limits, "CGROUP_FS", tmp_path)
+    backend = limits.select_backend("cgroup", limits.Limits(), str(tmp_path / "lg"))
+    assert backend.name == "rlimit"
+    assert limits.select_backend("plain", limits.Limits(), "").name == "plain"
+
+
+def test_rlimit_backend_caps_memory(monkeypatch):
+    backend = limits.RlimitBackend(limits.Limits(memory_max=64))
+    monkeypatch.setattr(letsgo, "_BACKEND", backend)
+    cmd = f'{sys.executable} -c "b = bytearray(512 * 1024 * 1024)"'
+    output, rc, _, _ = asyncio.run(letsgo.run_measured(cmd))
+    assert rc != 0
+    assert "MemoryError" in output
+
+
+def test_run_measured_reports_cpu(monkeypatch):
+    monkeypatch.setattr(letsgo, "_BACKEND", limits.Backend(limits.Limits()))
+    cmd = f'{sys.executable} -c "sum(range(3_000_000))"'
+    _, rc, _, usage = asyncio.run(letsgo.run_measured(cmd))
+    assert rc == 0
+    assert usage.cpu > 0
+
+
+def test_cgroup_slot_limits_and_usage(tmp_path, monkeypatch):
+    monkeypatch.setattr(limits, "_STALE", [])
+    leaf = tmp_path / "leaf"
+    slot = limits.CgroupSlot(leaf, limits.Limits(cpu_quota=50, memory_max=64))
+    assert (leaf / "cpu.max").read_text() == "50000 100000"
+    assert (leaf / "memory.max").read_text() == str(64 * 1024**2)
+    assert not (leaf / "pids.max").exists()
+    (leaf / "cpu.stat").write_text(
+        "usage_usec 3000\nuser_usec 2000\nsystem_usec 1000\n"
+    )
+    (leaf / "memory.peak").write_text(str(8 * 1024**2))
+    (leaf / "memory.stat").write_text("anon 1\npgfault 10\npgmajfault 2\n")
+    (leaf / "io.stat").write_text(
+        "8:0 rbytes=100 wbytes=50 rios=1 wios=1\n8:16 rbytes=1 wbytes=2\n"
+    )
+    usage = slot.close()
+    assert usage.cpu_user == 0.002
+    assert usage.cpu_sys == 0.001
+    assert usage.max_rss == 8 * 1024
+    assert (usage.minflt, usage.majflt) == (8, 2)
+    assert (usage.read_bytes, usage.write_bytes) == (101, 52)
+    assert (leaf / "cgroup.kill").read_text() == "1"
+    assert limits._STALE == [leaf]
+
+
+def test_slots_without_limits_need_no_preexec(tmp_path, monkeypatch):
+    assert limits.Backend(limits.Limits()).open(5).preexec is None
+    assert limits.RlimitBackend(limits.Limits()).open(5).preexec is None
+    capped = limits.RlimitBackend(limits.Limits(memory_max=64)).open(5)
+    assert capped.preexec is not None
+    # a leaf that can't be made: rlimits instead of a failing /run
+    backend = limits.CgroupBackend(
+        limits.Limits(memory_max=64), tmp_path / "missing" / "root"
+    )
+    slot = backend.open(5)
+    assert type(slot) is limits.RlimitSlot and slot.preexec is not None
+
+
+def test_cgroup_slot_that_was_not_joined(tmp_path, monkeypatch):
+    monkeypatch.setattr(limits, "_STALE", [])
+    slot = limits.CgroupSlot(tmp_path / "leaf", limits.Limits())
+    # cgroup.procs is not a cgroup file here: joining fails quietly
+    (tmp_path / "leaf" / "cgroup.procs").mkdir()
+    slot.join()
+    (tmp_path / "leaf" / "cpu.stat").write_text("usage_usec 0\nuser_usec 0\n")
+    (tmp_path / "leaf" / "memory.peak").write_text(str(999 * 1024**2))
+    # the empty leaf's figures are not the command's
+    assert slot.close().max_rss != 999 * 1024
+
+
+def test_usage_is_per_command(monkeypatch):
+    monkeypatch.setattr(letsgo, "_BACKEND", limits.Backend(limits.Limits()))
+    burn = f'{sys.executable} -c "b = bytearray(200 * 1024**2); sum(range(10**7))"'
+
+    async def _run():
+        return await asyncio.gather(
+            letsgo.run_measured(burn), letsgo.run_measured("sleep 0.5")
+        )
+
+    (*_, heavy), (*_, idle) = asyncio.run(_run())
+    assert heavy.cpu > 0.1 and heavy.max_rss > 200 * 1024
+    # running alongside it, the sleep is charged nothing of the other's
+    assert idle.cpu < 0.05 and idle.max_rss == 0
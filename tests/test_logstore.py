@@ -0,0 +1,87 @@
+import fcntl
+import os
+
+from spirits import logstore
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rotates_by_size_and_age(tmp_path):
+    clock = _Clock()
+    log = logstore.SegmentedLog(tmp_path, "s1", max_bytes=20, max_age=60, clock=clock)
+    for i in range(5):
+        log.write(f"line {i:04d}\n")  # 10 bytes
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "s1.0001.log",
+        "s1.0002.log",
+        "s1.log",
+    ]
+    clock.now += 61
+    log.write("late\n")
+    assert (tmp_path / "s1.0003.log").read_text() == "line 0004\n"
+    assert (tmp_path / "s1.log").read_text() == "late\n"
+
+
+def test_reads_compressed_segments_in_order(tmp_path):
+    log = logstore.SegmentedLog(tmp_path, "20240101-000000", max_bytes=50)
+    lines = [f"entry {i}" for i in range(40)]
+    for line in lines:
+        log.write(line + "\n")
+    compressed, removed = logstore.compact(tmp_path, [log.path])
+    assert compressed > 5 and removed == 0
+    assert [p.suffix for p in logstore.segments(tmp_path)][-1] == ".log"
+    assert all(p.suffix == logstore.SUFFIX for p in logstore.segments(tmp_path)[:-1])
+    assert list(logstore.iter_lines(tmp_path)) == lines
+
+
+def test_budget_removes_the_oldest_cold_segments(tmp_path):
+    for i in range(4):
+        path = tmp_path / f"old{i}.log"
+        path.write_text(os.urandom(2000).hex())
+        os.utime(path, (i, i))
+    active = tmp_path / "current.log"
+    active.write_text("x" * 5000)
+    os.utime(active, (0, 0))
+    compressed, removed = logstore.compact(tmp_path, [active], budget=10_000)
+    assert compressed == 4 and removed == 2
+    names = sorted(p.name for p in logstore.segments(tmp_path))
+    assert names == [
+        "current.log",
+        f"old2.log{logstore.SUFFIX}",
+        f"old3.log{logstore.SUFFIX}",
+    ]
+
+
+def test_recent_plain_logs_are_left_alone(tmp_path):
+    # another session may still be appending to it
+    (tmp_path / "other.log").write_text("busy\n")
+    assert logstore.compact(tmp_path) == (0, 0)
+    assert list(logstore.iter_lines(tmp_path)) == ["busy"]
+
+
+def test_cold_logs_are_compressed_once_their_process_is_gone(tmp_path):
+    live = tmp_path / f"20240101-000000-{os.getppid()}.log"
+    gone = tmp_path / "20240101-000000-999999999.log"
+    for path in (live, gone):
+        path.write_text("idle\n")
+        os.utime(path, (0, 0))
+    assert logstore.compact(tmp_path) == (1, 0)
+    assert {p.name for p in logstore.segments(tmp_path)} == {
+        f"{gone.name}{logstore.SUFFIX}",
+        live.name,
+    }
+
+
+def test_one_process_compacts_at_a_time(tmp_path):
+    segment = tmp_path / "s1.0001.log"
+    segment.write_text("closed\n")
+    with (tmp_path / logstore.LOCK_NAME).open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert logstore.compact(tmp_path) == (0, 0)
+    assert logstore.compact(tmp_path) == (1, 0)
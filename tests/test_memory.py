@@ -1,3 +1,5 @@
+import sqlite3
+
 from spirits import memory
 
 
@@ -8,3 +10,89 @@ def test_last_real_command_ignores_johny_user(monkeypatch, tmp_path):
     memory.log("user", "ls")
     memory.log("johny_user", "привет, Джонни, как дела?")
     assert memory.last_real_command() == "ls"
+
+
+def test_top_commands_orders_recent_commands(monkeypatch, tmp_path):
+    from spirits.limits import Usage
+
+    monkeypatch.setattr(memory, "DB_PATH", tmp_path / "memory.db")
+    memory._init_db()
+    memory.log_command("a", "sleep 2", 0, 2.0, Usage(cpu_user=0.01))
+    memory.log_command("a", "make", 0, 1.0, Usage(cpu_user=0.8, max_rss=2048))
+    memory.log_command("b", "yes", 1, 9.0, Usage(cpu_user=5.0))
+    slowest = memory.top_commands("duration", session="a")
+    assert [row[2] for row in slowest] == ["sleep 2", "make"]
+    heaviest = memory.top_commands("cpu", limit=1)
+    assert heaviest[0][1:4] == ("b", "yes", 1)
+    assert memory.top_commands("max_rss", session="a", limit=1)[0][2] == "make"
+
+
+def test_recall_follows_events_through_triggers(monkeypatch, tmp_path):
+    db_path = tmp_path / "memory.db"
+    with sqlite3.connect(db_path) as conn:
+        # a database from before the index existed
+        conn.execute("CREATE TABLE events (ts REAL, role TEXT, content TEXT)")
+        conn.execute("INSERT INTO events VALUES (1, 'user', 'pip install numpy')")
+    monkeypatch.setattr(memory, "DB_PATH", db_path)
+    memory._init_db()
+    memory.log("johny", "numpy needs a compiler; try pip install --only-binary")
+    memory.log("user", "apk add py3-numpy")
+    memory.log("user", "numpy numpy numpy")
+    found = memory.recall("pip numpy")
+    assert [row[2] for row in found] == [
+        "pip install numpy",
+        "numpy needs a compiler; try pip install --only-binary",
+    ]
+    assert found[0][:2] == (1.0, "user")
+    assert len(memory.recall("NUMPY")) == 4
+    assert memory.recall("numpy")[0][2] == "numpy numpy numpy"
+    assert [row[2] for row in memory.recall("numpy", roles=("johny",))] == [
+        "numpy needs a compiler; try pip install --only-binary"
+    ]
+    assert memory.recall('"pip" OR') == []
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE events SET content = 'pip list' WHERE ts = 1")
+        conn.execute("DELETE FROM events WHERE content LIKE 'apk%'")
+    assert [row[2] for row in memory.recall("pip")] == [
+        "pip list",
+        "numpy needs a compiler; try pip install --only-binary",
+    ]
+    assert memory.recall("py3") == []
+
+
+def test_context_fits_the_budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(memory, "DB_PATH", tmp_path / "memory.db")
+    memory._init_db()
+    memory.log("johny_user", "The user tried to 'make' and had problems. Explain.")
+    memory.log("johny", "make: install build-base " + "x" * 500)
+    memory.log("johny", "make needs a Makefile")
+    memory.log("user", "make")
+    picked = memory.context("make", 100)
+    assert picked == [
+        ("johny", "make needs a Makefile"),
+        ("johny_user", "The user tried to 'make' and had problems. Explain."),
+    ]
+    assert sum(len(content) for _, content in picked) <= 100
+
+
+def test_recall_over_many_events(monkeypatch, tmp_path):
+    # latency over a large history is measured by benchmarks memory_recall
+    monkeypatch.setattr(memory, "DB_PATH", tmp_path / "memory.db")
+    memory._init_db()
+    count = 20 * memory.RECALL_WINDOW
+    with sqlite3.connect(memory.DB_PATH) as conn:
+        conn.executemany(
+            "INSERT INTO events VALUES (?, 'user', ?)",
+            ((i, f"ls /srv/{i % 1000} pip install pkg{i}") for i in range(count)),
+        )
+    common = memory.recall("pip install")
+    assert [row[0] for row in common] == list(range(count - 1, count - 11, -1))
+    assert all(
+        (role, content) == ("user", f"ls /srv/{ts % 1000:g} pip install pkg{ts:g}")
+        for ts, role, content in common
+    )
+    # an old match outside the newest RECALL_WINDOW is still found
+    assert memory.recall("pkg1234") == [
+        (1234, "user", "ls /srv/234 pip install pkg1234")
+    ]
+    assert memory.recall("pip install", limit=3) == common[:3]
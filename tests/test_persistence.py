@@ -0,0 +1,117 @@
+import asyncio
+import sqlite3
+
+from telegram.ext import PicklePersistence
+
+from spirits.persistence import SQLitePersistence
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "state.db"
+
+    async def _write():
+        store = SQLitePersistence(path)
+        await store.update_user_data(1, {"companion_active": True})
+        await store.update_user_data(2, {"companion_active": False})
+        await store.update_chat_data(10, {"pinned": "x"})
+        await store.update_bot_data({"version": 2})
+        await store.update_conversation("run", (1, 1), 0)
+        await store.update_conversation("run", (2, 2), 0)
+        await store.update_conversation("run", (2, 2), None)
+        await store.drop_user_data(2)
+        await store.flush()
+        store.close()
+
+    async def _read():
+        store = SQLitePersistence(path)
+        return (
+            await store.get_user_data(),
+            await store.get_chat_data(),
+            await store.get_bot_data(),
+            await store.get_callback_data(),
+            await store.get_conversations("run"),
+        )
+
+    asyncio.run(_write())
+    assert asyncio.run(_read()) == (
+        {1: {"companion_active": True}},
+        {10: {"pinned": "x"}},
+        {"version": 2},
+        None,
+        {(1, 1): 0},
+    )
+
+
+def test_updates_gathered_together_share_one_transaction(tmp_path):
+    store = SQLitePersistence(tmp_path / "state.db")
+    batches = []
+    commit = store._commit
+
+    def _commit(writes):
+        writes = list(writes)
+        batches.append(len(writes))
+        commit(writes)
+
+    store._commit = _commit
+
+    async def _run():
+        await asyncio.gather(
+            *(store.update_user_data(uid, {"n": uid}) for uid in range(100))
+        )
+        await asyncio.sleep(0.1)
+        # queued while nothing is being written: a batch of its own
+        await store.update_user_data(5, {"n": -5})
+        await store.flush()
+        return await store.get_user_data()
+
+    users = asyncio.run(_run())
+    assert batches == [100, 1]
+    assert len(users) == 100 and users[5] == {"n": -5}
+
+
+def test_failed_batches_are_kept_for_the_next(tmp_path, caplog):
+    store = SQLitePersistence(tmp_path / "state.db")
+    commit = store._commit
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def _commit(writes):
+        if failures:
+            raise failures.pop()
+        commit(writes)
+
+    store._commit = _commit
+
+    async def _run():
+        data = {"n": 1}
+        await store.update_user_data(1, data)
+        await store.update_user_data(2, {"n": 2})
+        # what was handed over is written, not what the dict became
+        data["n"] = 100
+        await asyncio.sleep(0.1)
+        await store.update_user_data(2, {"n": 3})
+        await store.flush()
+        return await store.get_user_data()
+
+    assert asyncio.run(_run()) == {1: {"n": 1}, 2: {"n": 3}}
+    assert "persisting 2 rows failed" in caplog.text
+
+
+def test_imports_a_pickle_file_once(tmp_path):
+    legacy = tmp_path / "state.pkl"
+
+    async def _legacy():
+        old = PicklePersistence(filepath=legacy)
+        await old.update_user_data(7, {"history": ["/ls"], "companion_active": True})
+        await old.update_bot_data({"seen": 1})
+
+    async def _read(store):
+        return await store.get_user_data(), await store.get_bot_data()
+
+    asyncio.run(_legacy())
+    store = SQLitePersistence(tmp_path / "state.db")
+    assert store.import_pickle(legacy, drop=("history",))
+    assert asyncio.run(_read(store)) == ({7: {"companion_active": True}}, {"seen": 1})
+    assert not store.import_pickle(legacy)
+    assert not SQLitePersistence(tmp_path / "other.db").import_pickle(
+        tmp_path / "missing.pkl"
+    )
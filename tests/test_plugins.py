@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sys
+from importlib.metadata import EntryPoint
+from pathlib import Path
+
+from spirits import plugins
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import letsgo  # noqa: E402
+
+MANIFEST = """
+[[commands]]
+name = "/greet"
+description = "say hello"
+module = "greet_plugin"
+
+[[commands]]
+name = "/broken"
+description = "never loads"
+module = "greet_plugin"
+handler = "missing"
+
+[[commands]]
+name = "/Not Valid"
+module = "greet_plugin"
+"""
+
+PLUGIN = """
+async def handle(user):
+    return "hello " + user.partition(" ")[2]
+"""
+
+
+def _registry(tmp_path, monkeypatch):
+    modules = tmp_path / "modules"
+    modules.mkdir()
+    (modules / "greet.toml").write_text(MANIFEST)
+    (tmp_path / "greet_plugin.py").write_text(PLUGIN)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(plugins.importlib_metadata, "entry_points", lambda group: [])
+    site = tmp_path / "site-packages"
+    site.mkdir()
+    return plugins.Registry(modules, tmp_path / "cache", search_path=[str(site)])
+
+
+def test_plugins_are_imported_on_first_call(tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    commands = registry.load()
+    assert sorted(commands) == ["/broken", "/greet"]
+    handler = plugins.LazyHandler(commands["/greet"])
+    assert "greet_plugin" not in sys.modules
+    assert asyncio.run(handler("/greet you")) == ("hello you", "hello you")
+    assert handler.loaded
+    reply, _ = asyncio.run(plugins.LazyHandler(commands["/broken"])("/broken"))
+    assert reply.startswith("/broken: cannot load greet_plugin.missing")
+    sys.modules.pop("greet_plugin", None)
+
+
+def test_registry_is_cached_until_a_manifest_changes(tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    registry.load()
+    assert registry.scans == 1
+    again = plugins.Registry(
+        registry.directory, tmp_path / "cache", search_path=registry.search_path
+    )
+    assert sorted(again.load()) == ["/broken", "/greet"] and again.scans == 0
+    manifest = registry.directory / "greet.toml"
+    manifest.write_text(MANIFEST.replace("say hello", "say hi"))
+    stat = manifest.stat()
+    os.utime(manifest, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert again.load()["/greet"].description == "say hi" and again.scans == 1
+
+
+def test_entry_points_are_listed(tmp_path, monkeypatch):
+    registry = _registry(tmp_path, monkeypatch)
+    points = [
+        EntryPoint("weather", "letsgo_weather:handle", plugins.GROUP),
+        EntryPoint("Bad-Name", "x:handle", plugins.GROUP),
+    ]
+    monkeypatch.setattr(
+        plugins.importlib_metadata, "entry_points", lambda group: points
+    )
+    command = registry.load()["/weather"]
+    assert (command.module, command.handler) == ("letsgo_weather", "handle")
+    assert "/bad-name" not in registry.load()
+
+
+def test_help_lists_plugins_without_importing_them(monkeypatch):
+    command = plugins.PluginCommand("/weather", "forecast", "letsgo_weather_missing")
+    plugin = {"/weather": (plugins.LazyHandler(command), "forecast")}
+    monkeypatch.setattr(letsgo, "PLUGIN_COMMANDS", plugin)
+    assert letsgo.build_help_message().endswith("/weather - forecast")
+    assert letsgo.command_descriptions()["/weather"] == "forecast"
+    assert not plugin["/weather"][0].loaded
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import time
+
+from spirits import profiler
+
+
+def _busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampler_collects_collapsed_stacks(tmp_path):
+    sampler = profiler.Sampler(interval=0.001)
+    sampler.start()
+    _busy(0.2)
+    sampler.stop()
+    assert sampler.samples > 10
+    path = sampler.dump(tmp_path / "out.folded")
+    lines = path.read_text().splitlines()
+    assert any("_busy (test_profiler.py:" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert ";" in stack and int(count) > 0
+
+
+def test_control_cycle(tmp_path):
+    sampler = profiler.Sampler(interval=0.001)
+    assert profiler.control(sampler, "stop", tmp_path, "t") == "profiler not running"
+    assert profiler.control(sampler, "start", tmp_path, "t") == "profiler started"
+    _busy(0.05)
+    assert profiler.control(sampler, "dump", tmp_path, "t").endswith(".folded")
+    assert sampler.running
+    reply = profiler.control(sampler, "stop", tmp_path, "t")
+    assert not sampler.running
+    # the dump and the stop in the same second both keep their file
+    assert len(list(tmp_path.glob("*-t.folded"))) == 2
+    assert reply.split()[0].isdigit()
+    assert profiler.control(sampler, "bogus", tmp_path, "t").startswith("Usage")
+
+
+def test_profile_paths_are_unique(tmp_path):
+    paths = {profiler.profile_path(tmp_path, "t") for _ in range(100)}
+    assert len(paths) == 100
+    assert all(str(os.getpid()) in path.name for path in paths)
+
+
+def test_script_profiles_snippet(tmp_path):
+    out = tmp_path / "child.folded"
+    code = "import time\nend = time.time() + 0.1\nwhile time.time() < end: pass\n"
+    code += "print('done')"
+    result = subprocess.run(
+        [sys.executable, "-I", profiler.__file__, str(out), code],
+        capture_output=True,
+        text=True,
+    )
+    assert result.stdout.strip() == "done"
+    assert "<module> (<py>:1)" in out.read_text()
@@ -0,0 +1,201 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bridge  # noqa: E402
+
+
+async def _command(scheduler, key, seconds, done):
+    async with scheduler.enter(key):
+        await asyncio.sleep(seconds)
+    done.append(key)
+
+
+def test_light_users_are_not_stuck_behind_a_heavy_one():
+    async def _run():
+        scheduler = bridge.FairScheduler(concurrency=1, queue_size=20)
+        done = []
+        tasks = [
+            asyncio.create_task(_command(scheduler, "telegram:1", 0.05, done))
+            for _ in range(10)
+        ]
+        await asyncio.sleep(0)
+        tasks += [
+            asyncio.create_task(_command(scheduler, f"telegram:{uid}", 0.01, done))
+            for uid in (2, 3, 4)
+        ]
+        await asyncio.gather(*tasks)
+        return done
+
+    done = asyncio.run(_run())
+    assert done[:4] == ["telegram:1", "telegram:2", "telegram:3", "telegram:4"]
+    assert done[4:] == ["telegram:1"] * 9
+
+
+def test_turns_follow_the_weights(monkeypatch):
+    # every turn costs the minimum, so turns split exactly by weight
+    monkeypatch.setattr(bridge, "MIN_TURN_COST", 1.0)
+
+    async def _run():
+        scheduler = bridge.FairScheduler(
+            concurrency=1, queue_size=20, weights={"ws:a": 2.0}
+        )
+        done = []
+        tasks = [
+            asyncio.create_task(_command(scheduler, key, 0, done))
+            for _ in range(10)
+            for key in ("ws:a", "ws:b")
+        ]
+        await asyncio.gather(*tasks)
+        return done
+
+    done = asyncio.run(_run())
+    assert done[:12].count("ws:a") == 8
+
+
+def test_full_queue_is_rejected_and_measured():
+    async def _run():
+        scheduler = bridge.FairScheduler(concurrency=1, queue_size=2)
+        rejected = bridge.SCHED_REJECTED.values.get(("ws",), 0)
+        tickets = [scheduler.enter("ws:x") for _ in range(3)]
+        with pytest.raises(bridge.Busy):
+            scheduler.enter("ws:x")
+        assert bridge.SCHED_REJECTED.values[("ws",)] == rejected + 1
+        assert bridge.SCHED_QUEUED.values[("ws",)] == 2
+        assert bridge.SCHED_RUNNING.values[("ws",)] == 1
+        assert bridge.SCHED_DEEPEST.values[("ws",)] == 2
+        # another user is queued separately
+        other = scheduler.enter("ws:y")
+
+        async def _take(ticket):
+            async with ticket:
+                pass
+
+        await asyncio.gather(*(_take(ticket) for ticket in tickets + [other]))
+        assert bridge.SCHED_QUEUED.values[("ws",)] == 0
+        assert scheduler.depth("ws:x") == 0 and not scheduler._users
+
+    asyncio.run(_run())
+
+
+def test_cancelled_waiters_give_their_place_back():
+    async def _run():
+        scheduler = bridge.FairScheduler(concurrency=1, queue_size=5)
+        first = scheduler.enter("http:a")
+        await first.__aenter__()
+        waiter = asyncio.create_task(_command(scheduler, "http:a", 0, []))
+        await asyncio.sleep(0)
+        assert scheduler.depth("http:a") == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.depth("http:a") == 0
+        await first.__aexit__(None, None, None)
+        assert scheduler._running == 0 and not scheduler._users
+
+    asyncio.run(_run())
+
+
+def test_telegram_flood_gets_busy_replies(monkeypatch, tmp_path):
+    class _Proc:
+        async def run(self, cmd):
+            await asyncio.sleep(0.01)
+            return f"ran {cmd}"
+
+    async def _get_user_proc(user_id):
+        return _Proc()
+
+    class _Bot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_chat_action(self, **kwargs):
+            pass
+
+        async def send_message(self, **kwargs):
+            self.sent.append(kwargs["text"])
+
+    scheduler = bridge.FairScheduler(concurrency=2, queue_size=5)
+    monkeypatch.setattr(bridge, "SCHEDULER", scheduler)
+    monkeypatch.setattr(bridge, "_get_user_proc", _get_user_proc)
+    monkeypatch.setattr(bridge, "HISTORY_ROOT", tmp_path)
+    bot = _Bot()
+
+    def _update(user_id, text):
+        return SimpleNamespace(
+            message=SimpleNamespace(text=text),
+            effective_user=SimpleNamespace(id=user_id),
+            effective_chat=SimpleNamespace(id=user_id),
+        )
+
+    async def _run():
+        context = SimpleNamespace(bot=bot, user_data={})
+        await asyncio.gather(
+            *(bridge.handle_telegram(_update(1, f"/c{i}"), context) for i in range(10)),
+            bridge.handle_telegram(_update(2, "/light"), context),
+        )
+
+    asyncio.run(_run())
+    busy = [text for text in bot.sent if text.startswith("busy:")]
+    assert len(busy) == 4
+    assert "ran /light" in bot.sent
+    assert len([text for text in bot.sent if text.startswith("ran /c")]) == 6
+
+
+def test_telegram_flood_through_the_update_processor(monkeypatch, tmp_path):
+    class _Proc:
+        async def run(self, cmd):
+            await asyncio.sleep(0.01)
+            return f"ran {cmd}"
+
+    async def _get_user_proc(user_id):
+        return _Proc()
+
+    class _Bot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_chat_action(self, **kwargs):
+            pass
+
+        async def send_message(self, **kwargs):
+            self.sent.append(kwargs["text"])
+
+    monkeypatch.setattr(bridge, "SCHEDULER", bridge.FairScheduler(2, 5))
+    monkeypatch.setattr(bridge, "_get_user_proc", _get_user_proc)
+    monkeypatch.setattr(bridge, "HISTORY_ROOT", tmp_path)
+    bot = _Bot()
+    processor = bridge.ChatOrderedProcessor(max_concurrent_updates=8, queue_size=5)
+
+    def _update(user_id, text):
+        return SimpleNamespace(
+            message=SimpleNamespace(text=text),
+            effective_user=SimpleNamespace(id=user_id),
+            effective_chat=SimpleNamespace(id=user_id),
+            get_bot=lambda: bot,
+        )
+
+    async def _run():
+        context = SimpleNamespace(bot=bot, user_data={})
+        updates = [_update(1, f"/c{i}") for i in range(10)] + [_update(2, "/light")]
+        await asyncio.gather(
+            *(
+                processor.process_update(u, bridge.handle_telegram(u, context))
+                for u in updates
+            )
+        )
+
+    asyncio.run(_run())
+    busy = [text for text in bot.sent if text.startswith("busy:")]
+    assert (
+        busy
+        == ["busy: 5 commands already queued, send this again when they finish"] * 4
+    )
+    assert "ran /light" in bot.sent
+    ran = [text for text in bot.sent if text.startswith("ran /c")]
+    assert ran == [f"ran /c{i}" for i in range(6)]
+    assert processor._chats == {}
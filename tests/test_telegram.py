@@ -0,0 +1,178 @@
+import asyncio
+import gzip
+import sys
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from telegram.constants import ParseMode
+from telegram.error import RetryAfter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bridge  # noqa: E402
+
+
+class FakeBot:
+    """The Bot API methods the bridge uses, flood-limited on demand."""
+
+    def __init__(self, floods=0, retry_after=0):
+        self.calls = []
+        self.floods = floods
+        self.retry_after = retry_after
+
+    async def _call(self, method, **kwargs):
+        if self.floods:
+            self.floods -= 1
+            raise RetryAfter(self.retry_after)
+        self.calls.append((method, kwargs))
+
+    async def send_message(self, **kwargs):
+        await self._call("send_message", **kwargs)
+
+    async def send_document(self, **kwargs):
+        await self._call("send_document", **kwargs)
+
+    async def send_chat_action(self, **kwargs):
+        pass
+
+
+def _send(bot, output, markup=None):
+    return asyncio.run(bridge.send_output(bot, 42, output, markup))
+
+
+def test_short_output_goes_inline():
+    bot = FakeBot()
+    markup = bridge.build_main_keyboard()
+    assert _send(bot, "pong", markup) == "inline"
+    [(method, kwargs)] = bot.calls
+    assert method == "send_message"
+    assert kwargs == {"chat_id": 42, "text": "pong", "reply_markup": markup}
+
+
+def test_medium_output_is_one_code_block():
+    bot = FakeBot()
+    output = "a`b\\c\n" * 300
+    assert _send(bot, output) == "block"
+    [(method, kwargs)] = bot.calls
+    assert kwargs["parse_mode"] == ParseMode.MARKDOWN_V2
+    assert kwargs["text"].startswith("```\na\\`b\\\\c\n")
+    assert len(kwargs["text"]) <= bridge.MESSAGE_LIMIT
+
+
+def test_large_output_is_one_gzipped_document():
+    bot = FakeBot()
+    output = "\n".join(f"line {i}" for i in range(20000))
+    assert len(output) > 100_000
+    assert _send(bot, output) == "document"
+    [(method, kwargs)] = bot.calls
+    assert method == "send_document"
+    assert kwargs["filename"] == "output.txt.gz"
+    assert gzip.decompress(kwargs["document"]).decode() == output
+    assert kwargs["caption"] == f"20000 lines, {len(output)} characters"
+
+
+def test_empty_output_is_not_sent():
+    bot = FakeBot()
+    assert _send(bot, " \n") is None
+    assert bot.calls == []
+
+
+@pytest.mark.parametrize("retry_after", [0, timedelta(0)])
+def test_flood_wait_is_retried(retry_after):
+    bot = FakeBot(floods=2, retry_after=retry_after)
+    assert _send(bot, "pong") == "inline"
+    assert len(bot.calls) == 1
+
+
+def test_flood_wait_gives_up_after_the_last_attempt():
+    bot = FakeBot(floods=bridge.SEND_ATTEMPTS)
+    with pytest.raises(RetryAfter):
+        _send(bot, "pong")
+    assert bot.calls == []
+
+
+def test_handlers_deliver_large_replies_as_documents(monkeypatch, tmp_path):
+    class _Proc:
+        async def run(self, cmd):
+            return "x" * 50_000
+
+    async def _get_user_proc(user_id):
+        return _Proc()
+
+    monkeypatch.setattr(bridge, "_get_user_proc", _get_user_proc)
+    monkeypatch.setattr(bridge, "HISTORY_ROOT", tmp_path)
+    bot = FakeBot()
+    update = SimpleNamespace(
+        message=SimpleNamespace(text="/run cat big"),
+        effective_user=SimpleNamespace(id=7),
+        effective_chat=SimpleNamespace(id=7),
+    )
+    context = SimpleNamespace(bot=bot, user_data={})
+    asyncio.run(bridge.handle_telegram(update, context))
+    asyncio.run(bridge.run_execute(update, context))
+    assert [method for method, _ in bot.calls] == ["send_document"] * 2
+
+
+def test_files_sent_again_are_not_downloaded_again(monkeypatch, tmp_path):
+    monkeypatch.setattr(bridge, "UPLOADS", bridge.uploads.UploadStore(tmp_path))
+    downloads = []
+
+    class _File:
+        async def download_to_memory(self, out):
+            downloads.append(1)
+            out.write(b"report")
+
+    async def _get_file():
+        return _File()
+
+    def _update(name):
+        document = SimpleNamespace(
+            file_name=name, file_unique_id="AgADreport", get_file=_get_file
+        )
+        return SimpleNamespace(
+            message=SimpleNamespace(document=document, photo=[]),
+            effective_chat=SimpleNamespace(id=7),
+        )
+
+    bot = FakeBot()
+    context = SimpleNamespace(bot=bot)
+    asyncio.run(bridge.handle_file(_update("report.pdf"), context))
+    asyncio.run(bridge.handle_file(_update("copy.pdf"), context))
+    assert downloads == [1]
+    assert (tmp_path / "copy.pdf").read_bytes() == b"report"
+    assert (tmp_path / "copy.pdf").stat().st_ino == (
+        tmp_path / "report.pdf"
+    ).stat().st_ino
+    asyncio.run(bridge.handle_file(_update(".."), context))
+    assert [kwargs["text"] for _, kwargs in bot.calls] == [
+        "file report.pdf uploaded",
+        "file copy.pdf uploaded",
+        "Error: invalid file name: '..'",
+    ]
+
+
+def test_updates_of_one_chat_keep_their_order():
+    processor = bridge.ChatOrderedProcessor()
+    events = []
+
+    def _update(chat_id):
+        return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+    async def _handle(name, delay):
+        events.append(f"{name} start")
+        await asyncio.sleep(delay)
+        events.append(f"{name} end")
+
+    async def _run():
+        await asyncio.gather(
+            processor.process_update(_update(1), _handle("a1", 0.05)),
+            processor.process_update(_update(1), _handle("a2", 0)),
+            processor.process_update(_update(2), _handle("b1", 0)),
+        )
+
+    asyncio.run(_run())
+    assert events.index("a1 end") < events.index("a2 start")
+    assert events.index("b1 end") < events.index("a1 end")
+    assert processor._chats == {}
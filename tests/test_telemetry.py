@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+
+from spirits import telemetry
+
+
+def _fresh(monkeypatch):
+    monkeypatch.setattr(telemetry, "REGISTRY", {})
+
+
+def test_histogram_renders_cumulative_buckets(monkeypatch):
+    _fresh(monkeypatch)
+    hist = telemetry.Histogram("t_seconds", "test", ("rc",), buckets=(0.1, 1.0))
+    hist.observe(0.05, "0")
+    hist.observe(0.5, "0")
+    hist.observe(5, "0")
+    text = telemetry.render(telemetry.snapshot())
+    assert "# TYPE t_seconds histogram" in text
+    assert 't_seconds_bucket{rc="0",le="0.1"} 1' in text
+    assert 't_seconds_bucket{rc="0",le="1.0"} 2' in text
+    assert 't_seconds_bucket{rc="0",le="+Inf"} 3' in text
+    assert 't_seconds_count{rc="0"} 3' in text
+    assert 't_seconds_sum{rc="0"} 5.55' in text
+
+
+def test_counter_labels_are_escaped(monkeypatch):
+    _fresh(monkeypatch)
+    counter = telemetry.Counter("t_total", "test", ("channel",))
+    counter.inc('we"b')
+    counter.inc('we"b', amount=2)
+    text = telemetry.render(telemetry.snapshot())
+    assert 't_total{channel="we\\"b"} 3.0' in text
+
+
+def test_collect_merges_live_peers(monkeypatch, tmp_path):
+    _fresh(monkeypatch)
+    hist = telemetry.Histogram("t_seconds", "test", buckets=(1.0,))
+    counter = telemetry.Counter("t_total", "test")
+    hist.observe(0.5)
+    counter.inc()
+    peer = telemetry.snapshot()
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(peer))
+    (tmp_path / "999999999.json").write_text(json.dumps(peer))
+    text = telemetry.collect(tmp_path)
+    assert "t_total 2.0" in text
+    assert "t_seconds_count 2" in text
+    assert not (tmp_path / "999999999.json").exists()
+
+
+def test_dump_and_discard(monkeypatch, tmp_path):
+    _fresh(monkeypatch)
+    telemetry.Counter("t_total", "test").inc()
+    telemetry.dump(tmp_path)
+    path = tmp_path / f"{os.getpid()}.json"
+    assert json.loads(path.read_text())["t_total"]["values"] == [[[], 1.0]]
+    telemetry.discard(tmp_path)
+    assert not path.exists()
+
+
+def test_snapshot_while_other_threads_update(monkeypatch):
+    _fresh(monkeypatch)
+    hist = telemetry.Histogram("t_seconds", "test", ("key",))
+    counter = telemetry.Counter("t_total", "test", ("key",))
+    done = threading.Event()
+
+    def _update():
+        for i in range(20000):
+            hist.observe(0.01, str(i))
+            counter.inc(str(i))
+        done.set()
+
+    thread = threading.Thread(target=_update)
+    thread.start()
+    while not done.is_set():
+        telemetry.render(telemetry.snapshot())
+    thread.join()
+    state = telemetry.snapshot()
+    assert len(state["t_total"]["values"]) == 20000
+    assert len(state["t_seconds"]["values"]) == 20000
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from spirits import terminal
+
+
+def test_plain_strips_escapes_and_overdrawn_text():
+    data = b"\x1b[31mred\x1b[0m\r\n10%\r50%\r100%\r\n\x1b]0;title\x07done"
+    assert terminal.plain(data) == "red\n100%\ndone"
+
+
+def test_is_tui():
+    assert terminal.is_tui("/usr/bin/vim notes")
+    assert terminal.is_tui("top")
+    assert not terminal.is_tui("ls -l")
+    assert not terminal.is_tui("")
+
+
+def test_pty_size_resize_and_input():
+    async def _run():
+        term = await terminal.PtyProcess.spawn(
+            "stty size; read x; stty size; echo got:$x", rows=30, cols=100
+        )
+        output = b""
+        while b"30 100" not in output:
+            output += await term.read()
+        term.resize(40, 120)
+        term.write(b"hi\n")
+        while chunk := await term.read():
+            output += chunk
+        rc = await term.wait()
+        term.close()
+        return output, rc
+
+    output, rc = asyncio.run(_run())
+    assert rc == 0
+    assert b"40 120" in output
+    assert b"got:hi" in output
+
+
+def test_pty_terminate_hangs_up_the_group():
+    async def _run():
+        term = await terminal.PtyProcess.spawn("sleep 30 & sleep 30")
+        await term.terminate(grace=1)
+        term.close()
+        return term.proc.returncode
+
+    assert asyncio.run(asyncio.wait_for(_run(), 10)) != 0
+
+
+def _gone(pid, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(f"/proc/{pid}/stat") as fh:
+                if fh.read().rpartition(")")[2].split()[0] == "Z":
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_pty_terminate_kills_jobs_that_ignore_the_hangup(tmp_path):
+    pidfile = tmp_path / "pid"
+
+    async def _run():
+        term = await terminal.PtyProcess.spawn(
+            f"(trap '' HUP; exec sleep 30) & echo $! > {pidfile}; sleep 30"
+        )
+        while not pidfile.exists() or not pidfile.read_text().strip():
+            await asyncio.sleep(0.01)
+        await term.terminate(grace=1)
+        term.close()
+
+    asyncio.run(asyncio.wait_for(_run(), 10))
+    assert _gone(int(pidfile.read_text()))
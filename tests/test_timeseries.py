@@ -0,0 +1,121 @@
+from spirits import timeseries
+
+
+def test_ring_wraps_in_order():
+    ring = timeseries.Ring(3)
+    for value in range(5):
+        ring.append(value)
+    assert ring.values() == [2.0, 3.0, 4.0]
+
+
+def test_series_downsamples_to_minutes():
+    history = timeseries.History()
+    for second in range(180):
+        history.record({"load": float(second // 60)})
+    assert history.window("load", 60) == [float(v // 60) for v in range(120, 180)]
+    assert history.window("load", 3600) == [0.0, 1.0, 2.0]
+    assert history.window("load", 86400 * 7) == []
+    assert history.window("missing", 60) == []
+
+
+def test_history_round_trip(tmp_path):
+    history = timeseries.History()
+    for second in range(400):
+        history.record({"load": second * 0.5, "rx:eth0": 1.0})
+    path = tmp_path / "metrics.bin"
+    history.save(path)
+    loaded = timeseries.History.load(path)
+    assert set(loaded.series) == {"load", "rx:eth0"}
+    assert loaded.window("load", 300) == history.window("load", 300)
+    assert loaded.window("load", 3600) == history.window("load", 3600)
+    assert loaded.series["load"].acc == history.series["load"].acc
+    assert path.stat().st_size < 2 * 24 * 1024
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.bin"]
+
+
+def test_history_load_ignores_garbage(tmp_path):
+    path = tmp_path / "metrics.bin"
+    path.write_bytes(b"nonsense")
+    assert timeseries.History.load(path).series == {}
+    assert timeseries.History.load(tmp_path / "missing").series == {}
+
+
+def test_history_refresh_reads_only_new_points(tmp_path):
+    path = tmp_path / "metrics.bin"
+    written = timeseries.History()
+    for second in range(250):
+        written.record({"load": float(second)})
+    written.save(path)
+    reader = timeseries.History.load(path)
+    for more in (10, 100, 400):
+        for second in range(more):
+            written.record({"load": float(second)})
+        written.save(path)
+        reader.refresh(path)
+        for seconds in (300, 3600, 86400):
+            assert reader.window("load", seconds) == written.window("load", seconds)
+        assert reader.series["load"].acc == written.series["load"].acc
+
+    # slots the reader already has are not read again
+    written.record({"load": 1.0})
+    written.save(path)
+    ring = written.series["load"].rings[0]
+    slot = (ring.pos - 2) % len(ring.data)
+    first = timeseries._HEADER.size + 2 + len("load") + timeseries._RING.size
+    data = bytearray(path.read_bytes())
+    data[first + 8 * slot : first + 8 * slot + 8] = b"\xff" * 8
+    path.write_bytes(bytes(data))
+    reader.refresh(path)
+    assert reader.window("load", 2) == written.window("load", 2)
+
+
+def test_history_refresh_reloads_another_history(tmp_path):
+    path = tmp_path / "metrics.bin"
+    reader = timeseries.History()
+    reader.record({"load": 1.0})
+    other = timeseries.History()
+    other.record({"mem": 2.0})
+    other.save(path)
+    reader.refresh(path)
+    assert set(reader.series) == {"mem"}
+    path.write_bytes(b"nonsense")
+    reader.refresh(path)
+    assert reader.series == {}
+
+
+def test_history_loads_version_1(tmp_path):
+    history = timeseries.History()
+    for second in range(70):
+        history.record({"load": float(second)})
+    path = tmp_path / "metrics.bin"
+    history.save(path)
+    ring = timeseries._RING
+    saved = bytearray(path.read_bytes())
+    # rewrite the file the way version 1 laid it out, without the totals
+    old = bytearray(timeseries._HEADER.pack(timeseries._MAGIC, 1, 1))
+    offset = timeseries._HEADER.size
+    old += saved[offset : offset + 6]
+    offset += 6
+    for _, _, capacity in timeseries.LEVELS:
+        pos, size, _ = ring.unpack_from(saved, offset)
+        offset += ring.size
+        old += timeseries._RING_V1.pack(pos, size)
+        old += saved[offset : offset + 8 * capacity]
+        offset += 8 * capacity
+    old += saved[offset:]
+    path.write_bytes(bytes(old))
+    loaded = timeseries.History.load(path)
+    assert loaded.window("load", 300) == history.window("load", 300)
+    assert [r.total for r in loaded.series["load"].rings] == [70, 1, 0]
+
+
+def test_series_count_is_bounded():
+    history = timeseries.History()
+    history.record({f"s{i}": 1.0 for i in range(timeseries.MAX_SERIES + 5)})
+    assert len(history.series) == timeseries.MAX_SERIES
+
+
+def test_sparkline_scales_and_compresses():
+    assert timeseries.sparkline([0, 1, 2, 3, 4, 5, 6, 7]) == "▁▂▃▄▅▆▇█"
+    assert len(timeseries.sparkline(range(1000), width=40)) == 40
+    assert timeseries.sparkline([]) == ""
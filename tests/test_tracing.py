@@ -0,0 +1,147 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from spirits import tracing
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _trace_to(monkeypatch, path):
+    tracing.close()
+    monkeypatch.setattr(tracing, "TRACE_DIR", path)
+    monkeypatch.setattr(tracing, "ENABLED", True)
+    monkeypatch.setattr(tracing, "SERVICE", "letsgo")
+
+
+def test_spans_nest_and_survive_to_thread(monkeypatch, tmp_path):
+    _trace_to(monkeypatch, tmp_path)
+
+    async def _run():
+        with tracing.span("outer", user=1) as attrs:
+            await asyncio.to_thread(_inner)
+            attrs["rc"] = 0
+
+    def _inner():
+        with tracing.span("inner"):
+            pass
+
+    asyncio.run(_run())
+    tracing.close()
+    spans = {record["name"]: record for record in tracing.load(tmp_path)}
+    assert spans["inner"]["trace_id"] == spans["outer"]["trace_id"]
+    assert spans["inner"]["parent_id"] == spans["outer"]["span_id"]
+    assert spans["outer"]["parent_id"] is None
+    assert spans["outer"]["attrs"] == {"user": 1, "rc": 0}
+    assert tracing.current() is None
+
+
+def test_span_records_errors(monkeypatch, tmp_path):
+    _trace_to(monkeypatch, tmp_path)
+    try:
+        with tracing.span("boom"):
+            raise ValueError("x")
+    except ValueError:
+        pass
+    tracing.close()
+    (record,) = tracing.load(tmp_path)
+    assert record["error"] == "ValueError"
+
+
+def test_inject_extract_round_trip(monkeypatch, tmp_path):
+    _trace_to(monkeypatch, tmp_path)
+    assert tracing.inject("/ping") == "/ping"
+    assert tracing.extract("/ping") == ("/ping", None)
+    with tracing.span("bridge"):
+        line = tracing.inject("/run ls -l")
+        expected = tracing.current()
+    assert line.startswith(tracing.MARKER)
+    assert tracing.extract(line) == ("/run ls -l", expected)
+    tracing.close()
+
+
+def test_parse_rejects_malformed_headers():
+    trace_id, span_id = "ab" * 16, "cd" * 8
+    assert tracing.parse(f"00-{trace_id}-{span_id}-01") == (trace_id, span_id)
+    assert tracing.parse(None) is None
+    assert tracing.parse("00-abc-def-01") is None
+    assert tracing.parse(f"00-{'0' * 32}-{span_id}-01") is None
+    assert tracing.parse(f"00-{'zz' * 16}-{span_id}-01") is None
+
+
+def test_prune_keeps_live_processes_and_the_budget(tmp_path):
+    old = time.time() - tracing.MAX_AGE - 1
+    dead = [tmp_path / f"letsgo-99999999{i}.jsonl" for i in range(3)]
+    live = tmp_path / f"bridge-{os.getppid()}.jsonl"
+    for age, path in enumerate(dead + [live]):
+        path.write_text("x" * 100)
+        os.utime(path, (old + age, old + age))
+    for age, path in enumerate(dead[1:], 1):
+        os.utime(path, (time.time() - 10 + age,) * 2)
+    assert tracing.prune(tmp_path, budget=150) == 2
+    assert sorted(tmp_path.iterdir()) == [live, dead[2]]
+    assert tracing.prune(tmp_path, budget=150) == 0
+
+
+def test_load_reads_recent_files(monkeypatch, tmp_path):
+    _trace_to(monkeypatch, tmp_path)
+    with tracing.span("recent"):
+        pass
+    tracing.close()
+    stale = tmp_path / f"letsgo-{os.getppid()}.jsonl"
+    stale.write_text((tmp_path / f"letsgo-{os.getpid()}.jsonl").read_text())
+    old = time.time() - 2 * 3600
+    os.utime(stale, (old, old))
+    assert len(tracing.load(tmp_path, since=3600)) == 1
+    assert len(tracing.load(tmp_path, since=3 * 3600)) == 2
+
+
+def test_export_otlp_and_report(monkeypatch, tmp_path):
+    _trace_to(monkeypatch, tmp_path)
+    with tracing.span("telegram.message", user=7):
+        with tracing.span("bridge.execute", command="/run"):
+            pass
+    tracing.close()
+    spans = tracing.load(tmp_path)
+    export = tracing.export_otlp(spans)
+    (resource,) = export["resourceSpans"]
+    otlp = resource["scopeSpans"][0]["spans"]
+    assert resource["resource"]["attributes"][0]["value"] == {"stringValue": "letsgo"}
+    child = next(s for s in otlp if s["name"] == "bridge.execute")
+    parent = next(s for s in otlp if s["name"] == "telegram.message")
+    assert child["parentSpanId"] == parent["spanId"]
+    assert "parentSpanId" not in parent
+    assert parent["attributes"] == [{"key": "user", "value": {"intValue": "7"}}]
+    report = tracing.slowest(spans)
+    lines = report.splitlines()
+    assert lines[0] == f"trace {parent['traceId']}"
+    assert "letsgo:telegram.message user=7" in lines[1]
+    assert lines[2].startswith("    +") and "bridge.execute" in lines[2]
+
+
+def test_letsgo_continues_the_callers_trace(tmp_path):
+    trace_id, span_id = "12" * 16, "34" * 8
+    env = dict(
+        os.environ,
+        HOME=str(tmp_path),
+        LETSGO_TRACE_DIR=str(tmp_path / "traces"),
+        LETSGO_MEMORY_DB=str(tmp_path / "memory.db"),
+    )
+    stdin = f"{tracing.MARKER}00-{trace_id}-{span_id}-01 /ping\nexit\n"
+    subprocess.run(
+        [sys.executable, str(ROOT / "letsgo.py"), "--no-color"],
+        input=stdin,
+        capture_output=True,
+        text=True,
+        env=env,
+        cwd=ROOT,
+        timeout=30,
+    )
+    spans = tracing.load(tmp_path / "traces")
+    (dispatch,) = [s for s in spans if s["name"] == "letsgo.dispatch"]
+    assert dispatch["trace_id"] == trace_id
+    assert dispatch["parent_id"] == span_id
+    assert dispatch["attrs"] == {"command": "/ping"}
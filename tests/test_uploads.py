@@ -0,0 +1,104 @@
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from spirits import uploads
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_same_content_is_stored_once(tmp_path):
+    store = uploads.UploadStore(tmp_path)
+    data = os.urandom(3 * uploads.CHUNK + 5)
+    assert store.add(io.BytesIO(data), "a.bin") == (_digest(data), True)
+    assert store.add(io.BytesIO(data), "b.bin") == (_digest(data), False)
+    a, b = tmp_path / "a.bin", tmp_path / "b.bin"
+    assert a.read_bytes() == data
+    assert os.path.samefile(a, b) and os.path.samefile(a, store.blob(_digest(data)))
+    assert a.stat().st_nlink == 3
+    assert store.size(_digest(data)) == len(data)
+    # a new upload under an existing name replaces it
+    assert store.add(io.BytesIO(b"new"), "a.bin")[1]
+    assert a.read_bytes() == b"new" and b.read_bytes() == data
+    assert list(store.tmp_dir.iterdir()) == []
+
+
+def test_racing_uploads_of_the_same_data_share_the_blob(tmp_path, monkeypatch):
+    store = uploads.UploadStore(tmp_path)
+    first, second = store.writer(), store.writer()
+    first.write(b"same")
+    second.write(b"same")
+    link = store.link
+
+    def _racing(digest, name):
+        # the first upload is stored after the second found no blob
+        monkeypatch.setattr(store, "link", link)
+        assert first.commit("a.bin") == (digest, True)
+        raise FileNotFoundError(name)
+
+    monkeypatch.setattr(store, "link", _racing)
+    digest, new = second.commit("b.bin")
+    assert not new
+    blob = store.blob(digest)
+    assert os.path.samefile(tmp_path / "a.bin", blob)
+    assert os.path.samefile(tmp_path / "b.bin", blob)
+    assert blob.stat().st_nlink == 3
+    assert list(store.tmp_dir.iterdir()) == []
+
+
+def test_uploads_are_checked_and_kept_inside(tmp_path):
+    store = uploads.UploadStore(tmp_path)
+    with pytest.raises(uploads.UploadError):
+        store.add(io.BytesIO(b"cut sho"), "x", expected=_digest(b"cut short"))
+    assert not (tmp_path / "x").exists() and list(store.tmp_dir.iterdir()) == []
+    assert uploads.safe_name("../../etc/passwd") == "passwd"
+    assert uploads.safe_name("C:\\temp\\a.txt") == "a.txt"
+    for name in ("", "..", "dir/", uploads.BLOB_DIR, "a\0b"):
+        with pytest.raises(uploads.UploadError):
+            uploads.safe_name(name)
+    with pytest.raises(uploads.UploadError):
+        store.size("../../etc/passwd")
+    with pytest.raises(FileNotFoundError):
+        store.link(_digest(b"never sent"), "y")
+
+
+def test_blobs_written_in_place_are_not_reused(tmp_path):
+    store = uploads.UploadStore(tmp_path)
+    digest, _ = store.add(io.BytesIO(b"original"), "a")
+    # read-only does not stop root, nor anyone who chmods it back; the
+    # pause is for the mtime, which only moves once per clock tick
+    time.sleep(0.02)
+    os.chmod(tmp_path / "a", 0o644)
+    (tmp_path / "a").write_bytes(b"tampered")
+    assert store.size(digest) is None
+    assert store.add(io.BytesIO(b"original"), "b") == (digest, True)
+    assert (tmp_path / "b").read_bytes() == b"original"
+    assert (tmp_path / "a").read_bytes() == b"tampered"
+    assert store.size(digest) == len(b"original")
+
+
+def test_collect_removes_unnamed_blobs(tmp_path):
+    store = uploads.UploadStore(tmp_path)
+    kept, _ = store.add(io.BytesIO(b"kept"), "kept")
+    dropped, _ = store.add(io.BytesIO(b"dropped"), "dropped")
+    store.remember("tg-kept", kept)
+    store.remember("tg-dropped", dropped)
+    (tmp_path / "dropped").unlink()
+    # what an upload cut off by a crash leaves behind
+    leftover = store.tmp_dir / "tmpabandoned"
+    leftover.write_bytes(b"abandoned")
+    assert store.collect() == (0, 0)
+    old = time.time() - uploads.GRACE - 1
+    for path in (store.blob(kept), store.blob(dropped), leftover):
+        os.utime(path, (old, old))
+    assert store.collect() == (2, len(b"dropped") + len(b"abandoned"))
+    assert store.size(kept) == 4 and store.size(dropped) is None
+    assert store.recall("tg-kept") == kept
+    assert store.recall("tg-dropped") is None
+    assert store.recall("../x") is None
+    assert not leftover.exists()
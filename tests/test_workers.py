@@ -0,0 +1,118 @@
+import asyncio
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+import websockets
+
+from spirits import frames
+
+ROOT = Path(__file__).resolve().parents[1]
+TOKEN = "workers"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rows(db, sql):
+    try:
+        with sqlite3.connect(db) as conn:
+            return conn.execute(sql).fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+
+@pytest.fixture
+def bridge(tmp_path):
+    port = _free_port()
+    run_dir = tmp_path / "run"
+    env = dict(
+        os.environ,
+        HOME=str(tmp_path),
+        LETSGO_MEMORY_DB=str(tmp_path / "memory.db"),
+        LETSGO_TELEMETRY_DIR=str(tmp_path / "telemetry"),
+        LETSGO_RUN_DIR=str(run_dir),
+        LETSGO_WORKERS="2",
+        PORT=str(port),
+        API_TOKEN=TOKEN,
+        RATE_LIMIT_SEC="30",
+        TELEGRAM_TOKEN="",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "bridge.py"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while len(_rows(run_dir / "broker.db", "SELECT id FROM workers")) < 2:
+        assert proc.poll() is None and time.monotonic() < deadline
+        time.sleep(0.1)
+    yield port, run_dir
+    proc.send_signal(signal.SIGTERM)
+    proc.wait(timeout=30)
+
+
+async def _pid(connect):
+    """Run ``echo $PPID`` in session ``w``: the pid of the letsgo behind it."""
+    async with connect(f"token={TOKEN}&sid=w") as ws:
+        await ws.send(frames.encode(frames.COMMAND, b"/run echo $PPID"))
+        output = b""
+        while True:
+            kind, payload = frames.decode(await ws.recv())
+            if kind == frames.OUTPUT:
+                output += payload
+            elif kind == frames.EXIT:
+                return next(int(w) for w in output.decode().split() if w.isdigit())
+
+
+def test_sessions_and_rate_limits_span_workers(bridge):
+    port, run_dir = bridge
+
+    def _tcp(query):
+        return websockets.connect(
+            f"ws://127.0.0.1:{port}/ws?{query}", subprotocols=[frames.SUBPROTOCOL]
+        )
+
+    def _via(address):
+        return lambda query: websockets.unix_connect(
+            address, f"ws://worker/ws?{query}", subprotocols=[frames.SUBPROTOCOL]
+        )
+
+    async def _run():
+        first = await _pid(_tcp)
+        [(owner,)] = _rows(
+            run_dir / "broker.db",
+            "SELECT w.address FROM owners o JOIN workers w ON w.id = o.worker",
+        )
+        sockets = [str(run_dir / f"worker-{i}.sock") for i in range(2)]
+        other = next(address for address in sockets if address != owner)
+        # straight to the worker that does not own the session: it relays
+        pids = [await _pid(_via(other)) for _ in range(3)]
+        pids += [await _pid(_tcp) for _ in range(4)]
+        return first, pids, sockets
+
+    first, pids, sockets = asyncio.run(_run())
+    assert pids == [first] * len(pids)
+
+    replies = []
+    for address in sockets:
+        transport = httpx.HTTPTransport(uds=address)
+        with httpx.Client(transport=transport, base_url="http://worker") as client:
+            replies.append(
+                client.post(
+                    "/run", params={"cmd": "/ping"}, auth=("alice", TOKEN)
+                ).status_code
+            )
+    assert replies == [200, 429]